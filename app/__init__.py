@@ -1,15 +1,38 @@
 # app/__init__.py
 import os
 from flask import Flask
-from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
+
+from app.api.cache import TTLCache
+from app.api.compression import Compressor
+from app.api.consistency import WriteMarker
+from app.api.events import EventBroker
+from app.api.hashing import PasswordHasher
+from app.api.metrics import Metrics
+from app.api.pool import get_engine_options
+from app.api.profiling import Profiler
+from app.api.ratelimit import RateLimiter
+from app.api.revocation import TokenDenylist
+from app.api.routing import RoutingSQLAlchemy, get_replica_binds
+from app.api.search import SearchIndex
+from app.api.serialization import JSONEncoder, set_backend
 
 # instantiate the extensions
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
-bcrypt = Bcrypt()
+hasher = PasswordHasher()
+token_cache = TTLCache('AUTH_TOKEN_CACHE')
+denylist = TokenDenylist()
+user_cache = TTLCache('USER_CACHE')
+recent_writes = TTLCache('READ_YOUR_WRITES')
+write_marker = WriteMarker()
+limiter = RateLimiter()
+search_index = SearchIndex()
+user_events = EventBroker()
+metrics = Metrics()
+compressor = Compressor()
+profiler = Profiler()
 
 
 def create_app():
@@ -21,10 +44,24 @@ def create_app():
     # set config
     app_settings = os.getenv('APP_SETTINGS')
     app.config.from_object(app_settings)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', get_engine_options(app.config))
+    app.config.setdefault('SQLALCHEMY_BINDS', get_replica_binds(app.config))
+
+    # set up JSON serialisation
+    app.json_encoder = JSONEncoder
+    set_backend(app.config.get('JSON_BACKEND', 'auto'))
 
     # set up extensions
     db.init_app(app)
-    bcrypt.init_app(app)
+    hasher.init_app(app)
+    token_cache.init_app(app)
+    denylist.init_app(app)
+    user_cache.init_app(app)
+    recent_writes.init_app(app)
+    write_marker.init_app(app)
+    limiter.init_app(app)
+    search_index.init_app(app)
+    user_events.init_app(app)
     migrate.init_app(app, db)
 
     # register blueprints
@@ -33,4 +70,13 @@ def create_app():
     from app.api.views.auth import auth_blueprint
     app.register_blueprint(auth_blueprint)
 
+    # compress responses, after every other after_request hook ran
+    compressor.init_app(app)
+
+    # profile on demand, around everything else the request runs
+    profiler.init_app(app)
+
+    # record metrics, served at /metrics
+    metrics.init_app(app)
+
     return app
@@ -0,0 +1,399 @@
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy.orm.exc import NoResultFound
+from werkzeug.exceptions import RequestEntityTooLarge
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from app import hasher, limiter, user_cache, user_events, write_marker
+from app.api.caching import cache_headers, make_etag, match_etag
+from app.api.consistency import WRITE_MARKER_HEADER
+from app.api.hashing import HashingPoolSaturated
+from app.api.metrics import REQUEST_LATENCY, REQUESTS, REQUESTS_IN_FLIGHT
+from app.api.models import User, listen_user_events
+from app.api.ratelimit import get_client_ip, get_identities
+from app.api.validation import check_payload_size, validate_login
+from app.api.serialization import dumps
+
+
+def _dsn(uri):
+    """Turns an SQLAlchemy database URI into a DSN asyncpg accepts"""
+    return 'postgresql://' + uri.split('://', 1)[1]
+
+
+class AsyncUserReader:
+    """Reads users with asyncpg, from the read replicas first like User._read"""
+
+    def __init__(self, config):
+        self.config = config
+        self.primary = _dsn(config.get('SQLALCHEMY_DATABASE_URI'))
+        self.replicas = [_dsn(url) for url in config.get('DATABASE_REPLICA_URLS') or []]
+        self._counter = itertools.count()
+        self._pools = {}
+
+    async def _pool(self, dsn):
+        # pools are created on first use, the task being shared by the requests waiting for it
+        if dsn not in self._pools:
+            server_settings = {}
+            if self.config.get('DATABASE_STATEMENT_TIMEOUT_MS'):
+                server_settings['statement_timeout'] = str(self.config.get('DATABASE_STATEMENT_TIMEOUT_MS'))
+            self._pools[dsn] = asyncio.ensure_future(asyncpg.create_pool(
+                dsn,
+                min_size=1,
+                max_size=self.config.get('DATABASE_POOL_SIZE') + self.config.get('DATABASE_MAX_OVERFLOW'),
+                # PgBouncer in transaction mode cannot keep prepared statements
+                statement_cache_size=0 if self.config.get('DATABASE_PGBOUNCER') else 100,
+                server_settings=server_settings
+            ))
+        task = self._pools[dsn]
+        try:
+            return await task
+        except Exception:
+            # let the next request try again rather than fail the same way until the worker restarts
+            if self._pools.get(dsn) is task:
+                del self._pools[dsn]
+            raise
+
+    async def fetchrow(self, query, *args, written_key=None):
+        """Runs query on a replica, or on the primary for recently written users, clients that just wrote and,
+        with DATABASE_REPLICA_RETRY_MISSES, replica misses
+        """
+        if self.replicas and (written_key is None or not User.recently_written(written_key)):
+            pool = await self._pool(self.replicas[next(self._counter) % len(self.replicas)])
+            row = await pool.fetchrow(query, *args)
+            if row is not None or written_key is None or not self.config.get('DATABASE_REPLICA_RETRY_MISSES'):
+                return row
+        pool = await self._pool(self.primary)
+        return await pool.fetchrow(query, *args)
+
+    async def close(self):
+        pools, self._pools = self._pools, {}
+        for task in pools.values():
+            try:
+                pool = await task
+            except Exception:
+                continue
+            await pool.close()
+
+
+class AsyncApp:
+    """ASGI application serving the hottest routes asynchronously, and the others through the Flask app
+
+    GET /ping, GET /users/<uid>, GET /auth/status and POST /auth/login answer exactly like their Flask views,
+    login being rate limited and shed by the same limiter. GET /users/events streams without holding a thread.
+    On Postgres, with asyncpg installed, users are read without holding a thread; otherwise the Flask code
+    runs on a thread pool of ASGI_EXECUTOR_WORKERS threads. Passwords are always checked on that pool.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.user_by_id = 'SELECT {}, updated_at FROM {} WHERE id = $1'.format(
+            ', '.join(User.DATA_FIELDS), User.__tablename__
+        )
+        self.user_by_email = 'SELECT id, password FROM {} WHERE lower(email) = $1'.format(
+            User.__tablename__
+        )
+        self.routes = [
+            ('GET', re.compile(r'/ping$'), '/ping', self.ping),
+            # numeric ids only, /users/search and invalid ids being left to the Flask app
+            ('GET', re.compile(r'/users/([0-9]+)$'), '/users/<uid>', self.get_user),
+            ('GET', re.compile(r'/auth/status$'), '/auth/status', self.user_status),
+            ('POST', re.compile(r'/auth/login$'), '/auth/login', self.login_user)
+        ]
+        self._lock = threading.Lock()
+        self._executor = None
+        self._reader = None
+        self._pid = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http':
+            if scope['method'] == 'GET' and scope['path'] == '/users/events':
+                return await self.stream_events(scope, receive, send)
+            for method, pattern, rule, view in self.routes:
+                match = pattern.match(scope['path'])
+                if match and scope['method'] == method:
+                    return await self.dispatch(scope, receive, send, rule, view, match.groups())
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, scope, receive, send, rule, view, args):
+        started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+        headers = {}
+        self._use_write_marker(scope)
+        try:
+            response_object, status, *view_headers = await view(scope, receive, *args)
+            headers.update(*view_headers)
+        except HashingPoolSaturated:
+            response_object, status = {'status': 'error', 'message': 'Service busy, please try again.'}, 503
+            headers['retry-after'] = '1'
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+        body = b''
+        if status != 304:
+            body = dumps(response_object).encode()
+            headers['content-type'] = 'application/json'
+            headers['content-length'] = str(len(body))
+        if self._header(scope, b'origin') is not None:
+            headers['access-control-allow-origin'] = '*'
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+        REQUEST_LATENCY.labels(scope['method'], rule).observe(time.perf_counter() - started)
+        REQUESTS.labels(scope['method'], rule, status).inc()
+
+    def _use_write_marker(self, scope):
+        """Sends the lookups of a client that just wrote, through any worker, to the primary, see WriteMarker"""
+        cookies = SimpleCookie(self._header(scope, b'cookie') or '')
+        with self.flask_app.app_context():
+            name = self.flask_app.config.get('READ_YOUR_WRITES_COOKIE')
+            if name in cookies:
+                marker = cookies[name].value
+            else:
+                marker = self._header(scope, WRITE_MARKER_HEADER.lower().encode())
+            write_marker.use(marker)
+
+    @staticmethod
+    def _header(scope, name):
+        for key, value in scope['headers']:
+            if key.lower() == name:
+                return value.decode('latin-1')
+        return None
+
+    @staticmethod
+    async def _read_body(receive):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                return body
+
+    async def ping(self, scope, receive):
+        return {'status': 'success', 'message': 'pong!'}, 200
+
+    async def get_user(self, scope, receive, uid):
+        user, etag = await self.get_by_id_with_etag(uid)
+        if not user:
+            return {'status': 'fail', 'message': 'User not found.'}, 404
+        matched = match_etag(self._header(scope, b'if-none-match'), etag)
+        with self.flask_app.app_context():
+            if matched is not None:
+                return None, 304, cache_headers(matched)
+            headers = cache_headers(etag)
+        return {'status': 'success', 'data': user}, 200, headers
+
+    async def user_status(self, scope, receive):
+        token = User.get_token_from_authorization_header(self._header(scope, b'authorization'))
+        # the denylist may ask its store about the token, which must not block the event loop
+        subject = await self.run_sync(User.decode_auth_token, token)
+        if isinstance(subject, str):
+            return {'status': 'error', 'message': subject}, 401
+        user, _ = await self.get_by_id_with_etag(subject)
+        return {'status': 'success', 'data': user}, 200
+
+    async def login_user(self, scope, receive):
+        body = await self._read_body(receive)
+        payload = None
+        if 'json' in (self._header(scope, b'content-type') or ''):
+            try:
+                payload = json.loads(body.decode())
+            except ValueError:
+                pass
+        with self.flask_app.app_context():
+            client_ip = get_client_ip(
+                (scope.get('client') or ('',))[0], self._header(scope, b'x-forwarded-for'),
+                self.flask_app.config.get('RATELIMIT_PROXY_COUNT')
+            )
+            rejected = limiter.limit(client_ip, get_identities(payload, ('email',)))
+        if rejected is not None:
+            return rejected
+        try:
+            with self.flask_app.app_context():
+                check_payload_size(len(body))
+            tokens = await self.login(**validate_login(payload))
+        except RequestEntityTooLarge:
+            return {'status': 'fail', 'message': 'Payload too large.'}, 413
+        except NoResultFound:
+            return {'status': 'error', 'message': 'Invalid username or password.'}, 404
+        except (TypeError, ValueError):
+            return {'status': 'error', 'message': 'Invalid payload.'}, 400
+        finally:
+            limiter.release()
+        return {
+            'status': 'success',
+            'message': 'Successfully logged in.',
+            'token': tokens[0],
+            'refresh_token': tokens[1]
+        }, 200
+
+    async def stream_events(self, scope, receive, send):
+        """Streams user events like the Flask view, waiting for them on the event loop"""
+        loop = asyncio.get_running_loop()
+        published = asyncio.Event()
+
+        def wake():
+            loop.call_soon_threadsafe(published.set)
+        user_events.subscribe(wake)
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            with self.flask_app.app_context():
+                listen_user_events()
+            heartbeat = self.flask_app.config.get('USERS_EVENTS_HEARTBEAT_SECONDS')
+            last_event_id = (
+                self._header(scope, b'last-event-id')
+                or parse_qs(scope['query_string'].decode('latin-1')).get('last_event_id', [None])[0]
+            )
+            headers = [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]
+            if self._header(scope, b'origin') is not None:
+                headers.append((b'access-control-allow-origin', b'*'))
+            await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+            messages, last_event_id = user_events.start(last_event_id)
+            events = user_events.events_after(last_event_id)
+            while not disconnected.done():
+                next_messages, last_event_id = user_events.next_messages(last_event_id, events)
+                messages += next_messages
+                body = ''.join(messages or [': keep-alive\n\n']).encode()
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+                messages = []
+                published.clear()
+                if user_events.last_event_id == last_event_id:
+                    waiter = asyncio.ensure_future(published.wait())
+                    await asyncio.wait({waiter, disconnected}, timeout=heartbeat, return_when=asyncio.FIRST_COMPLETED)
+                    waiter.cancel()
+                events = user_events.events_after(last_event_id)
+        finally:
+            user_events.unsubscribe(wake)
+            disconnected.cancel()
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def get_by_id_with_etag(self, user_id):
+        """Async User.get_by_id_with_etag"""
+        reader = self._get_reader()
+        if reader is None:
+            return await self.run_sync(User.get_by_id_with_etag, user_id)
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None, None
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            return dict(cached[0]), cached[1]
+        try:
+            row = await reader.fetchrow(self.user_by_id, user_id, written_key=('id', user_id))
+        except asyncpg.DataError:
+            return None, None
+        if row is None:
+            return None, None
+        data = User.row_to_data(tuple(row))
+        etag = make_etag(user_id, row['updated_at'])
+        user_cache.set(user_id, (data, etag))
+        return dict(data), etag
+
+    async def login(self, email, password):
+        """Async User.login
+        :raises NoResultFound: if the credentials are wrong
+        :return: (auth token, refresh token) tuple
+        """
+        reader = self._get_reader()
+        if reader is None:
+            return await self.run_sync(self._login, email, password)
+        if not email or not password or not isinstance(email, str):
+            raise ValueError
+        row = await reader.fetchrow(self.user_by_email, email.lower(), written_key=('email', email.lower()))
+        if row is None or not await self.run_sync(hasher.check_password_hash, row['password'], password):
+            raise NoResultFound
+        with self.flask_app.app_context():
+            rehash = hasher.needs_rehash(row['password'], self.flask_app.config.get('BCRYPT_LOG_ROUNDS'))
+        if rehash:
+            await self.run_sync(User.upgrade_password_hash, row['id'], password)
+        with self.flask_app.app_context():
+            return self._encode_tokens(row['id'])
+
+    @staticmethod
+    def _login(email, password):
+        return AsyncApp._encode_tokens(User.login(email, password).id)
+
+    @staticmethod
+    def _encode_tokens(user_id):
+        return tuple(token.decode() for token in User.encode_auth_tokens(user_id))
+
+    async def run_sync(self, func, *args):
+        """Runs func in the Flask app context, on the thread pool"""
+        # in the context of the request, marked by _use_write_marker
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._get_executor(), context.run, self._call, func, args
+        )
+
+    def _call(self, func, args):
+        with self.flask_app.app_context():
+            return func(*args)
+
+    def _get_executor(self):
+        with self._lock:
+            self._check_pid()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.flask_app.config.get('ASGI_EXECUTOR_WORKERS'))
+            return self._executor
+
+    def _get_reader(self):
+        with self._lock:
+            self._check_pid()
+            uri = self.flask_app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+            if self._reader is None and asyncpg is not None and uri.startswith('postgres'):
+                self._reader = AsyncUserReader(self.flask_app.config)
+            return self._reader
+
+    def _check_pid(self):
+        # a forked worker cannot reuse its parent's threads and connections
+        if self._pid != os.getpid():
+            self._executor = None
+            self._reader = None
+            self._pid = os.getpid()
+
+    async def shutdown(self):
+        if self._reader is not None:
+            await self._reader.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._reader = None
+        self._executor = None
+
+
+def create_asgi_app(flask_app):
+    """Wraps the Flask app into an ASGI application"""
+    return AsyncApp(flask_app)
@@ -0,0 +1,57 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread safe LRU cache whose entries expire after a time to live
+
+    Sized by the {config_prefix}_SIZE setting, entries live {config_prefix}_TTL_SECONDS
+    unless a ttl is given when setting them. A size of 0 disables the cache.
+    """
+
+    def __init__(self, config_prefix, maxsize=1024, ttl=60, app=None):
+        self.config_prefix = config_prefix
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config.get(self.config_prefix + '_SIZE', self.maxsize)
+        self.ttl = app.config.get(self.config_prefix + '_TTL_SECONDS', self.ttl)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._entries[key]
+            except KeyError:
+                return default
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
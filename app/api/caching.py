@@ -0,0 +1,53 @@
+import hashlib
+
+from flask import current_app, request
+
+
+def make_etag(*parts):
+    """Builds a strong entity tag, unquoted, from the values identifying a representation"""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def match_etag(if_none_match, etag):
+    """Finds the representation of etag an If-None-Match header lists, comparing weakly as RFC 7232 requires for it
+    :return: the unquoted entity tag matched, with the encoding suffix of a compressed representation, None if none is
+    """
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == '*':
+        return etag
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        # compressed representations are tagged with their encoding as suffix
+        if tag == etag or tag.rsplit('-', 1)[0] == etag:
+            return tag
+    return None
+
+
+def etag_matches(if_none_match, etag):
+    """Tells whether an If-None-Match header lists etag, see match_etag"""
+    return match_etag(if_none_match, etag) is not None
+
+
+def cache_headers(etag, vary=None):
+    """Headers letting clients and shared caches revalidate a representation with its ETag"""
+    headers = {
+        'ETag': '"{}"'.format(etag),
+        'Cache-Control': current_app.config.get('USERS_CACHE_CONTROL')
+    }
+    if vary:
+        headers['Vary'] = vary
+    return headers
+
+
+def not_modified(etag, vary=None):
+    """Returns a 304 response when the request's If-None-Match matches etag, None otherwise
+    The 304 carries the ETag of the representation matched, so that caches holding a compressed one can freshen it.
+    """
+    matched = match_etag(request.headers.get('If-None-Match'), etag)
+    if matched is not None:
+        return current_app.response_class(status=304, headers=cache_headers(matched, vary))
+    return None
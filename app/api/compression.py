@@ -0,0 +1,113 @@
+import zlib
+
+from flask import current_app, request
+
+from app.api.cache import TTLCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/plain')
+
+
+class _GzipCompressor:
+    def __init__(self, level):
+        # wbits=31: gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def process(self, data):
+        return self._compressor.process(data)
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class Compressor:
+    """Compresses responses with brotli or gzip, as negotiated from Accept-Encoding
+
+    Responses smaller than COMPRESS_MIN_SIZE bytes are sent as they are, streamed ones are compressed
+    on the fly. Compressed bodies of responses with an ETag are cached by ETag and encoding, a strong
+    ETag standing for the exact same bytes; their ETag gets the encoding as suffix.
+    """
+
+    def __init__(self, app=None):
+        self.cache = TTLCache('COMPRESS_CACHE', maxsize=256, ttl=300)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+        self.cache.init_app(app)
+        app.after_request(self._after_request)
+
+    @staticmethod
+    def _encodings():
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def _create_compressor(self, encoding):
+        if encoding == 'br':
+            return _BrotliCompressor(current_app.config.get('COMPRESS_BROTLI_QUALITY'))
+        return _GzipCompressor(current_app.config.get('COMPRESS_GZIP_LEVEL'))
+
+    def compress(self, data, encoding):
+        compressor = self._create_compressor(encoding)
+        return compressor.process(data) + compressor.finish()
+
+    def _compress_stream(self, chunks, encoding):
+        compressor = self._create_compressor(encoding)
+        try:
+            for chunk in chunks:
+                compressed = compressor.process(chunk if isinstance(chunk, bytes) else chunk.encode())
+                if compressed:
+                    yield compressed
+            yield compressor.finish()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def _after_request(self, response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough:
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.status_code != 200 or 'Content-Encoding' in response.headers:
+            return response
+        encoding = request.accept_encodings.best_match(self._encodings())
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = self._compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+            etag, weak = response.get_etag()
+            if etag is not None:
+                response.set_etag('{}-{}'.format(etag, encoding), weak)
+        else:
+            data = response.get_data()
+            if len(data) < current_app.config.get('COMPRESS_MIN_SIZE'):
+                return response
+            etag, weak = response.get_etag()
+            if etag is None:
+                response.set_data(self.compress(data, encoding))
+            else:
+                compressed = self.cache.get((etag, encoding))
+                if compressed is None:
+                    compressed = self.compress(data, encoding)
+                    self.cache.set((etag, encoding), compressed)
+                response.set_data(compressed)
+                response.set_etag('{}-{}'.format(etag, encoding), weak)
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,73 @@
+import contextvars
+
+from flask import current_app, has_request_context, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+WRITE_MARKER_HEADER = 'X-Last-Write'
+
+
+class WriteMarker:
+    """Tells every worker which clients just wrote, so that they read their own writes
+
+    recent_writes only knows the writes of its own process, while the next request of a client may reach any worker.
+    Responses to writes carry a signed marker, as the READ_YOUR_WRITES_COOKIE cookie and the X-Last-Write header,
+    which the client sends back: its lookups then go to the primary until the marker is READ_YOUR_WRITES_TTL_SECONDS
+    old.
+    """
+
+    def __init__(self, app=None):
+        # set for the requests the Flask app doesn't serve itself, e.g. those of the ASGI app
+        self._marked = contextvars.ContextVar('write_marked', default=False)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('READ_YOUR_WRITES_COOKIE', 'last_write')
+        app.config.setdefault('READ_YOUR_WRITES_TTL_SECONDS', 5)
+        app.after_request(self._set_marker)
+
+    @staticmethod
+    def _serializer():
+        return URLSafeTimedSerializer(current_app.config.get('SECRET_KEY'), salt='read-your-writes')
+
+    def mark(self):
+        """Marks the client of the current request, if any, as having just written"""
+        if has_request_context():
+            request.environ['app.wrote'] = True
+
+    def check(self, marker):
+        """Tells if marker was signed by this app less than READ_YOUR_WRITES_TTL_SECONDS ago"""
+        if not marker:
+            return False
+        try:
+            self._serializer().loads(marker, max_age=current_app.config.get('READ_YOUR_WRITES_TTL_SECONDS'))
+        except BadSignature:
+            return False
+        return True
+
+    def use(self, marker):
+        """Marks the current context, e.g. an ASGI request, as that of a client that just wrote if marker is valid"""
+        self._marked.set(self.check(marker))
+
+    def is_marked(self):
+        """Tells if the client of the current request just wrote, its lookups having to go to the primary"""
+        if self._marked.get():
+            return True
+        if not has_request_context():
+            return False
+        if 'app.write_marked' not in request.environ:
+            request.environ['app.write_marked'] = self.check(
+                request.cookies.get(current_app.config.get('READ_YOUR_WRITES_COOKIE'))
+                or request.headers.get(WRITE_MARKER_HEADER)
+            )
+        return request.environ['app.write_marked']
+
+    def _set_marker(self, response):
+        if request.environ.get('app.wrote'):
+            marker = self._serializer().dumps(True)
+            response.set_cookie(
+                current_app.config.get('READ_YOUR_WRITES_COOKIE'), marker,
+                max_age=current_app.config.get('READ_YOUR_WRITES_TTL_SECONDS'), httponly=True, samesite='Lax'
+            )
+            response.headers[WRITE_MARKER_HEADER] = marker
+        return response
@@ -0,0 +1,251 @@
+import collections
+import json
+import os
+import select
+import threading
+import time
+import uuid
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from app.api.serialization import dumps
+
+# Postgres refuses NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_SIZE = 7900
+
+
+def format_event(event_id, event, data):
+    """Formats an event as a Server-Sent Events message"""
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event_id, event, data)
+
+
+def notify_payloads(messages):
+    """Groups JSON messages into JSON lists of at most NOTIFY_PAYLOAD_SIZE bytes, one NOTIFY payload each"""
+    payloads, chunk, size = [], [], 2
+    for message in messages:
+        length = len(message.encode()) + 1
+        if chunk and size + length > NOTIFY_PAYLOAD_SIZE:
+            payloads.append('[{}]'.format(','.join(chunk)))
+            chunk, size = [], 2
+        chunk.append(message)
+        size += length
+    if chunk:
+        payloads.append('[{}]'.format(','.join(chunk)))
+    return payloads
+
+
+class EventBroker:
+    """Recent user events, kept in a ring buffer of USERS_EVENTS_BUFFER_SIZE events for clients to resume from
+
+    Events are published once their transaction commits. On Postgres, writes NOTIFY the USERS_EVENTS_CHANNEL
+    channel instead, and every process LISTENs to it, so that clients see the writes of all workers.
+    Event ids are only known to the process that assigned them: a client resuming from an id this process
+    doesn't know, or one that left the buffer, gets a reset event telling it to reload the users.
+    """
+
+    def __init__(self, app=None):
+        self._condition = threading.Condition()
+        self._events = collections.deque(maxlen=1000)
+        # tells the ids of this process apart from those of other processes, or of a previous run
+        self._epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._listener = None
+        self._pid = None
+        self._subscribers = set()
+        self._streams = 0
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USERS_EVENTS_BUFFER_SIZE', 1000)
+        app.config.setdefault('USERS_EVENTS_HEARTBEAT_SECONDS', 15)
+        app.config.setdefault('USERS_EVENTS_CHANNEL', 'users_events')
+        app.config.setdefault('USERS_EVENTS_WSGI_STREAMS', 1)
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+        if uri.startswith('postgres') and not app.config.get('USERS_EVENTS_LISTEN_URL'):
+            if app.config.get('DATABASE_PGBOUNCER'):
+                raise ValueError('USERS_EVENTS_LISTEN_URL must connect to Postgres directly, LISTEN not working '
+                                 'through PgBouncer transaction pooling')
+            app.config['USERS_EVENTS_LISTEN_URL'] = uri
+        with self._condition:
+            self._events = collections.deque(self._events, maxlen=app.config.get('USERS_EVENTS_BUFFER_SIZE'))
+
+    @property
+    def last_event_id(self):
+        return '{}-{}'.format(self._epoch, self._seq)
+
+    def publish(self, event, data):
+        """Appends an event to the buffer and wakes the clients waiting for one
+        :param data: JSON serialised event data
+        """
+        with self._condition:
+            self._seq += 1
+            self._events.append((self._seq, event, data))
+            self._condition.notify_all()
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback()
+
+    def subscribe(self, callback):
+        """Calls callback, from the publishing thread, whenever events are published or ids reset"""
+        with self._condition:
+            self._subscribers.add(callback)
+
+    def unsubscribe(self, callback):
+        with self._condition:
+            self._subscribers.discard(callback)
+
+    def events_after(self, last_event_id):
+        """Lists the (event id, event, data) tuples published after last_event_id
+        :return: None if the events after last_event_id can't be told, the id being unknown or too old
+        """
+        epoch, _, seq = (last_event_id or '').partition('-')
+        if epoch != self._epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        with self._condition:
+            if seq > self._seq or self._events and seq < self._events[0][0] - 1:
+                return None
+            return [
+                ('{}-{}'.format(self._epoch, event_seq), event, data)
+                for event_seq, event, data in self._events if event_seq > seq
+            ]
+
+    def wait(self, last_event_id, timeout):
+        """Waits up to timeout seconds for events after last_event_id, see events_after"""
+        with self._condition:
+            self._condition.wait_for(lambda: self.last_event_id != last_event_id, timeout)
+        return self.events_after(last_event_id)
+
+    def start(self, last_event_id):
+        """Opens a stream resuming after last_event_id, if any
+        :return: (messages, last event id) tuple, the messages to send first and the id to wait for events after
+        """
+        if last_event_id is None:
+            last_event_id = self.last_event_id
+            return ['retry: 3000\n\n', format_event(last_event_id, 'ready', '{}')], last_event_id
+        return ['retry: 3000\n\n'], last_event_id
+
+    def next_messages(self, last_event_id, events):
+        """Formats the events following last_event_id, events being what events_after or wait returned
+        :return: (messages, last event id) tuple, a reset event standing for events that can't be told
+        """
+        if events is None:
+            last_event_id = self.last_event_id
+            return [format_event(last_event_id, 'reset', '{}')], last_event_id
+        messages = []
+        for event_id, event, data in events:
+            messages.append(format_event(event_id, event, data))
+            last_event_id = event_id
+        return messages, last_event_id
+
+    def open_stream(self, limit):
+        """Takes one of the limit streams the WSGI server may hold open at once, see close_stream
+        :return: False when all are taken
+        """
+        with self._condition:
+            if self._streams >= limit:
+                return False
+            self._streams += 1
+            return True
+
+    def close_stream(self):
+        with self._condition:
+            self._streams -= 1
+
+    def stream(self, last_event_id, heartbeat):
+        """Yields the Server-Sent Events messages following last_event_id, forever
+        Comments are sent every heartbeat seconds without events, so that proxies keep the connection open.
+        """
+        messages, last_event_id = self.start(last_event_id)
+        yield from messages
+        events = self.events_after(last_event_id)
+        while True:
+            messages, last_event_id = self.next_messages(last_event_id, events)
+            yield from messages or [': keep-alive\n\n']
+            events = self.wait(last_event_id, heartbeat)
+
+    def queue(self, executor, session_info, channel, events):
+        """Queues events of the current transaction, published once it commits
+        :param executor: session or connection of the transaction, used to NOTIFY on Postgres
+        :param session_info: info dict of the session, holding the events until the commit otherwise
+        :param channel: Postgres channel to NOTIFY, None elsewhere
+        :param events: (event, data dict) tuples
+        """
+        if channel:
+            payloads = notify_payloads(dumps({'event': event, 'data': data}) for event, data in events)
+            executor.execute(
+                text('SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload'),
+                {'channel': channel, 'payloads': payloads}
+            )
+        else:
+            session_info.setdefault('user_events', []).extend((event, dumps(data)) for event, data in events)
+
+    def publish_queued(self, session_info):
+        """Publishes the events queued in a transaction that just committed"""
+        for event, data in session_info.pop('user_events', ()):
+            self.publish(event, data)
+
+    def discard_queued(self, session_info):
+        session_info.pop('user_events', None)
+
+    def listen(self, url, channel):
+        """Starts the thread publishing the events NOTIFYed on channel, once per process
+        :param url: database URL of the listening connection, which must not go through PgBouncer
+        """
+        with self._condition:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._listening = False
+            self._listener = threading.Thread(target=self._listen, args=(url, channel), daemon=True)
+            self._listener.start()
+
+    @property
+    def listening(self):
+        """Tells if this process currently receives the events NOTIFYed by the others"""
+        return self._listening
+
+    def _listen(self, url, channel):
+        # a connection of its own, kept for good rather than taken from the application's pool
+        engine = create_engine(url, poolclass=NullPool)
+        dropped = False
+        while True:
+            fairy = None
+            try:
+                fairy = engine.raw_connection()
+                connection = fairy.connection
+                # connecting may have left a transaction open, in which autocommit can't be turned on
+                connection.rollback()
+                connection.autocommit = True
+                connection.cursor().execute('LISTEN "{}"'.format(channel))
+                self._listening = True
+                if dropped:
+                    # notifications were missed while not listening, have the clients reset
+                    self.clear()
+                    dropped = False
+                while True:
+                    if select.select([connection], [], [], 5) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        for notification in json.loads(connection.notifies.pop(0).payload):
+                            self.publish(notification['event'], dumps(notification['data']))
+            except Exception:
+                if fairy is not None:
+                    fairy.invalidate()
+                dropped = dropped or self._listening
+                self._listening = False
+                time.sleep(1)
+
+    def clear(self):
+        """Drops the buffered events, the clients resuming from any of them getting a reset event"""
+        with self._condition:
+            self._epoch = uuid.uuid4().hex[:8]
+            self._events.clear()
+            self._condition.notify_all()
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback()
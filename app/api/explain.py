@@ -0,0 +1,55 @@
+from flask import current_app
+
+from app import db
+from app.api.models import User
+from app.api.pagination import encode_cursor
+
+
+def get_model_queries():
+    """Lists the queries behind each User read path, filled in with the newest user's values"""
+    newest = User.users_page_query().first()
+    limit = current_app.config.get('USERS_PAGE_SIZE') + 1
+    user_id = newest.id if newest else 1
+    email = newest.email if newest else 'user@example.com'
+    cursor = encode_cursor(newest.created_at, newest.id) if newest else None
+    username = newest.username if newest else 'user'
+    queries = [
+        ('get_all_users / iter_user_rows', User.users_page_query()),
+        ('get_users_page', User.users_page_query().limit(limit)),
+        ('get_users_page (cursor)', User.users_page_query(cursor).limit(limit)),
+        ('get_users_page (active)', User.users_page_query(active=True).limit(limit)),
+        ('get_by_id', User.query_data().filter(User.id == user_id).limit(1)),
+        ('get_by_ids', User.by_ids_query([user_id, user_id + 1, user_id + 2])),
+        ('exists', User.exists_query(username, email).limit(1)),
+        ('login', User.login_query(email).limit(1)),
+    ]
+    # other databases search through the in-process index
+    if db.engine.dialect.name == 'postgresql':
+        search_limit = current_app.config.get('USERS_SEARCH_PAGE_SIZE')
+        term = username[:4]
+        queries += [
+            ('search', User.trigram_search_query(term, search_limit)),
+            ('search (cursor)', User.trigram_search_query(term, search_limit, (username.lower(), user_id))),
+        ]
+    return queries
+
+
+def explain(query):
+    """Returns the plan of query, from EXPLAIN ANALYZE on Postgres and EXPLAIN QUERY PLAN on SQLite
+    :rtype: list of strings
+    """
+    connection = db.session.connection()
+    compiled = query.statement.compile(dialect=connection.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    if connection.dialect.name == 'postgresql':
+        return [row[0] for row in connection.execute('EXPLAIN ANALYZE ' + str(compiled), params)]
+    return [row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)]
+
+
+def explain_queries():
+    """Yields (name, plan) for each User read query"""
+    for name, query in get_model_queries():
+        yield name, explain(query)
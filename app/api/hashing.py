@@ -0,0 +1,256 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from flask_bcrypt import generate_password_hash, check_password_hash
+
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+from app.api.serialization import jsonify
+from app.api.stats import Timing
+
+
+SCHEMES = ('bcrypt', 'argon2')
+BCRYPT_COST = re.compile(r'^\$2[abxy]?\$(\d+)\$')
+
+
+class HashingPoolSaturated(Exception):
+    """Raised when every worker is busy and the waiting queue is full"""
+
+
+def hash_password(password, scheme, rounds, argon2_params):
+    """Hashes password with bcrypt at cost rounds, or with argon2 and its (time, memory, parallelism) costs
+    :raises ValueError: if password is empty
+    :rtype: string
+    """
+    if scheme == 'argon2':
+        if not password:
+            raise ValueError('Password must be non-empty.')
+        return argon2.PasswordHasher(*argon2_params).hash(password)
+    return generate_password_hash(password, rounds).decode()
+
+
+def verify_password(pw_hash, password):
+    """Checks password against a bcrypt or argon2 hash, hashes that can't be verified never matching
+    :rtype: bool
+    """
+    if pw_hash.startswith('$argon2'):
+        if argon2 is None:
+            return False
+        try:
+            return argon2.PasswordHasher().verify(pw_hash, password)
+        # malformed hashes raise InvalidHash, a ValueError
+        except (argon2.exceptions.VerificationError, ValueError):
+            return False
+    try:
+        return check_password_hash(pw_hash, password)
+    except ValueError:
+        return False
+
+
+def _measure_ms(func, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def calibrate_bcrypt(target_ms, minimum=4, maximum=16):
+    """Measures bcrypt on this machine, from the cheapest cost up to the first one over budget
+    :return: (rounds, timings) tuple, rounds being the highest cost hashing within target_ms
+    and timings the milliseconds each cost measured took
+    """
+    timings = {}
+    for rounds in range(minimum, maximum + 1):
+        timings[rounds] = _measure_ms(generate_password_hash, 'calibration', rounds)
+        if timings[rounds] > target_ms:
+            break
+    within = [rounds for rounds, ms in timings.items() if ms <= target_ms]
+    return max(within, default=minimum), timings
+
+
+def calibrate_argon2(target_ms, memory_cost, parallelism, maximum=20):
+    """Measures argon2 on this machine with the given memory cost (KiB) and parallelism
+    :return: (time_cost, timings) tuple, like calibrate_bcrypt
+    """
+    timings = {}
+    for time_cost in range(1, maximum + 1):
+        hasher = argon2.PasswordHasher(time_cost, memory_cost, parallelism)
+        timings[time_cost] = _measure_ms(hasher.hash, 'calibration')
+        if timings[time_cost] > target_ms:
+            break
+    within = [time_cost for time_cost, ms in timings.items() if ms <= target_ms]
+    return max(within, default=1), timings
+
+
+def _timed(func, *args):
+    """Runs func in the worker, reporting when it started and how long it took"""
+    started = time.time()
+    result = func(*args)
+    return result, started, time.time() - started
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords on a bounded process pool
+
+    The pool is sized by PASSWORD_HASHING_WORKERS (0 hashes on the calling thread), by default the cores
+    divided by the number of gunicorn workers, each of which has its own pool. It accepts at most
+    PASSWORD_HASHING_QUEUE_SIZE waiting jobs on top of the running ones, beyond which HashingPoolSaturated
+    is raised and answered with a 503. A sync worker only ever has one job in flight, so this only sheds
+    load with threaded or async workers.
+
+    New hashes use PASSWORD_HASH_SCHEME, bcrypt or argon2 (requires argon2-cffi), while hashes
+    of either scheme are verified.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self.queue_wait = Timing()
+        self.hash_time = Timing()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASHING_WORKERS', os.cpu_count())
+        app.config.setdefault('PASSWORD_HASHING_QUEUE_SIZE', 16)
+        app.config.setdefault('PASSWORD_HASH_SCHEME', 'bcrypt')
+        app.config.setdefault('ARGON2_TIME_COST', 3)
+        app.config.setdefault('ARGON2_MEMORY_COST', 65536)
+        app.config.setdefault('ARGON2_PARALLELISM', 1)
+        self._get_scheme(app.config)
+        app.register_error_handler(HashingPoolSaturated, self._saturated)
+
+    @staticmethod
+    def _saturated(e):
+        response = jsonify({
+            'status': 'error',
+            'message': 'Service busy, please try again.'
+        })
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    @staticmethod
+    def _get_scheme(config):
+        """Reads the hashing scheme and its argon2 parameters from config
+        :raises ValueError: if the scheme is unknown or argon2-cffi is not installed
+        """
+        scheme = config.get('PASSWORD_HASH_SCHEME')
+        if scheme not in SCHEMES:
+            raise ValueError('Unknown PASSWORD_HASH_SCHEME {}, use one of {}.'.format(scheme, ', '.join(SCHEMES)))
+        if scheme == 'argon2' and argon2 is None:
+            raise ValueError('PASSWORD_HASH_SCHEME argon2 requires the argon2-cffi package.')
+        return scheme, (config.get('ARGON2_TIME_COST'), config.get('ARGON2_MEMORY_COST'), config.get('ARGON2_PARALLELISM'))
+
+    def generate_password_hash(self, password, rounds):
+        """Hashes password with the configured scheme, rounds being the bcrypt cost
+        :rtype: string
+        """
+        scheme, argon2_params = self._get_scheme(current_app.config)
+        return self._run(hash_password, password, scheme, rounds, argon2_params)
+
+    def check_password_hash(self, pw_hash, password):
+        """Checks password against a bcrypt or argon2 hash
+        :rtype: bool
+        """
+        return self._run(verify_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash, rounds):
+        """Tells whether pw_hash was made with another scheme or cost than the configured ones
+        :param rounds: the configured bcrypt cost
+        """
+        scheme, argon2_params = self._get_scheme(current_app.config)
+        if scheme == 'argon2':
+            return not pw_hash.startswith('$argon2') or argon2.PasswordHasher(*argon2_params).check_needs_rehash(pw_hash)
+        match = BCRYPT_COST.match(pw_hash)
+        return match is None or int(match.group(1)) != rounds
+
+    def generate_password_hashes(self, passwords, rounds):
+        """Hashes many passwords in parallel
+        Bulk jobs wait for a free slot instead of failing when the pool is saturated.
+        :return: list holding, for each password, its hash or the exception raised hashing it
+        """
+        workers = current_app.config.get('PASSWORD_HASHING_WORKERS')
+        if not workers:
+            results = []
+            for password in passwords:
+                try:
+                    results.append(self.generate_password_hash(password, rounds))
+                except Exception as e:
+                    results.append(e)
+            return results
+        scheme, argon2_params = self._get_scheme(current_app.config)
+        executor, slots = self._get_executor(workers)
+        futures = []
+        for password in passwords:
+            submitted = time.time()
+            slots.acquire()
+            future = executor.submit(_timed, hash_password, password, scheme, rounds, argon2_params)
+            future.add_done_callback(lambda f: slots.release())
+            futures.append((submitted, future))
+        results = []
+        for submitted, future in futures:
+            try:
+                pw_hash, started, elapsed = future.result()
+            except Exception as e:
+                results.append(e)
+                continue
+            self._observe(submitted, started, elapsed)
+            results.append(pw_hash)
+        return results
+
+    def get_stats(self):
+        return {
+            'queue_wait': self.queue_wait.get_data(),
+            'hash_time': self.hash_time.get_data()
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._executor = None
+
+    def _run(self, func, *args):
+        workers = current_app.config.get('PASSWORD_HASHING_WORKERS')
+        submitted = time.time()
+        if not workers:
+            result, started, elapsed = _timed(func, *args)
+        else:
+            executor, slots = self._get_executor(workers)
+            if not slots.acquire(blocking=False):
+                raise HashingPoolSaturated
+            try:
+                future = executor.submit(_timed, func, *args)
+            except Exception:
+                slots.release()
+                raise
+            future.add_done_callback(lambda f: slots.release())
+            result, started, elapsed = future.result()
+        self._observe(submitted, started, elapsed)
+        return result
+
+    def _observe(self, submitted, started, elapsed):
+        self.queue_wait.observe(max(0.0, started - submitted))
+        self.hash_time.observe(elapsed)
+
+    def _get_executor(self, workers):
+        with self._lock:
+            # a forked gunicorn worker cannot reuse its parent's pool
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+                self._slots = threading.BoundedSemaphore(
+                    workers + current_app.config.get('PASSWORD_HASHING_QUEUE_SIZE')
+                )
+                self._pid = os.getpid()
+            return self._executor, self._slots
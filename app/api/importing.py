@@ -0,0 +1,29 @@
+import itertools
+import json
+
+
+def iter_ndjson(lines):
+    """Yields the record held by each non-empty NDJSON line, None for lines that aren't valid JSON
+    :param lines: iterable of str or bytes lines
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def iter_records(fileobj):
+    """Yields the records of a JSON array or NDJSON file, telling them apart by their first character
+    :param fileobj: text file object
+    """
+    head = fileobj.read(1)
+    while head.isspace():
+        head = fileobj.read(1)
+    if head == '[':
+        yield from json.loads(head + fileobj.read())
+    else:
+        yield from iter_ndjson(itertools.chain([head + fileobj.readline()], fileobj))
@@ -0,0 +1,126 @@
+import os
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# with gunicorn, each worker writes its samples to this directory and /metrics aggregates them
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+)
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent handling requests', ['method', 'endpoint']
+)
+REQUESTS = Counter(
+    'http_requests_total', 'Requests handled', ['method', 'endpoint', 'status']
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'Requests being handled', multiprocess_mode='livesum'
+)
+REQUEST_SQL_QUERIES = Histogram(
+    'http_request_sql_queries', 'SQL queries run per request', ['endpoint'], buckets=QUERY_COUNT_BUCKETS
+)
+REQUEST_SQL_TIME = Histogram(
+    'http_request_sql_duration_seconds', 'Time spent running SQL queries per request', ['endpoint']
+)
+PASSWORD_HASH_TIME = Histogram(
+    'password_hash_duration_seconds', 'Time spent hashing or verifying a password'
+)
+PASSWORD_HASH_QUEUE_WAIT = Histogram(
+    'password_hash_queue_wait_seconds', 'Time password hashes waited for a worker'
+)
+JWT_TIME = Histogram(
+    'jwt_duration_seconds', 'Time spent encoding or decoding a JWT', ['operation'],
+    buckets=(.00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005, .01)
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a database connection', ['pool']
+)
+DB_POOL_TIMEOUTS = Counter(
+    'db_pool_checkout_timeouts_total', 'Database connection checkouts that timed out', ['pool']
+)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is not None and has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+        g.sql_time += time.perf_counter() - started
+
+
+class Metrics:
+    """Records request, SQL, password hashing, JWT and pool metrics, served at /metrics for Prometheus"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from app import hasher
+        from app.api.models import jwt_decode_time, jwt_encode_time
+        from app.api.pool import pool_stats
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics)
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        hasher.hash_time.subscribe(PASSWORD_HASH_TIME.observe)
+        hasher.queue_wait.subscribe(PASSWORD_HASH_QUEUE_WAIT.observe)
+        jwt_encode_time.subscribe(JWT_TIME.labels('encode').observe)
+        jwt_decode_time.subscribe(JWT_TIME.labels('decode').observe)
+        pool_stats.subscribe(self._observe_pool)
+
+    @staticmethod
+    def _observe_pool(stats):
+        stats.checkout_wait.subscribe(DB_POOL_CHECKOUT_WAIT.labels(stats.name).observe)
+        stats.subscribe_timeouts(DB_POOL_TIMEOUTS.labels(stats.name).inc)
+
+    @staticmethod
+    def _endpoint():
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+
+    @staticmethod
+    def _before_request():
+        g.request_started = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_time = 0.0
+        REQUESTS_IN_FLIGHT.inc()
+
+    def _after_request(self, response):
+        if 'request_started' in g:
+            endpoint = self._endpoint()
+            REQUEST_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - g.request_started)
+            REQUESTS.labels(request.method, endpoint, response.status_code).inc()
+            REQUEST_SQL_QUERIES.labels(endpoint).observe(g.sql_queries)
+            REQUEST_SQL_TIME.labels(endpoint).observe(g.sql_time)
+        return response
+
+    @staticmethod
+    def _teardown_request(exception):
+        if g.pop('request_started', None) is not None:
+            REQUESTS_IN_FLIGHT.dec()
+
+    @staticmethod
+    def metrics():
+        if MULTIPROC_DIR:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return generate_latest(registry), 200, {'Content-Type': CONTENT_TYPE_LATEST}
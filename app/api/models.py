@@ -1,11 +1,37 @@
 import datetime
+import hashlib
+import itertools
+import os
+import threading
+import time
+import uuid
 
 import jwt
 from flask import current_app
-from sqlalchemy import exc
+from sqlalchemy import exc, event, or_, tuple_
+from sqlalchemy.orm import Session
 from sqlalchemy.orm.exc import NoResultFound
 
-from app import db, bcrypt
+from app import (
+    db, denylist, hasher, recent_writes, search_index, token_cache, user_cache, user_events, write_marker
+)
+from app.api.caching import make_etag
+from app.api.hashing import HashingPoolSaturated
+from app.api.pagination import encode_cursor, decode_cursor
+from app.api.search import SearchTimeout, decode_search_cursor, encode_search_cursor
+from app.api.stats import Timing
+from app.api.validation import validate_user
+
+jwt_encode_time = Timing()
+jwt_decode_time = Timing()
+
+REVOKED_TOKEN_MESSAGE = 'Revoked token, please login again.'
+# denylist key prefix of the login sessions, the tokens of which carry their id as fam claim
+FAMILY_PREFIX = 'family:'
+
+
+class UserAlreadyExists(Exception):
+    """Raised when the username or email of a new user is taken"""
 
 
 class User(db.Model):
@@ -16,13 +42,33 @@ class User(db.Model):
     password = db.Column(db.String(255), nullable=False)
     active = db.Column(db.Boolean(), default=True, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow
+    )
+
+    __table_args__ = (
+        # listing order, newest first
+        db.Index('ix_users_created_at_id', created_at.desc(), id.desc()),
+        # case insensitive login lookups, emails being unique whatever their case
+        db.Index('ix_users_email_lower', db.func.lower(email), unique=True),
+        # search order, the pg_trgm indexes matching searches being created by migrations only
+        db.Index('ix_users_username_lower_id', db.func.lower(username), id),
+        # active users listing
+        db.Index(
+            'ix_users_active_created_at_id', created_at.desc(), id.desc(),
+            postgresql_where=active.is_(True), sqlite_where=active.is_(True)
+        ),
+    )
+
+    # keys of get_data(), in order
+    DATA_FIELDS = ('id', 'username', 'email', 'created_at', 'active')
 
     def __init__(self, username, email, password, created_at=datetime.datetime.utcnow()):
         self.username = username
-        self.email = email
-        self.password = bcrypt.generate_password_hash(
+        self.email = email.lower() if isinstance(email, str) else email
+        self.password = hasher.generate_password_hash(
             password, current_app.config.get('BCRYPT_LOG_ROUNDS')
-        ).decode()
+        )
         self.created_at = created_at
 
     def save(self):
@@ -36,17 +82,207 @@ class User(db.Model):
             raise
 
     @staticmethod
-    def login(email, password):
-        if not email or not password:
+    def create(username, email, password):
+        """Creates a user, checking the username and email are free before paying for the password hash
+        Emails are stored lowercase.
+        :raises ValueError: if a field is empty
+        :raises UserAlreadyExists: if the username or email is taken
+        :raises exc.IntegrityError: if a concurrent request took them meanwhile
+        :return: the get_data() dict of the user
+        """
+        if not username or not email or not password:
             raise ValueError
+        email = email.lower()
+        if User.exists(username, email):
+            raise UserAlreadyExists
+        created_at = datetime.datetime.utcnow()
+        row = {
+            'username': username,
+            'email': email,
+            'password': hasher.generate_password_hash(password, current_app.config.get('BCRYPT_LOG_ROUNDS')),
+            'active': True,
+            'created_at': created_at,
+            'updated_at': created_at
+        }
         try:
-            user = User.query.filter_by(email=email).one()
-        except NoResultFound:
+            data = User._insert_returning(row)
+            TableVersion.bump(User.__tablename__)
+            queue_user_events(db.session(), [('created', data)])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
             raise
-        if not bcrypt.check_password_hash(user.password, password):
+        User._record_writes(ids=[data['id']], emails=[email])
+        return data
+
+    @staticmethod
+    def _insert_returning(row):
+        """Inserts row, getting the get_data() dict back from the INSERT itself rather than reloading it"""
+        table = User.__table__
+        statement = table.insert().values(**row)
+        if db.engine.dialect.name == 'postgresql':
+            returned = db.session.execute(statement.returning(*[table.c[field] for field in User.DATA_FIELDS]))
+            return User.row_to_data(returned.first())
+        # no RETURNING here: the new id and the inserted values make up the same row
+        values = dict(row, id=db.session.execute(statement).inserted_primary_key[0])
+        return User.row_to_data([values[field] for field in User.DATA_FIELDS])
+
+    @staticmethod
+    def exists(username, email):
+        """Checks through the unique indexes, on a read replica, if a user has this username or email"""
+        return User._read(User.exists_query(username, email).first) is not None
+
+    @staticmethod
+    def exists_query(username, email):
+        """Queries the id of the users having this username or email"""
+        return db.session.query(User.id).filter(or_(
+            User.username == username, db.func.lower(User.email) == email.lower()
+        ))
+
+    @staticmethod
+    def bulk_create(records, batch_size):
+        """Creates users in batches, reporting the rows that can't be created instead of aborting
+        :param records: iterable of dicts holding username, email and password
+        :param batch_size: number of users inserted per statement
+        :return: (created, errors) tuple, errors being a list of {'index', 'message'} dicts
+        """
+        created, errors = 0, []
+        seen = (set(), set())
+        batch = []
+        for index, record in enumerate(records):
+            batch.append((index, record))
+            if len(batch) >= batch_size:
+                created += User._create_batch(batch, seen, errors)
+                batch = []
+        if batch:
+            created += User._create_batch(batch, seen, errors)
+        errors.sort(key=lambda error: error['index'])
+        return created, errors
+
+    @staticmethod
+    def _create_batch(batch, seen, errors):
+        seen_usernames, seen_emails = seen
+        valid = []
+        for index, record in batch:
+            try:
+                record = validate_user(record)
+                valid.append((index, dict(record, email=record['email'].lower())))
+            except ValueError:
+                errors.append({'index': index, 'message': 'Invalid payload.'})
+        if not valid:
+            return 0
+        existing = db.session.query(User.username, User.email).filter(or_(
+            User.username.in_([record['username'] for _, record in valid]),
+            db.func.lower(User.email).in_([record['email'] for _, record in valid])
+        )).all()
+        existing_usernames = {username for username, _ in existing}
+        existing_emails = {email.lower() for _, email in existing}
+        unique = []
+        for index, record in valid:
+            if (record['username'] in existing_usernames or record['username'] in seen_usernames
+                    or record['email'] in existing_emails or record['email'] in seen_emails):
+                errors.append({'index': index, 'message': 'User already exists.'})
+                continue
+            seen_usernames.add(record['username'])
+            seen_emails.add(record['email'])
+            unique.append((index, record))
+        # hash only the rows that can actually be inserted
+        pw_hashes = hasher.generate_password_hashes(
+            [record['password'] for _, record in unique], current_app.config.get('BCRYPT_LOG_ROUNDS')
+        )
+        created_at = datetime.datetime.utcnow()
+        rows = []
+        for (index, record), pw_hash in zip(unique, pw_hashes):
+            if isinstance(pw_hash, Exception):
+                errors.append({'index': index, 'message': 'Invalid payload.'})
+                continue
+            rows.append((index, {
+                'username': record['username'],
+                'email': record['email'],
+                'password': pw_hash,
+                'active': True,
+                'created_at': created_at,
+                'updated_at': created_at
+            }))
+        return User._insert_rows(rows, errors)
+
+    @staticmethod
+    def _insert_rows(rows, errors):
+        if not rows:
+            return 0
+        try:
+            created = User._insert_many_returning([row for _, row in rows])
+            TableVersion.bump(User.__tablename__)
+            queue_user_events(db.session(), [('created', data) for data in created])
+            db.session.commit()
+            User._record_writes(ids=[data['id'] for data in created], emails=[row['email'] for _, row in rows])
+            return len(rows)
+        except exc.IntegrityError:
+            db.session.rollback()
+        # a concurrent write got in the way, fall back to one row at a time
+        created = 0
+        for index, row in rows:
+            try:
+                data = User._insert_returning(row)
+                TableVersion.bump(User.__tablename__)
+                queue_user_events(db.session(), [('created', data)])
+                db.session.commit()
+                User._record_writes(ids=[data['id']], emails=[row['email']])
+                created += 1
+            except exc.IntegrityError:
+                db.session.rollback()
+                errors.append({'index': index, 'message': 'User already exists.'})
+        return created
+
+    @staticmethod
+    def _insert_many_returning(rows):
+        """Inserts rows in a single statement, getting their get_data() dicts back in id order
+        On Postgres the rows are passed as one array per column, RETURNING what was inserted.
+        """
+        columns = ('username', 'email', 'password', 'active', 'created_at', 'updated_at')
+        if db.engine.dialect.name == 'postgresql':
+            types = ('text', 'text', 'text', 'boolean', 'timestamp', 'timestamp')
+            arrays = ', '.join('CAST(:{} AS {}[])'.format(column, type_) for column, type_ in zip(columns, types))
+            statement = db.text('INSERT INTO {} ({}) SELECT * FROM unnest({}) RETURNING {}'.format(
+                User.__tablename__, ', '.join(columns), arrays, ', '.join(User.DATA_FIELDS)
+            ))
+            returned = db.session.execute(statement, {column: [row[column] for row in rows] for column in columns})
+            return sorted((User.row_to_data(row) for row in returned), key=lambda data: data['id'])
+        # no RETURNING here: read the rows back, by the emails just inserted
+        db.session.execute(User.__table__.insert(), rows)
+        returned = User.query_data().filter(User.email.in_([row['email'] for row in rows])).order_by(User.id)
+        return [User.row_to_data(row) for row in returned]
+
+    @staticmethod
+    def login_query(email):
+        """Queries the user with the given email, case insensitively"""
+        return User.query.filter(db.func.lower(User.email) == email.lower())
+
+    @staticmethod
+    def login(email, password):
+        if not email or not password or not isinstance(email, str):
+            raise ValueError
+        user = User._read(User.login_query(email).first, written_key=('email', email.lower()))
+        if not user:
+            raise NoResultFound
+        if not hasher.check_password_hash(user.password, password):
             raise NoResultFound
+        if hasher.needs_rehash(user.password, current_app.config.get('BCRYPT_LOG_ROUNDS')):
+            User.upgrade_password_hash(user.id, password)
         return user
 
+    @staticmethod
+    def upgrade_password_hash(user_id, password):
+        """Rehashes the password of a user who just logged in with the configured scheme and cost
+        Failing to is not an error, the current hash being checked again on the next login.
+        """
+        try:
+            pw_hash = hasher.generate_password_hash(password, current_app.config.get('BCRYPT_LOG_ROUNDS'))
+            User.query.filter(User.id == user_id).update({User.password: pw_hash}, synchronize_session='evaluate')
+            db.session.commit()
+        except (HashingPoolSaturated, exc.SQLAlchemyError):
+            db.session.rollback()
+
     def get_data(self):
         return {
             'id': self.id,
@@ -56,23 +292,243 @@ class User(db.Model):
             'active': self.active
         }
 
+    @staticmethod
+    def query_data():
+        """Queries the DATA_FIELDS columns only, as plain rows rather than User entities
+        This leaves the password hash out and skips the identity map and instance state bookkeeping.
+        """
+        return db.session.query(*[getattr(User, field) for field in User.DATA_FIELDS])
+
+    @staticmethod
+    def row_to_data(row):
+        """Turns a query_data() row into the dict get_data() would return, ignoring any extra column"""
+        return dict(zip(User.DATA_FIELDS, row))
+
     @staticmethod
     def get_by_id(user_id):
-        """Gets a user by its id"""
+        """Gets a user by its id, served from the user cache when possible"""
+        data, _ = User.get_by_id_with_etag(user_id)
+        return data
+
+    @staticmethod
+    def get_by_id_with_etag(user_id):
+        """Gets a user by its id along with the ETag of its current version, from the user cache when possible
+        :return: (data, etag) tuple, (None, None) if there's no such user
+        """
         try:
-            user = User.query.get(user_id)
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None, None
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            return dict(cached[0]), cached[1]
+        try:
+            row = User._read(
+                User.query_data().add_columns(User.updated_at).filter(User.id == user_id).first,
+                written_key=('id', user_id)
+            )
         except exc.DataError:
-            return None
-        return None if not user else user.get_data()
+            return None, None
+        if not row:
+            return None, None
+        data = User.row_to_data(row)
+        etag = make_etag(user_id, row.updated_at)
+        user_cache.set(user_id, (data, etag))
+        return dict(data), etag
+
+    @staticmethod
+    def get_by_ids(user_ids):
+        """Gets many users by id with one query for those the user cache doesn't hold
+        Recently written users are read from the primary, and so are those the replica doesn't find
+        with DATABASE_REPLICA_RETRY_MISSES.
+        :param user_ids: list of integer ids
+        :return: (users, missing) tuple, users being an ordered dict of id to data, missing a list of ids
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        found = {}
+        for user_id in user_ids:
+            cached = user_cache.get(user_id)
+            if cached is not None:
+                found[user_id] = dict(cached[0])
+        uncached = [user_id for user_id in user_ids if user_id not in found]
+        written = [user_id for user_id in uncached if User.recently_written(('id', user_id))]
+        if uncached and not written:
+            with db.session().using_replica() as replica:
+                found.update(User._fetch_by_ids(uncached))
+            retry = replica and current_app.config.get('DATABASE_REPLICA_RETRY_MISSES')
+            uncached = [user_id for user_id in uncached if user_id not in found] if retry else []
+        if uncached:
+            found.update(User._fetch_by_ids(uncached))
+        users = {user_id: found[user_id] for user_id in user_ids if user_id in found}
+        return users, [user_id for user_id in user_ids if user_id not in found]
+
+    @staticmethod
+    def by_ids_query(user_ids):
+        """Queries the DATA_FIELDS and updated_at of the users with these ids"""
+        return User.query_data().add_columns(User.updated_at).filter(User.id.in_(user_ids))
+
+    @staticmethod
+    def _fetch_by_ids(user_ids):
+        """Reads users by id in a single query, filling the user cache"""
+        found = {}
+        for row in User.by_ids_query(user_ids):
+            data = User.row_to_data(row)
+            user_cache.set(row.id, (data, make_etag(row.id, row.updated_at)))
+            found[row.id] = dict(data)
+        return found
+
+    @staticmethod
+    def get_users_version():
+        """Returns the version of the users table, changing with every write to it"""
+        return User._read(lambda: TableVersion.get(User.__tablename__))
 
     @staticmethod
     def get_all_users():
         """Returns all users"""
         users_list = []
-        for user in User.query.order_by(User.created_at.desc()).all():
-            users_list.append(user.get_data())
+        for row in User._read(User.users_page_query().all):
+            users_list.append(User.row_to_data(row))
         return users_list
 
+    @staticmethod
+    def users_page_query(cursor=None, active=None):
+        """Queries users newest first, starting after cursor
+        :param cursor: cursor returned along with the previous page, if any
+        :param active: only return active (True) or inactive (False) users
+        :raises ValueError: if the cursor is malformed
+        """
+        query = User.query_data().order_by(User.created_at.desc(), User.id.desc())
+        if active is not None:
+            query = query.filter(User.active.is_(active))
+        if cursor:
+            created_at, user_id = decode_cursor(cursor)
+            # a row value comparison, which Postgres can use as a condition on ix_users_created_at_id
+            query = query.filter(tuple_(User.created_at, User.id) < tuple_(created_at, user_id))
+        return query
+
+    @staticmethod
+    def get_users_page(limit, cursor=None, active=None):
+        """Returns a page of users, newest first, using keyset pagination on (created_at, id)
+        :param limit: maximum number of users to return
+        :param cursor: cursor returned along with the previous page, if any
+        :param active: only return active (True) or inactive (False) users
+        :raises ValueError: if the cursor is malformed
+        :return: (users, next_cursor) tuple, next_cursor being None on the last page
+        """
+        rows = User._read(User.users_page_query(cursor, active).limit(limit + 1).all)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+        return [User.row_to_data(row) for row in rows], next_cursor
+
+    @staticmethod
+    def search(query, limit, cursor=None):
+        """Finds users whose username or email contains query, or whose username is similar to it,
+        using keyset pagination on (lower(username), id)
+        Postgres matches through the pg_trgm indexes, other databases through the in-process search index.
+        :param cursor: cursor returned along with the previous page, if any
+        :raises ValueError: if the cursor is malformed
+        :raises SearchTimeout: if the database can't answer within USERS_SEARCH_BUDGET_MS
+        :return: (users, next_cursor) tuple, next_cursor being None once every user was looked at
+        """
+        after = decode_search_cursor(cursor) if cursor else None
+        config = current_app.config
+        if db.engine.dialect.name == 'postgresql':
+            return User._search_trigrams(query.lower(), limit, after)
+        with db.session().using_replica():
+            search_index.refresh(
+                User.get_users_version, lambda: [User.row_to_data(row) for row in User.query_data()],
+                config.get('USERS_SEARCH_REFRESH_SECONDS')
+            )
+        users, position = search_index.search(
+            query, limit, config.get('USERS_SEARCH_SIMILARITY'), after, config.get('USERS_SEARCH_BUDGET_MS')
+        )
+        return users, encode_search_cursor(*position) if position else None
+
+    @staticmethod
+    def trigram_search_query(query, limit, after=None):
+        """Queries a page of the users matching query through the pg_trgm indexes, on Postgres only
+        :param after: (lowercased username, id) tuple of the last user of the previous page, if any
+        """
+        pattern = '%' + query.replace('!', '!!').replace('%', '!%').replace('_', '!_') + '%'
+        username = db.func.lower(User.username)
+        rows = User.query_data().filter(or_(
+            username.like(pattern, escape='!'),
+            db.func.lower(User.email).like(pattern, escape='!'),
+            # pg_trgm's similarity operator, % doubled for the driver's paramstyle
+            username.op('%%')(query)
+        ))
+        if after is not None:
+            rows = rows.filter(tuple_(username, User.id) > tuple_(*after))
+        return rows.order_by(username, User.id).limit(limit + 1)
+
+    @staticmethod
+    def _search_trigrams(query, limit, after):
+        config = current_app.config
+        rows = User.trigram_search_query(query, limit, after)
+        with db.session().using_replica():
+            try:
+                db.session.execute('SET LOCAL statement_timeout = {:d}'.format(config.get('USERS_SEARCH_BUDGET_MS')))
+                db.session.execute('SET LOCAL pg_trgm.similarity_threshold = {:f}'.format(
+                    config.get('USERS_SEARCH_SIMILARITY')
+                ))
+                rows = rows.all()
+            except exc.OperationalError as e:
+                db.session.rollback()
+                # query_canceled
+                if getattr(e.orig, 'pgcode', None) == '57014':
+                    raise SearchTimeout
+                raise
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_search_cursor(rows[-1].username, rows[-1].id)
+        return [User.row_to_data(row) for row in rows], next_cursor
+
+    @staticmethod
+    def iter_user_rows(batch_size):
+        """Yields all users, newest first, as tuples of DATA_FIELDS fetched from a server side cursor
+        :param batch_size: number of rows fetched per round-trip
+        """
+        query = User.users_page_query().yield_per(batch_size)
+        with db.session().using_replica():
+            yield from query
+
+    @staticmethod
+    def _read(query, written_key=None):
+        """Runs query on a read replica
+        Lookups of a recently written user (written_key), or by a client that just wrote, go to the primary.
+        With DATABASE_REPLICA_RETRY_MISSES,
+        so do lookups the replica finds nothing for, in case it is lagging behind; this is off by default
+        as it sends every miss, e.g. each login attempt for an unknown email, to the primary too.
+        """
+        if written_key is None or not User.recently_written(written_key):
+            with db.session().using_replica() as replica:
+                result = query()
+            if (result or written_key is None or not replica
+                    or not current_app.config.get('DATABASE_REPLICA_RETRY_MISSES')):
+                return result
+        return query()
+
+    @staticmethod
+    def recently_written(written_key):
+        """Tells if a user, or the client of the current request, was written within the read-your-writes window
+        :param written_key: ('id', user id) or ('email', lowercased email) tuple
+        """
+        return recent_writes.get(written_key) or write_marker.is_marked()
+
+    @staticmethod
+    def _record_writes(ids=(), emails=()):
+        """Sends the next reads of these users, and those of the client that wrote them, to the primary,
+        for the read-your-writes window
+        """
+        write_marker.mark()
+        for user_id in ids:
+            recent_writes.set(('id', user_id), True)
+        for email in emails:
+            recent_writes.set(('email', email.lower()), True)
+
     @staticmethod
     def get_token_from_authorization_header(authorization_header):
         try:
@@ -82,10 +538,11 @@ class User(db.Model):
 
 
     @staticmethod
-    def encode_auth_token(user_id):
+    def encode_auth_token(user_id, family=None):
         """Encodes the JWT based on user id
         :rtype: bytes|string
         :param user_id: the user id
+        :param family: id of the login session the token belongs to, if any
         :return: encoded JWT
         """
         try:
@@ -95,22 +552,229 @@ class User(db.Model):
                 # Issued At Claim (iat)
                 'iat': datetime.datetime.utcnow(),
                 # Subject (sub)
-                'sub': user_id
+                'sub': user_id,
+                # JWT ID (jti), identifying the token once revoked
+                'jti': uuid.uuid4().hex
             }
-            return jwt.encode(payload, current_app.config.get('SECRET_KEY'), algorithm='HS256')
+            if family is not None:
+                payload['fam'] = family
+            return User._encode_token(payload)
         except Exception:
             return 'Could not encode token.'
 
+    @staticmethod
+    def encode_refresh_token(user_id, family):
+        """Encodes a long lived JWT only good for getting new auth tokens from /auth/refresh
+        :rtype: bytes
+        :param user_id: the user id
+        :param family: id of the login session the token belongs to, shared by the tokens refreshed from it
+        :return: encoded JWT
+        """
+        return User._encode_token({
+            'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=current_app.config.get('REFRESH_TOKEN_EXPIRATION_TIME_SECONDS')),
+            'iat': datetime.datetime.utcnow(),
+            'sub': user_id,
+            'jti': uuid.uuid4().hex,
+            'fam': family,
+            'type': 'refresh'
+        })
+
+    @staticmethod
+    def encode_auth_tokens(user_id):
+        """Starts a login session for user id
+        :return: (auth token, refresh token) tuple of encoded JWTs
+        """
+        family = uuid.uuid4().hex
+        return User.encode_auth_token(user_id, family), User.encode_refresh_token(user_id, family)
+
+    @staticmethod
+    def _encode_token(payload):
+        started = time.perf_counter()
+        token = jwt.encode(payload, current_app.config.get('SECRET_KEY'), algorithm='HS256')
+        jwt_encode_time.observe(time.perf_counter() - started)
+        return token
+
     @staticmethod
     def decode_auth_token(auth_token):
         """Decodes auth token
+        Valid tokens are remembered, keyed by their digest, until they expire.
+        Revoked ones are rejected.
         """
-        try:
-            payload = jwt.decode(auth_token, current_app.config.get('SECRET_KEY'), algorithms='HS256')
-            return payload['sub']
-        except jwt.ExpiredSignatureError:
-            return 'Expired token, please login again.'
-        except jwt.InvalidTokenError:
+        claims = User._decode_claims(auth_token)
+        if isinstance(claims, str):
+            return claims
+        if claims.get('type') == 'refresh':
             return 'Invalid token.'
-        except Exception:
-            return 'Could not decode token.'
+        if User._is_revoked(claims):
+            return REVOKED_TOKEN_MESSAGE
+        return claims['sub']
+
+    @staticmethod
+    def revoke_auth_token(auth_token):
+        """Revokes auth token until it expires, along with the tokens of its login session
+        :return: the subject of the token, or the reason it was not valid as decode_auth_token does
+        """
+        subject = User.decode_auth_token(auth_token)
+        if isinstance(subject, str):
+            return subject
+        claims = User._decode_claims(auth_token)
+        if claims.get('jti') is not None:
+            denylist.revoke(claims['jti'], claims['exp'])
+        if claims.get('fam') is not None:
+            User._revoke_family(claims['fam'])
+        return subject
+
+    @staticmethod
+    def refresh_auth_token(refresh_token):
+        """Gets a new auth token from a refresh token, without checking any password
+        With REFRESH_TOKEN_ROTATION, the refresh token is exchanged for a new one too, and using it
+        again revokes its whole login session, as it has most likely leaked.
+        :return: (auth token, refresh token) tuple of strings, or the reason the refresh token was refused
+        """
+        claims = User._decode_claims(refresh_token)
+        if isinstance(claims, str):
+            return claims
+        if claims.get('type') != 'refresh':
+            return 'Invalid token.'
+        if denylist.is_revoked(FAMILY_PREFIX + claims['fam']):
+            return REVOKED_TOKEN_MESSAGE
+        user = User.get_by_id(claims['sub'])
+        if not user or not user['active']:
+            return 'Invalid token.'
+        rotation = current_app.config.get('REFRESH_TOKEN_ROTATION')
+        if rotation:
+            # claimed in one step, so that of concurrent refreshes with the same token only one succeeds
+            reused = not denylist.claim(claims['jti'], claims['exp'])
+        else:
+            reused = denylist.is_revoked(claims['jti'])
+        if reused:
+            User._revoke_family(claims['fam'])
+            return REVOKED_TOKEN_MESSAGE
+        auth_token = User.encode_auth_token(claims['sub'], claims['fam']).decode()
+        if not rotation:
+            return auth_token, refresh_token
+        return auth_token, User.encode_refresh_token(claims['sub'], claims['fam']).decode()
+
+    @staticmethod
+    def _revoke_family(family):
+        """Revokes every token of a login session, for as long as the ones refreshed last are valid"""
+        denylist.revoke(
+            FAMILY_PREFIX + family, time.time() + current_app.config.get('REFRESH_TOKEN_EXPIRATION_TIME_SECONDS')
+        )
+
+    @staticmethod
+    def _is_revoked(claims):
+        # tokens issued before jti was added can't be revoked
+        if claims.get('jti') is not None and denylist.is_revoked(claims['jti']):
+            return True
+        return claims.get('fam') is not None and denylist.is_revoked(FAMILY_PREFIX + claims['fam'])
+
+    @staticmethod
+    def _decode_claims(auth_token):
+        """Decodes a token, revoked or not
+        :return: the claims, or an error message
+        """
+        secret = current_app.config.get('SECRET_KEY')
+        token = auth_token if isinstance(auth_token, bytes) else str(auth_token).encode()
+        key = hashlib.sha256(secret.encode() + b'.' + token).digest()
+        claims = token_cache.get(key)
+        if claims is None:
+            try:
+                started = time.perf_counter()
+                claims = jwt.decode(auth_token, secret, algorithms='HS256')
+                jwt_decode_time.observe(time.perf_counter() - started)
+            except jwt.ExpiredSignatureError:
+                return 'Expired token, please login again.'
+            except jwt.InvalidTokenError:
+                return 'Invalid token.'
+            except Exception:
+                return 'Could not decode token.'
+            token_cache.set(key, claims, ttl=claims.get('exp', 0) - time.time())
+        return claims
+
+
+class TableVersion(db.Model):
+    """Counts the writes to a table, so that representations of it can be validated without reading it
+
+    The count is split over SHARDS rows, each thread incrementing its own, so that concurrent writes
+    don't all wait on the lock of a single row until they commit. Rows are created by their first write.
+    """
+    __tablename__ = "table_versions"
+    name = db.Column(db.String(64), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    SHARDS = 16
+
+    @staticmethod
+    def bump(name, connection=None):
+        """Increments the version of table name, within the current transaction"""
+        executor = connection if connection is not None else db.session
+        # a transaction runs on a single thread, and so only ever locks one row
+        shard = hash((os.getpid(), threading.get_ident())) % TableVersion.SHARDS
+        executor.execute(db.text(
+            'INSERT INTO table_versions (name, shard, version) VALUES (:name, :shard, 1) '
+            'ON CONFLICT (name, shard) DO UPDATE SET version = table_versions.version + 1'
+        ), {'name': name, 'shard': shard})
+
+    @staticmethod
+    def get(name):
+        """Returns the version of table name, 0 if it was never written"""
+        return int(
+            db.session.query(db.func.sum(TableVersion.version)).filter(TableVersion.name == name).scalar() or 0
+        )
+
+
+@event.listens_for(Session, 'after_flush')
+def users_flushed(session, flush_context):
+    """Bumps the users table version when a flush wrote users"""
+    if any(isinstance(obj, User) for obj in itertools.chain(session.new, session.dirty, session.deleted)):
+        TableVersion.bump(User.__tablename__, session.connection())
+
+
+def queue_user_events(session, events):
+    """Queues (event, data) user events, published once the transaction of session commits
+    On Postgres they are NOTIFYed to every process, see EventBroker.
+    """
+    connection = session.connection()
+    channel = current_app.config.get('USERS_EVENTS_CHANNEL') if connection.dialect.name == 'postgresql' else None
+    user_events.queue(connection, session.info, channel, events)
+
+
+def listen_user_events():
+    """Starts relaying the user events of every process to this one, on Postgres"""
+    if db.engine.dialect.name == 'postgresql':
+        user_events.listen(
+            current_app.config.get('USERS_EVENTS_LISTEN_URL'), current_app.config.get('USERS_EVENTS_CHANNEL')
+        )
+
+
+@event.listens_for(Session, 'after_flush')
+def user_events_flushed(session, flush_context):
+    """Queues the events of the users a flush created or updated"""
+    events = [('created', obj.get_data()) for obj in session.new if isinstance(obj, User)]
+    events += [
+        ('updated', obj.get_data()) for obj in session.dirty
+        if isinstance(obj, User) and session.is_modified(obj)
+    ]
+    if events:
+        queue_user_events(session, events)
+
+
+@event.listens_for(Session, 'after_commit')
+def user_events_committed(session):
+    user_events.publish_queued(session.info)
+
+
+@event.listens_for(Session, 'after_rollback')
+def user_events_rolled_back(session):
+    user_events.discard_queued(session.info)
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_written(mapper, connection, target):
+    """Drops the cached data of a user as soon as it is written, and reads it from the primary for a while"""
+    user_cache.pop(target.id)
+    User._record_writes(ids=[target.id], emails=[target.email])
@@ -0,0 +1,70 @@
+import base64
+import datetime
+import json
+
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(created_at, user_id):
+    """Encodes the position of a user in the listing order into an opaque token
+    :param created_at: the user creation date
+    :param user_id: the user id
+    :return: url safe cursor
+    """
+    position = json.dumps([created_at.strftime(CURSOR_DATETIME_FORMAT), user_id])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor produced by encode_cursor
+    :raises ValueError: if the cursor is malformed
+    :return: (created_at, user_id) tuple
+    """
+    try:
+        created_at, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return datetime.datetime.strptime(created_at, CURSOR_DATETIME_FORMAT), int(user_id)
+    except Exception:
+        raise ValueError('Invalid cursor.')
+
+
+def parse_limit(value, default, maximum):
+    """Parses the limit query parameter
+    :raises ValueError: if the limit is not a positive integer
+    :return: the limit, capped to maximum
+    """
+    if value is None:
+        return default
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('Invalid limit.')
+    return min(limit, maximum)
+
+
+def parse_bool(value):
+    """Parses an optional true/false query parameter
+    :raises ValueError: if the value is neither
+    :return: True, False or None when the parameter is missing
+    """
+    if value is None:
+        return None
+    if value not in ('true', 'false'):
+        raise ValueError('Invalid boolean.')
+    return value == 'true'
+
+
+def parse_ids(ids, maximum):
+    """Parses a list of user ids, given as a comma separated string or a list
+    :raises ValueError: if an id is not a positive 32 bits integer, or there are none or more than maximum
+    :return: list of ids
+    """
+    if isinstance(ids, str):
+        ids = ids.split(',')
+    if not isinstance(ids, list) or not 0 < len(ids) <= maximum:
+        raise ValueError('Invalid ids.')
+    try:
+        user_ids = [int(user_id) for user_id in ids if not isinstance(user_id, (bool, float))]
+    except (TypeError, ValueError):
+        raise ValueError('Invalid ids.')
+    if len(user_ids) != len(ids) or not all(0 < user_id < 2 ** 31 for user_id in user_ids):
+        raise ValueError('Invalid ids.')
+    return user_ids
@@ -0,0 +1,156 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+from app.api.stats import Timing
+
+
+# name of the primary database pool, replica pools being named after their bind
+PRIMARY_POOL = 'primary'
+
+
+class PoolStats:
+    """Tracks how long checkouts of a pool wait for a connection and how close the pool gets to its limit"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._timeout_subscribers = []
+        self.checkout_wait = Timing()
+        self.timeouts = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.capacity = 0
+
+    def observe_checkout(self, pool, seconds):
+        self.checkout_wait.observe(seconds)
+        with self._lock:
+            self.checked_out = pool.checkedout()
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.capacity = pool.size() + max(pool._max_overflow, 0)
+
+    def observe_checkin(self, pool):
+        with self._lock:
+            self.checked_out = pool.checkedout()
+
+    def subscribe_timeouts(self, callback):
+        """Calls callback, without arguments, on every checkout timeout from now on"""
+        if callback not in self._timeout_subscribers:
+            self._timeout_subscribers.append(callback)
+
+    def observe_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+        for callback in self._timeout_subscribers:
+            callback()
+
+    def get_data(self):
+        with self._lock:
+            return {
+                'checkout_wait': self.checkout_wait.get_data(),
+                'timeouts': self.timeouts,
+                'checked_out': self.checked_out,
+                'max_checked_out': self.max_checked_out,
+                'capacity': self.capacity,
+                'saturation': self.checked_out / self.capacity if self.capacity else 0.0
+            }
+
+
+class PoolStatsRegistry:
+    """PoolStats of every instrumented pool, by pool name: PRIMARY_POOL or the bind name of a replica"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._subscribers = []
+
+    def get(self, name):
+        stats = self._stats.get(name)
+        if stats is not None:
+            return stats
+        with self._lock:
+            if name in self._stats:
+                return self._stats[name]
+            stats = self._stats[name] = PoolStats(name)
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(stats)
+        return stats
+
+    def subscribe(self, callback):
+        """Calls callback with the PoolStats of every pool, those known now and those created later"""
+        with self._lock:
+            if callback in self._subscribers:
+                return
+            self._subscribers.append(callback)
+            known = list(self._stats.values())
+        for stats in known:
+            callback(stats)
+
+    def get_data(self):
+        with self._lock:
+            known = list(self._stats.values())
+        return {stats.name: stats.get_data() for stats in known}
+
+
+pool_stats = PoolStatsRegistry()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool reporting checkout latency and saturation to pool_stats, under its logging name"""
+
+    @property
+    def stats(self):
+        return pool_stats.get(self.logging_name or PRIMARY_POOL)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            self.stats.observe_timeout()
+            raise
+        self.stats.observe_checkout(self, time.perf_counter() - started)
+        return connection
+
+    def _do_return_conn(self, conn):
+        super()._do_return_conn(conn)
+        self.stats.observe_checkin(self)
+
+
+def get_engine_options(config):
+    """Builds the SQLALCHEMY_ENGINE_OPTIONS for a Postgres database from the DATABASE_* settings
+    In PgBouncer mode connections are not pooled by SQLAlchemy and no session level setting is sent
+    on connect, the statement timeout being set for each transaction instead.
+    """
+    uri = config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if not uri.startswith('postgres'):
+        return {}
+    statement_timeout = config.get('DATABASE_STATEMENT_TIMEOUT_MS')
+    if config.get('DATABASE_PGBOUNCER'):
+        if statement_timeout and not event.contains(Engine, 'begin', set_local_statement_timeout):
+            event.listen(Engine, 'begin', set_local_statement_timeout)
+        return {'poolclass': NullPool}
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config.get('DATABASE_POOL_SIZE'),
+        'max_overflow': config.get('DATABASE_MAX_OVERFLOW'),
+        'pool_timeout': config.get('DATABASE_POOL_TIMEOUT'),
+        'pool_recycle': config.get('DATABASE_POOL_RECYCLE'),
+        'pool_pre_ping': config.get('DATABASE_POOL_PRE_PING')
+    }
+    if statement_timeout:
+        options['connect_args'] = {'options': '-c statement_timeout={:d}'.format(statement_timeout)}
+    return options
+
+
+def set_local_statement_timeout(connection):
+    """Applies the statement timeout to the transaction being started"""
+    timeout = current_app.config.get('DATABASE_STATEMENT_TIMEOUT_MS') if current_app else 0
+    if timeout:
+        connection.execute('SET LOCAL statement_timeout = {:d}'.format(timeout))
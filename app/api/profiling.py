@@ -0,0 +1,207 @@
+import cProfile
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import current_app, g, request
+
+PROFILE_MODES = ('cprofile', 'sample')
+
+
+def collapse_stack(frame):
+    """Formats a stack, outermost frame first, as a line of the collapsed format read by flame graph tools"""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append('{} ({}:{})'.format(code.co_name, code.co_filename, code.co_firstlineno).replace(';', ':'))
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+def write_collapsed(path, stacks):
+    """Writes stack counts to path, one 'frame;frame;frame count' line per stack"""
+    with open(path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write('{} {}\n'.format(stack, count))
+
+
+class StackSampler:
+    """Samples the stacks of the running threads, or of a single one, every interval seconds
+
+    Sampling only looks at the frames from a separate thread, so the sampled code is not slowed down.
+    """
+
+    def __init__(self, interval, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops sampling
+        :return: the stacks sampled since the last take()
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.take()
+
+    def take(self):
+        """Returns the stacks sampled so far and starts counting again"""
+        with self._lock:
+            stacks, self.stacks = self.stacks, Counter()
+        return stacks
+
+    def sample(self):
+        own = threading.get_ident()
+        with self._lock:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own and self.thread_id in (None, thread_id):
+                    self.stacks[collapse_stack(frame)] += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+
+class ContinuousProfiler(StackSampler):
+    """Samples every thread of the worker, writing a profile every period seconds"""
+
+    def __init__(self, interval, period, directory):
+        super().__init__(interval)
+        self.period = period
+        self.directory = directory
+
+    def _run(self):
+        flushed = time.monotonic()
+        while not self._stopped.wait(self.interval):
+            self.sample()
+            if time.monotonic() - flushed >= self.period:
+                self.flush()
+                flushed = time.monotonic()
+
+    def stop(self):
+        """Stops sampling, writing the stacks sampled since the last flush
+        :return: the profile path or None
+        """
+        return self._write(super().stop())
+
+    def flush(self):
+        """Writes the stacks sampled since the last flush, if any
+        :return: the profile path or None
+        """
+        return self._write(self.take())
+
+    def _write(self, stacks):
+        if not stacks:
+            return None
+        path = os.path.join(self.directory, 'worker-{}-{}.folded'.format(os.getpid(), int(time.time())))
+        write_collapsed(path, stacks)
+        return path
+
+
+class Profiler:
+    """Profiles requests on demand, and optionally every worker continuously
+
+    A request sent with an X-Profile header (or a profile query parameter) set to cprofile or sample,
+    and an X-Profile-Secret header matching PROFILING_SECRET, runs under cProfile or the stack sampler.
+    Its profile is stored in PROFILING_DIR, as pstats or collapsed stacks, and named by the
+    X-Profile-File response header. Without PROFILING_SECRET the flags are ignored.
+
+    With PROFILING_CONTINUOUS_SECONDS, each worker samples all its threads and writes a profile
+    to PROFILING_DIR every that many seconds.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._continuous = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILING_SECRET', None)
+        app.config.setdefault('PROFILING_DIR', '/tmp/profiles')
+        app.config.setdefault('PROFILING_SAMPLE_INTERVAL_MS', 5)
+        app.config.setdefault('PROFILING_CONTINUOUS_SECONDS', 0)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    @staticmethod
+    def _requested_mode():
+        secret = current_app.config.get('PROFILING_SECRET')
+        mode = request.headers.get('X-Profile') or request.args.get('profile')
+        if not secret or mode not in PROFILE_MODES:
+            return None
+        if not hmac.compare_digest(request.headers.get('X-Profile-Secret', '').encode(), secret.encode()):
+            return None
+        return mode
+
+    def _before_request(self):
+        if current_app.config.get('PROFILING_CONTINUOUS_SECONDS'):
+            self._ensure_continuous()
+        mode = self._requested_mode()
+        if mode is None:
+            return
+        directory = current_app.config.get('PROFILING_DIR')
+        os.makedirs(directory, exist_ok=True)
+        g.profile_path = os.path.join(directory, '{}-{}-{}.{}'.format(
+            request.endpoint or 'unmatched', int(time.time()), uuid.uuid4().hex[:8],
+            'prof' if mode == 'cprofile' else 'folded'
+        ))
+        if mode == 'cprofile':
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+        else:
+            interval = current_app.config.get('PROFILING_SAMPLE_INTERVAL_MS') / 1000
+            g.profiler = StackSampler(interval, threading.get_ident()).start()
+
+    @staticmethod
+    def _after_request(response):
+        if 'profile_path' in g:
+            response.headers['X-Profile-File'] = os.path.basename(g.profile_path)
+        return response
+
+    @staticmethod
+    def _teardown_request(exception):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        if isinstance(profiler, StackSampler):
+            write_collapsed(g.profile_path, profiler.stop())
+        else:
+            profiler.disable()
+            profiler.dump_stats(g.profile_path)
+
+    def _ensure_continuous(self):
+        with self._lock:
+            # the sampling thread does not survive the fork into a gunicorn worker
+            if self._continuous is None or self._pid != os.getpid():
+                directory = current_app.config.get('PROFILING_DIR')
+                os.makedirs(directory, exist_ok=True)
+                self._continuous = ContinuousProfiler(
+                    current_app.config.get('PROFILING_SAMPLE_INTERVAL_MS') / 1000,
+                    current_app.config.get('PROFILING_CONTINUOUS_SECONDS'),
+                    directory
+                ).start()
+                self._pid = os.getpid()
+            return self._continuous
+
+    def shutdown(self):
+        """Stops the continuous profiler of this worker, writing what it sampled"""
+        with self._lock:
+            if self._continuous is not None and self._pid == os.getpid():
+                self._continuous.stop()
+            self._continuous = None
@@ -0,0 +1,217 @@
+import functools
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+
+from app.api.serialization import jsonify
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+RATE_LIMITED_MESSAGE = 'Too many requests, please try again later.'
+BUSY_MESSAGE = 'Service busy, please try again.'
+
+
+def get_client_ip(remote_addr, forwarded_for, proxy_count):
+    """Finds the client address, trusting the last proxy_count X-Forwarded-For entries
+    Any entry before them may have been made up by the client.
+    """
+    if proxy_count and forwarded_for:
+        forwarded = [address.strip() for address in forwarded_for.split(',') if address.strip()]
+        if len(forwarded) >= proxy_count:
+            return forwarded[-proxy_count]
+    return remote_addr
+
+
+class MemoryRateLimitStore:
+    """Token buckets held by the current process, the least recently used ones dropped beyond maxsize
+
+    Stands in for a shared store when a single process serves the app.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, rate, burst):
+        """Takes a token from the bucket key, refilled with rate tokens per second up to burst
+        :return: 0 if a token was taken, otherwise the seconds until one is available
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1 if not wait else tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisRateLimitStore:
+    """Token buckets shared by every process through Redis, updated atomically by a script"""
+
+    TAKE_SCRIPT = """
+        local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local tokens = math.min(burst, (tonumber(bucket[1]) or burst) + (now - (tonumber(bucket[2]) or now)) * rate)
+        local wait = 0
+        if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(wait)
+    """
+
+    def __init__(self, url, prefix='ratelimit:'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._take = self.client.register_script(self.TAKE_SCRIPT)
+
+    def take(self, key, rate, burst):
+        return float(self._take(keys=[self.prefix + key], args=[rate, burst]))
+
+    def clear(self):
+        keys = self.client.keys(self.prefix + '*')
+        if keys:
+            self.client.delete(*keys)
+
+
+class RateLimiter:
+    """Protects the routes hashing passwords from bursts
+
+    Requests are limited per client IP (RATELIMIT_IP_RATE per second, bursts of RATELIMIT_IP_BURST) and per
+    identity, e.g. the email logged into (RATELIMIT_IDENTITY_RATE, RATELIMIT_IDENTITY_BURST), answering 429.
+    At most AUTH_CONCURRENCY_LIMIT of them run at once in a process, further ones getting a 503, so that
+    threads are left for cheap requests. Both answers carry Retry-After.
+
+    RATELIMIT_URL selects the bucket store: empty for the in-process one, redis://... for Redis.
+    """
+
+    def __init__(self, app=None):
+        self.store = MemoryRateLimitStore()
+        self._lock = threading.Lock()
+        self._running = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_URL', '')
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_IP_RATE', 1.0)
+        app.config.setdefault('RATELIMIT_IP_BURST', 20)
+        app.config.setdefault('RATELIMIT_IDENTITY_RATE', 0.1)
+        app.config.setdefault('RATELIMIT_IDENTITY_BURST', 5)
+        app.config.setdefault('RATELIMIT_PROXY_COUNT', 0)
+        app.config.setdefault('AUTH_CONCURRENCY_LIMIT', 8)
+        self.store = self.create_store(app.config.get('RATELIMIT_URL'))
+
+    @staticmethod
+    def create_store(url):
+        """Creates the store for url
+        :raises ValueError: if the store is unknown or its client not installed
+        """
+        if not url:
+            return MemoryRateLimitStore()
+        if url.startswith(('redis://', 'rediss://', 'unix://')):
+            if redis is None:
+                raise ValueError('The redis package is required by RATELIMIT_URL {}.'.format(url))
+            return RedisRateLimitStore(url)
+        raise ValueError('Unknown RATELIMIT_URL {}.'.format(url))
+
+    def check(self, client_ip, identities):
+        """Takes a token from the buckets of the client and of each identity
+        :return: 0 if the request may proceed, otherwise the seconds to wait before retrying
+        """
+        config = current_app.config
+        if not config.get('RATELIMIT_ENABLED'):
+            return 0
+        wait = self.store.take('ip:' + client_ip, config.get('RATELIMIT_IP_RATE'), config.get('RATELIMIT_IP_BURST'))
+        for identity in identities:
+            wait = max(wait, self.store.take(
+                'identity:' + identity, config.get('RATELIMIT_IDENTITY_RATE'), config.get('RATELIMIT_IDENTITY_BURST')
+            ))
+        return wait
+
+    def acquire(self):
+        """Claims one of the AUTH_CONCURRENCY_LIMIT slots, without waiting
+        :return: whether a slot was free, in which case it must be released
+        """
+        limit = current_app.config.get('AUTH_CONCURRENCY_LIMIT')
+        with self._lock:
+            if limit and self._running >= limit:
+                return False
+            self._running += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._running -= 1
+
+    def limit(self, client_ip, identities):
+        """Admits a request, claiming a slot to release once it is answered
+        :return: None if admitted, otherwise the (response_object, status, headers) to answer with
+        """
+        wait = self.check(client_ip, identities)
+        if wait:
+            response_object = {
+                'status': 'error',
+                'message': RATE_LIMITED_MESSAGE
+            }
+            return response_object, 429, {'Retry-After': str(max(1, math.ceil(wait)))}
+        if not self.acquire():
+            response_object = {
+                'status': 'error',
+                'message': BUSY_MESSAGE
+            }
+            return response_object, 503, {'Retry-After': '1'}
+        return None
+
+    def clear(self):
+        self.store.clear()
+
+    def protect(self, *identity_fields):
+        """Decorates a view hashing passwords, rate limiting it per client IP and per value of
+        the identity_fields of its JSON or form payload, and shedding it when too many run at once
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                client_ip = get_client_ip(
+                    request.remote_addr, request.headers.get('X-Forwarded-For'),
+                    current_app.config.get('RATELIMIT_PROXY_COUNT')
+                )
+                payload = request.get_json(silent=True)
+                if payload is None:
+                    payload = request.form.to_dict()
+                rejected = self.limit(client_ip, get_identities(payload, identity_fields))
+                if rejected is not None:
+                    response_object, status, headers = rejected
+                    return jsonify(response_object), status, headers
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.release()
+            return wrapper
+        return decorator
+
+
+def get_identities(payload, fields):
+    """Lists the rate limiting keys of the identity fields found in a payload"""
+    if not isinstance(payload, dict):
+        return []
+    return [
+        '{}:{}'.format(field, payload[field].lower())
+        for field in fields if isinstance(payload.get(field), str)
+    ]
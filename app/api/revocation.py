@@ -0,0 +1,302 @@
+import hashlib
+import math
+import os
+import threading
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# how long stores log the jtis added, for processes to sync incrementally, see TokenDenylist.sync
+ADDED_RETENTION_SECONDS = 3600
+# how far back incremental syncs look before the previous one, covering clock skew between hosts
+SYNC_OVERLAP_SECONDS = 60
+
+
+class BloomFilter:
+    """Set membership test answering 'maybe' or a definite 'no', in constant time and memory
+
+    Sized for capacity items with a false positive rate of error_rate, items can't be removed.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class MemoryDenylistStore:
+    """Denylist held by the current process, entries expiring along with their token
+
+    Stands in for a shared store when a single process serves the app, e.g. in development and tests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._added = {}
+
+    def add(self, jti, expires_at):
+        with self._lock:
+            self._entries[jti] = expires_at
+            self._added[jti] = time.time()
+
+    def add_if_absent(self, jti, expires_at):
+        """Adds jti unless it is already there, in one step
+        :return: whether it was added
+        """
+        with self._lock:
+            current = self._entries.get(jti)
+            if current is not None and current > time.time():
+                return False
+            self._entries[jti] = expires_at
+            self._added[jti] = time.time()
+            return True
+
+    def contains(self, jti):
+        with self._lock:
+            expires_at = self._entries.get(jti)
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[jti]
+                return False
+            return expires_at is not None
+
+    def active(self):
+        """Lists the jtis of the revoked tokens that haven't expired yet"""
+        now = time.time()
+        with self._lock:
+            self._entries = {jti: expires_at for jti, expires_at in self._entries.items() if expires_at > now}
+            self._added = {
+                jti: added_at for jti, added_at in self._added.items()
+                if added_at > now - ADDED_RETENTION_SECONDS and jti in self._entries
+            }
+            return list(self._entries)
+
+    def added_since(self, since):
+        """Lists the jtis added at since or later, as long as ADDED_RETENTION_SECONDS ago"""
+        with self._lock:
+            return [jti for jti, added_at in self._added.items() if added_at >= since]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._added.clear()
+
+
+class RedisDenylistStore:
+    """Denylist shared by every process through Redis"""
+
+    def __init__(self, url, prefix='denylist:'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        # jtis scored by expiry, and by the time they were added
+        self.index = prefix + 'index'
+        self.added = prefix + 'added'
+
+    def add(self, jti, expires_at):
+        pipeline = self.client.pipeline()
+        pipeline.set(self.prefix + jti, 1, exat=math.ceil(expires_at))
+        self._index(pipeline, jti, expires_at)
+        pipeline.execute()
+
+    def add_if_absent(self, jti, expires_at):
+        if not self.client.set(self.prefix + jti, 1, nx=True, exat=math.ceil(expires_at)):
+            return False
+        pipeline = self.client.pipeline()
+        self._index(pipeline, jti, expires_at)
+        pipeline.execute()
+        return True
+
+    def _index(self, pipeline, jti, expires_at):
+        now = time.time()
+        pipeline.zadd(self.index, {jti: expires_at})
+        pipeline.zadd(self.added, {jti: now})
+        pipeline.zremrangebyscore(self.added, '-inf', now - ADDED_RETENTION_SECONDS)
+
+    def contains(self, jti):
+        return bool(self.client.exists(self.prefix + jti))
+
+    def active(self):
+        self.client.zremrangebyscore(self.index, '-inf', time.time())
+        return [jti.decode() for jti in self.client.zrange(self.index, 0, -1)]
+
+    def added_since(self, since):
+        return [jti.decode() for jti in self.client.zrangebyscore(self.added, since, '+inf')]
+
+    def clear(self):
+        self.client.delete(self.index, self.added, *self.client.keys(self.prefix + '*'))
+
+
+class TokenDenylist:
+    """Revoked token ids, checked through a Bloom filter so that tokens that aren't revoked cost no lookup
+
+    DENYLIST_URL selects the store: empty for the in-process one, redis://... for Redis.
+    Every DENYLIST_SYNC_SECONDS the filter picks up the tokens other processes revoked meanwhile, and every
+    DENYLIST_REBUILD_SECONDS it is rebuilt from the whole store, dropping expired entries. This runs on a thread
+    of each process, started by the first check, so that checks never wait for the store unless the filter matches.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        # held by one sync at a time, without blocking checks
+        self._sync_lock = threading.Lock()
+        self.store = MemoryDenylistStore()
+        self.capacity = 100000
+        self.error_rate = 0.001
+        self.sync_seconds = 1
+        self.rebuild_seconds = 3600
+        self._filter = BloomFilter(self.capacity, self.error_rate)
+        self._filter_capacity = self.capacity
+        # number of jtis in the filter, which is rebuilt larger once it exceeds its capacity
+        self._count = 0
+        self._synced_at = None
+        self._rebuilt_at = None
+        # jtis this process revoked during a rebuild, which the store read may have missed
+        self._revoked_meanwhile = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DENYLIST_URL', '')
+        app.config.setdefault('DENYLIST_BLOOM_CAPACITY', self.capacity)
+        app.config.setdefault('DENYLIST_BLOOM_ERROR_RATE', self.error_rate)
+        app.config.setdefault('DENYLIST_SYNC_SECONDS', self.sync_seconds)
+        app.config.setdefault('DENYLIST_REBUILD_SECONDS', self.rebuild_seconds)
+        self.store = self.create_store(app.config.get('DENYLIST_URL'))
+        self.capacity = app.config.get('DENYLIST_BLOOM_CAPACITY')
+        self.error_rate = app.config.get('DENYLIST_BLOOM_ERROR_RATE')
+        self.sync_seconds = app.config.get('DENYLIST_SYNC_SECONDS')
+        self.rebuild_seconds = app.config.get('DENYLIST_REBUILD_SECONDS')
+        self._synced_at = None
+
+    @staticmethod
+    def create_store(url):
+        """Creates the store for url
+        :raises ValueError: if the store is unknown or its client not installed
+        """
+        if not url:
+            return MemoryDenylistStore()
+        if url.startswith(('redis://', 'rediss://', 'unix://')):
+            if redis is None:
+                raise ValueError('The redis package is required by DENYLIST_URL {}.'.format(url))
+            return RedisDenylistStore(url)
+        raise ValueError('Unknown DENYLIST_URL {}.'.format(url))
+
+    def revoke(self, jti, expires_at):
+        """Revokes the token jti until expires_at, a timestamp"""
+        if expires_at <= time.time():
+            return
+        self.store.add(jti, expires_at)
+        self._add(jti)
+
+    def claim(self, jti, expires_at):
+        """Revokes the token jti until expires_at unless it already is, atomically across processes
+        :return: whether this call revoked it, False meaning the token was used before
+        """
+        if expires_at <= time.time():
+            return True
+        claimed = self.store.add_if_absent(jti, expires_at)
+        self._add(jti)
+        return claimed
+
+    def _add(self, jti):
+        with self._lock:
+            self._add_to_filter(jti)
+            if self._revoked_meanwhile is not None:
+                self._revoked_meanwhile.append(jti)
+
+    def _add_to_filter(self, jti):
+        if jti not in self._filter:
+            self._filter.add(jti)
+            self._count += 1
+
+    def is_revoked(self, jti):
+        self._start_syncing()
+        return jti in self._filter and self.store.contains(jti)
+
+    def sync(self):
+        """Adds the jtis revoked since the previous sync to the Bloom filter, or rebuilds it from the store
+        when it is due, over capacity, or the previous sync is older than the stores remember additions.
+        The store is read without holding the lock, which checks and revocations take.
+        """
+        with self._sync_lock:
+            started = time.time()
+            if self._needs_rebuild(started):
+                self._rebuild(started)
+            else:
+                added = self.store.added_since(self._synced_at - SYNC_OVERLAP_SECONDS)
+                with self._lock:
+                    for jti in added:
+                        self._add_to_filter(jti)
+            self._synced_at = started
+
+    def _needs_rebuild(self, now):
+        if self._synced_at is None or now - self._rebuilt_at > self.rebuild_seconds:
+            return True
+        # the store may have forgotten some of the additions since the previous sync
+        if now - self._synced_at > ADDED_RETENTION_SECONDS - SYNC_OVERLAP_SECONDS:
+            return True
+        with self._lock:
+            return self._count > self._filter_capacity
+
+    def _rebuild(self, started):
+        with self._lock:
+            self._revoked_meanwhile = []
+        try:
+            active = self.store.active()
+        except Exception:
+            with self._lock:
+                self._revoked_meanwhile = None
+            raise
+        capacity = max(self.capacity, 2 * len(active))
+        bloom = BloomFilter(capacity, self.error_rate)
+        for jti in active:
+            bloom.add(jti)
+        with self._lock:
+            for jti in self._revoked_meanwhile:
+                bloom.add(jti)
+            self._filter, self._filter_capacity = bloom, capacity
+            self._count = len(active) + len(self._revoked_meanwhile)
+            self._revoked_meanwhile = None
+            self._rebuilt_at = started
+
+    def _start_syncing(self):
+        """Starts the thread syncing the filter, once per process"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            # a forked gunicorn worker doesn't inherit its parent's thread
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._sync_forever, daemon=True).start()
+
+    def _sync_forever(self):
+        while True:
+            try:
+                self.sync()
+            except Exception:
+                # the store is unreachable, keep checking tokens against the current filter until it is back
+                pass
+            time.sleep(self.sync_seconds)
+
+    def clear(self):
+        self.store.clear()
+        with self._sync_lock:
+            self._synced_at = None
+        self.sync()
@@ -0,0 +1,76 @@
+import itertools
+from contextlib import contextmanager
+
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, _EngineConnector, get_state
+from sqlalchemy import orm
+
+from app.api.pool import PRIMARY_POOL, InstrumentedQueuePool
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+
+def get_replica_binds(config):
+    """Builds SQLALCHEMY_BINDS holding one replica_<n> bind per DATABASE_REPLICA_URLS entry"""
+    return {
+        REPLICA_BIND_PREFIX + str(index): url
+        for index, url in enumerate(config.get('DATABASE_REPLICA_URLS') or [])
+    }
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the queries made within using_replica() to a read replica
+
+    Flushes always go to the primary, so objects read from a replica can still be saved.
+    """
+
+    def __init__(self, db, **options):
+        self._db = db
+        self._replica_bind = None
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._replica_bind is not None and not self._flushing:
+            return get_state(self.app).db.get_engine(self.app, bind=self._replica_bind)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    @contextmanager
+    def using_replica(self):
+        """Routes the queries of the block to the next replica, round-robin
+        Yields whether a replica is actually used, which isn't the case when none is configured.
+        """
+        replicas = sorted(
+            key for key in (self.app.config.get('SQLALCHEMY_BINDS') or {})
+            if key.startswith(REPLICA_BIND_PREFIX)
+        )
+        if not replicas or self._replica_bind is not None:
+            yield self._replica_bind is not None
+            return
+        self._replica_bind = replicas[next(self._db.replica_counter) % len(replicas)]
+        try:
+            yield True
+        finally:
+            self._replica_bind = None
+
+
+class RoutingEngineConnector(_EngineConnector):
+    """Names the instrumented pool of each engine after its bind, so that pools are told apart in the metrics"""
+
+    def get_options(self, sa_url, echo):
+        options = _EngineConnector.get_options(self, sa_url, echo)
+        if options.get('poolclass') is InstrumentedQueuePool:
+            options.setdefault('pool_logging_name', self._bind or PRIMARY_POOL)
+        return options
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension whose sessions can read from replicas"""
+
+    def __init__(self, *args, **kwargs):
+        self.replica_counter = itertools.count()
+        super().__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def make_connector(self, app=None, bind=None):
+        return RoutingEngineConnector(self, self.get_app(app), bind)
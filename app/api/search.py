@@ -0,0 +1,130 @@
+import base64
+import bisect
+import json
+import re
+import threading
+import time
+
+WORD_PATTERN = re.compile(r'[^\W_]+')
+
+
+class SearchTimeout(Exception):
+    """Raised when a search can't be answered within USERS_SEARCH_BUDGET_MS"""
+
+
+def trigrams(text):
+    """Splits text into the trigrams pg_trgm would, words being padded with two spaces before and one after"""
+    grams = set()
+    for word in WORD_PATTERN.findall(text.lower()):
+        padded = '  ' + word + ' '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def similarity(first, second):
+    """pg_trgm's similarity() of two trigram sets, from 0 to 1"""
+    if not first or not second:
+        return 0
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+
+def encode_search_cursor(username, user_id):
+    """Encodes the position of a user in the search order, lower(username) then id"""
+    return base64.urlsafe_b64encode(json.dumps([username.lower(), user_id]).encode()).decode()
+
+
+def decode_search_cursor(cursor):
+    """Decodes a cursor produced by encode_search_cursor
+    :raises ValueError: if the cursor is malformed
+    :return: (lower username, user id) tuple
+    """
+    try:
+        username, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return str(username), int(user_id)
+    except Exception:
+        raise ValueError('Invalid cursor.')
+
+
+class SearchIndex:
+    """In-process user search index, for databases without pg_trgm
+
+    Users are kept sorted like search results, by lower(username) then id, and matched like on Postgres:
+    username or email containing the query, or username similar to it (USERS_SEARCH_SIMILARITY).
+    The index is rebuilt when the users table version changes, which is checked at most every
+    USERS_SEARCH_REFRESH_SECONDS, so that a stream of writes doesn't reload the users on every search.
+    A search scans it from the cursor on, stopping once USERS_SEARCH_BUDGET_MS have passed with the
+    results found so far.
+    """
+
+    # entries scanned between two deadline checks
+    CHECK_EVERY = 256
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        # (keys, entries), swapped at once so that searches never see the keys of another version
+        self._index = ([], [])
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USERS_SEARCH_PAGE_SIZE', 20)
+        app.config.setdefault('USERS_SEARCH_MAX_PAGE_SIZE', 100)
+        app.config.setdefault('USERS_SEARCH_BUDGET_MS', 100)
+        app.config.setdefault('USERS_SEARCH_SIMILARITY', 0.3)
+        app.config.setdefault('USERS_SEARCH_REFRESH_SECONDS', 5)
+
+    def refresh(self, get_version, load_rows, interval=0):
+        """Rebuilds the index from load_rows() if get_version() changed, checking at most every interval seconds
+        Searches go on with the current index while another thread refreshes it.
+        :param get_version: function returning the users table version
+        :param load_rows: function returning User.DATA_FIELDS dicts
+        """
+        if self._version is not None and time.monotonic() - self._checked_at < interval:
+            return
+        # only the first build is waited for
+        if not self._lock.acquire(blocking=self._version is None):
+            return
+        try:
+            if self._version is not None and time.monotonic() - self._checked_at < interval:
+                return
+            version = get_version()
+            if version != self._version:
+                entries = sorted(
+                    ((data['username'].lower(), data['id']), data['email'].lower(), trigrams(data['username']), data)
+                    for data in load_rows()
+                )
+                self._index = ([entry[0] for entry in entries], entries)
+                self._version = version
+            self._checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def search(self, query, limit, threshold, after=None, budget_ms=None):
+        """Finds up to limit users matching query past the after position
+        :return: (users, position) tuple, position being the key to continue from, None if the scan is over
+        """
+        keys, entries = self._index
+        query = query.lower()
+        query_trigrams = trigrams(query)
+        deadline = time.perf_counter() + budget_ms / 1000 if budget_ms else None
+        start = bisect.bisect_right(keys, tuple(after)) if after is not None else 0
+        users = []
+        for index in range(start, len(entries)):
+            if (deadline is not None and index > start and (index - start) % self.CHECK_EVERY == 0
+                    and time.perf_counter() > deadline):
+                return users, keys[index - 1]
+            key, email, username_trigrams, data = entries[index]
+            if query in key[0] or query in email or similarity(query_trigrams, username_trigrams) >= threshold:
+                users.append(dict(data))
+                if len(users) == limit:
+                    return users, key if index + 1 < len(entries) else None
+        return users, None
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._checked_at = 0.0
+            self._index = ([], [])
@@ -0,0 +1,110 @@
+import datetime
+import json
+from json.encoder import encode_basestring
+
+from flask import current_app
+from flask.json import JSONEncoder as BaseJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def format_datetime(value):
+    """Formats a datetime as ISO-8601, naive datetimes being UTC"""
+    if value.tzinfo is None:
+        return value.isoformat() + '+00:00'
+    return value.isoformat()
+
+
+def _default(obj):
+    if isinstance(obj, datetime.datetime):
+        return format_datetime(obj)
+    if isinstance(obj, datetime.date):
+        return obj.isoformat()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NAIVE_UTC).decode()
+
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj, default=_default, ensure_ascii=False)
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+BACKENDS = {
+    'orjson': _orjson_dumps if orjson else None,
+    'ujson': _ujson_dumps if ujson else None,
+    'json': _json_dumps
+}
+
+_dumps = BACKENDS['orjson'] or BACKENDS['ujson'] or BACKENDS['json']
+
+
+def set_backend(name):
+    """Selects the JSON encoder: orjson, ujson, json, or auto for the fastest one installed
+    :raises ValueError: if the backend is unknown or not installed
+    """
+    global _dumps
+    if name == 'auto':
+        _dumps = BACKENDS['orjson'] or BACKENDS['ujson'] or BACKENDS['json']
+    elif BACKENDS.get(name):
+        _dumps = BACKENDS[name]
+    else:
+        raise ValueError('JSON backend {} is not available.'.format(name))
+
+
+def dumps(obj):
+    """Serialises obj with the selected JSON encoder
+    :rtype: string
+    """
+    return _dumps(obj)
+
+
+def jsonify(obj):
+    """Creates a JSON response, like flask.jsonify, with the selected JSON encoder"""
+    return current_app.response_class(dumps(obj), mimetype='application/json')
+
+
+class JSONEncoder(BaseJSONEncoder):
+    """Encoder used by flask.json, formatting datetimes the same way as dumps"""
+
+    def default(self, o):
+        if isinstance(o, datetime.date):
+            return _default(o)
+        return super().default(o)
+
+
+def _encode_value(value):
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return '"' + format_datetime(value) + '"'
+    return dumps(value)
+
+
+def compile_row_encoder(fields):
+    """Compiles a function encoding row tuples as JSON objects keyed by fields, without building dicts
+    :param fields: names of the row columns, in order
+    """
+    template = '{' + ','.join(encode_basestring(field) + ':%s' for field in fields) + '}'
+
+    def encode(row):
+        return template % tuple(map(_encode_value, row))
+    return encode
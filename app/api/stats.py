@@ -0,0 +1,34 @@
+import threading
+
+
+class Timing:
+    """Aggregates durations, in seconds, passing each of them on to its subscribers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def subscribe(self, callback):
+        """Calls callback with every duration observed from now on"""
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def observe(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+        for callback in self._subscribers:
+            callback(seconds)
+
+    def get_data(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'total': self.total,
+                'mean': self.total / self.count if self.count else 0.0,
+                'max': self.max
+            }
@@ -0,0 +1,69 @@
+import re
+
+from flask import current_app, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+EMAIL_PATTERN = r'[^@\s]+@[^@\s]+\.[^@\s]+'
+
+
+def compile_schema(fields):
+    """Compiles a function validating payloads holding exactly the given string fields
+    :param fields: dict of field name to (min length, max length, pattern or None)
+    :return: function returning the payload, or raising ValueError if it is invalid
+    """
+    names = frozenset(fields)
+    checks = tuple(
+        (name, min_length, max_length, re.compile(pattern).fullmatch if pattern else None)
+        for name, (min_length, max_length, pattern) in fields.items()
+    )
+
+    def validate(payload):
+        if not isinstance(payload, dict) or payload.keys() != names:
+            raise ValueError('Invalid payload.')
+        for name, min_length, max_length, match in checks:
+            value = payload[name]
+            if (not isinstance(value, str) or not min_length <= len(value) <= max_length
+                    or match is not None and match(value) is None):
+                raise ValueError('Invalid {}.'.format(name))
+        return payload
+    return validate
+
+
+validate_user = compile_schema({
+    'username': (1, 128, None),
+    'email': (3, 128, EMAIL_PATTERN),
+    'password': (1, 256, None)
+})
+
+validate_login = compile_schema({
+    'email': (1, 128, None),
+    'password': (1, 256, None)
+})
+
+
+def check_payload_size(size):
+    """Rejects payloads larger than USERS_MAX_PAYLOAD_BYTES
+    :raises RequestEntityTooLarge: if size is larger
+    """
+    if size is not None and size > current_app.config.get('USERS_MAX_PAYLOAD_BYTES'):
+        raise RequestEntityTooLarge
+
+
+def get_json_payload(validate):
+    """Reads and validates the JSON payload of the current request, before anything is hashed
+    :param validate: compiled schema
+    :raises RequestEntityTooLarge: if the payload is larger than USERS_MAX_PAYLOAD_BYTES
+    :raises ValueError: if the payload is invalid
+    """
+    check_payload_size(request.content_length)
+    check_payload_size(len(request.get_data(cache=True)))
+    return validate(request.get_json(silent=True))
+
+
+def get_form_payload(validate, fields):
+    """Reads and validates the given fields of the current request's form, like get_json_payload
+    :raises RequestEntityTooLarge: if the form is larger than USERS_MAX_PAYLOAD_BYTES
+    :raises ValueError: if the payload is invalid, e.g. a field is missing
+    """
+    check_payload_size(request.content_length)
+    return validate({field: request.form.get(field) for field in fields})
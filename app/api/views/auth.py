@@ -1,24 +1,29 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request
 from sqlalchemy import exc
 from sqlalchemy.orm.exc import NoResultFound
 
-from app.api.models import User
+from app import limiter
+from app.api.models import User, UserAlreadyExists
+from app.api.serialization import jsonify
+from app.api.validation import get_json_payload, validate_login, validate_user
 
 auth_blueprint = Blueprint('auth', __name__)
 
 
 @auth_blueprint.route('/auth/register', methods=['POST'])
+@limiter.protect('username', 'email')
 def register_user():
     try:
-        user = User(**request.get_json())
-        user.save()
+        user = User.create(**get_json_payload(validate_user))
+        auth_token, refresh_token = User.encode_auth_tokens(user['id'])
         response_object = {
             'status': 'success',
-            'data': user.get_data(),
-            'token': user.encode_auth_token(user.id).decode()
+            'data': user,
+            'token': auth_token.decode(),
+            'refresh_token': refresh_token.decode()
         }
         return jsonify(response_object), 201
-    except exc.IntegrityError:
+    except (UserAlreadyExists, exc.IntegrityError):
         response_object = {
             'status': 'error',
             'message': 'User already exists.'
@@ -33,13 +38,16 @@ def register_user():
 
 
 @auth_blueprint.route('/auth/login', methods=['POST'])
+@limiter.protect('email')
 def login_user():
     try:
-        user = User.login(**request.get_json())
+        user = User.login(**get_json_payload(validate_login))
+        auth_token, refresh_token = User.encode_auth_tokens(user.id)
         response_object = {
             'status': 'success',
             'message': 'Successfully logged in.',
-            'token': user.encode_auth_token(user.id).decode()
+            'token': auth_token.decode(),
+            'refresh_token': refresh_token.decode()
         }
         return jsonify(response_object), 200
     except NoResultFound:
@@ -56,10 +64,35 @@ def login_user():
         return jsonify(response_object), 400
 
 
+@auth_blueprint.route('/auth/refresh', methods=['POST'])
+def refresh_token():
+    try:
+        response = User.refresh_auth_token(request.get_json()['refresh_token'])
+    except (KeyError, TypeError):
+        response_object = {
+            'status': 'error',
+            'message': 'Invalid payload.'
+        }
+        return jsonify(response_object), 400
+    if isinstance(response, str):
+        response_object = {
+            'status': 'error',
+            'message': response
+        }
+        return jsonify(response_object), 401
+    response_object = {
+        'status': 'success',
+        'message': 'Successfully refreshed.',
+        'token': response[0],
+        'refresh_token': response[1]
+    }
+    return jsonify(response_object), 200
+
+
 @auth_blueprint.route('/auth/logout', methods=['GET'])
 def logout_user():
     headers_token = User.get_token_from_authorization_header(request.headers.get('Authorization'))
-    response = User.decode_auth_token(headers_token)
+    response = User.revoke_auth_token(headers_token)
     if isinstance(response, str):
         response_object = {
             'status': 'error',
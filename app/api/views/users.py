@@ -1,10 +1,19 @@
-from flask import Blueprint, jsonify, request, render_template
+from flask import Blueprint, Response, current_app, request, render_template, stream_with_context
 from sqlalchemy import exc
-from app import db
-from app.api.models import User
+from werkzeug.exceptions import RequestEntityTooLarge
+from app import db, limiter, user_events
+from app.api.caching import cache_headers, make_etag, not_modified
+from app.api.importing import iter_ndjson
+from app.api.models import User, UserAlreadyExists, listen_user_events
+from app.api.pagination import parse_bool, parse_ids, parse_limit
+from app.api.search import SearchTimeout
+from app.api.serialization import compile_row_encoder, jsonify
+from app.api.validation import get_form_payload, get_json_payload, validate_user
 
 users_blueprint = Blueprint('users', __name__,  template_folder='../templates')
 
+encode_user_row = compile_row_encoder(User.DATA_FIELDS)
+
 
 def client_prefers_html():
     """Checks if client accepts JSON as a response format"""
@@ -13,6 +22,15 @@ def client_prefers_html():
     return best == 'text/html' and request.accept_mimetypes[best] > request.accept_mimetypes['application/json']
 
 
+@users_blueprint.app_errorhandler(RequestEntityTooLarge)
+def payload_too_large(e):
+    response_object = {
+        'status': 'fail',
+        'message': 'Payload too large.'
+    }
+    return jsonify(response_object), 413
+
+
 @users_blueprint.route('/ping', methods=['GET'])
 def ping_pong():
     return jsonify({
@@ -22,25 +40,17 @@ def ping_pong():
 
 
 @users_blueprint.route('/users', methods=['POST'])
+@limiter.protect('username', 'email')
 def add_user():
-    """Add a user to the database."""
-    if 'application/json' not in request.content_type:
-        User(
-            username=request.form['username'],
-            email=request.form['email'],
-            password=request.form['password'],
-        ).save()
-        return render_template('users.html', users=User.get_all_users())
-
+    """Add a user to the database, from a JSON payload or the HTML form."""
+    form = 'application/json' not in (request.content_type or '')
     try:
-        user = User(**request.get_json())
-        user.save()
-        response_object = {
-            'status': 'success',
-            'data': user.get_data()
-        }
-        return jsonify(response_object), 201
-    except exc.IntegrityError:
+        if form:
+            payload = get_form_payload(validate_user, ('username', 'email', 'password'))
+        else:
+            payload = get_json_payload(validate_user)
+        user = User.create(**payload)
+    except (UserAlreadyExists, exc.IntegrityError):
         response_object = {
             'status': 'fail',
             'message': 'User already exists.'
@@ -52,12 +62,110 @@ def add_user():
                 'message': 'Invalid payload.'
             }
         return jsonify(response_object), 400
+    if form:
+        return render_template('users.html', users=User.get_all_users())
+    response_object = {
+        'status': 'success',
+        'data': user
+    }
+    return jsonify(response_object), 201
+
+
+@users_blueprint.route('/users/bulk', methods=['POST'])
+@limiter.protect()
+def bulk_add_users():
+    """Add many users from a JSON array or an NDJSON stream, reporting the rows that failed."""
+    if request.mimetype == 'application/x-ndjson':
+        records = iter_ndjson(request.stream)
+    else:
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            response_object = {
+                'status': 'fail',
+                'message': 'Invalid payload.'
+            }
+            return jsonify(response_object), 400
+    created, errors = User.bulk_create(records, current_app.config.get('USERS_IMPORT_BATCH_SIZE'))
+    response_object = {
+        'status': 'success',
+        'data': {
+            'created': created,
+            'errors': errors
+        }
+    }
+    return jsonify(response_object), 200
+
+
+@users_blueprint.route('/users/search', methods=['GET'])
+def search_users():
+    """Search users by username or email, e.g. for autocompletion, with ?q= then ?cursor= for the next page"""
+    query = request.args.get('q', '').strip()
+    try:
+        if not 0 < len(query) <= 128:
+            raise ValueError
+        limit = parse_limit(
+            request.args.get('limit'),
+            current_app.config.get('USERS_SEARCH_PAGE_SIZE'),
+            current_app.config.get('USERS_SEARCH_MAX_PAGE_SIZE')
+        )
+        users, next_cursor = User.search(query, limit, request.args.get('cursor'))
+    except ValueError:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid search parameters.'
+        }
+        return jsonify(response_object), 400
+    except SearchTimeout:
+        response_object = {
+            'status': 'error',
+            'message': 'Search timed out, please refine the query.'
+        }
+        return jsonify(response_object), 503
+    response_object = {
+        'status': 'success',
+        'data': {
+            'users': users,
+            'next_cursor': next_cursor
+        }
+    }
+    return jsonify(response_object), 200
+
+
+@users_blueprint.route('/users/events', methods=['GET'])
+def stream_user_events():
+    """Stream user creations and updates as Server-Sent Events, resuming after the Last-Event-ID header
+    (or ?last_event_id=) when given. A reset event asks the client to reload the users, some events being lost.
+    """
+    # a sync worker would serve nothing else for as long as the stream stays open
+    if not request.environ.get('wsgi.multithread'):
+        message = 'Event streams are served by threaded workers or the ASGI app only.'
+    elif not user_events.open_stream(current_app.config.get('USERS_EVENTS_WSGI_STREAMS')):
+        message = 'Too many event streams, retry later.'
+    else:
+        message = None
+    if message:
+        response_object = {
+            'status': 'fail',
+            'message': message
+        }
+        return jsonify(response_object), 503
+    listen_user_events()
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    messages = user_events.stream(last_event_id, current_app.config.get('USERS_EVENTS_HEARTBEAT_SECONDS'))
+    response = Response(messages, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # don't let nginx buffer the stream
+        'X-Accel-Buffering': 'no'
+    })
+    # the server closes the response once the client is gone, even if the stream never started
+    response.call_on_close(user_events.close_stream)
+    return response
 
 
 @users_blueprint.route('/users/<uid>', methods=['GET'])
 def get_user(uid):
-    """Get a single user"""
-    user = User.get_by_id(user_id=uid)
+    """Get a single user, answering 304 when the client's copy is still current"""
+    user, etag = User.get_by_id_with_etag(user_id=uid)
     if not user:
         response_object = {
             'status': 'fail',
@@ -65,23 +173,112 @@ def get_user(uid):
         }
         return jsonify(response_object), 404
     else:
+        response = not_modified(etag)
+        if response is not None:
+            return response
         response_object = {
             'status': 'success',
             'data': user
         }
-        return jsonify(response_object), 200
+        return jsonify(response_object), 200, cache_headers(etag)
+
+
+@users_blueprint.route('/users/lookup', methods=['POST'])
+def lookup_users():
+    """Get many users by id, the ids being posted as {"ids": [...]} for lists too long for a query string"""
+    payload = request.get_json(silent=True)
+    return get_users_by_ids(payload.get('ids') if isinstance(payload, dict) else None)
+
+
+def get_users_by_ids(ids):
+    """Answers with the users of the given ids keyed by id, in the requested order, and the ids not found"""
+    try:
+        user_ids = parse_ids(ids, current_app.config.get('USERS_MAX_BATCH_SIZE'))
+    except ValueError:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid ids, at most {} can be requested.'.format(current_app.config.get('USERS_MAX_BATCH_SIZE'))
+        }
+        return jsonify(response_object), 400
+    users, missing = User.get_by_ids(user_ids)
+    response_object = {
+        'status': 'success',
+        'data': {
+            'users': {str(user_id): user for user_id, user in users.items()},
+            'missing': missing
+        }
+    }
+    return jsonify(response_object), 200
+
+
+def stream_users(stream_format, headers):
+    """Streams all users as NDJSON or as a chunked JSON array"""
+    rows = User.iter_user_rows(current_app.config.get('USERS_STREAM_BATCH_SIZE'))
+
+    def generate_ndjson():
+        for row in rows:
+            yield encode_user_row(row) + '\n'
+
+    def generate_json():
+        yield '{"status":"success","data":{"users":['
+        separator = ''
+        for row in rows:
+            yield separator + encode_user_row(row)
+            separator = ','
+        yield ']}}'
+
+    if stream_format == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson', headers=headers)
+    return Response(stream_with_context(generate_json()), mimetype='application/json', headers=headers)
 
 
 @users_blueprint.route('/users', methods=['GET'])
 def get_all_users():
-    """Get all users"""
-    users = User.get_all_users()
+    """Get all users, one page at a time (?active=true|false to filter), or streamed with ?stream=ndjson|json
+    Listings are tagged with the users table version, so that 304s skip both the query and the serialisation.
+    ?ids=1,2,3 gets these users only, like POST /users/lookup.
+    """
+    if 'ids' in request.args:
+        return get_users_by_ids(request.args.get('ids'))
+    # the version and the listing are read from the same replica
+    with db.session().using_replica():
+        return list_users()
+
+
+def list_users():
+    html = client_prefers_html()
+    etag = make_etag('users', User.get_users_version(), html, sorted(request.args.items(multi=True)))
+    response = not_modified(etag, vary='Accept')
+    if response is not None:
+        return response
+    headers = cache_headers(etag, vary='Accept')
+    if html:
+        return render_template('users.html', users=User.get_all_users()), 200, headers
+    stream_format = request.args.get('stream')
+    try:
+        if stream_format:
+            if stream_format not in ('ndjson', 'json'):
+                raise ValueError
+            return stream_users(stream_format, headers)
+        limit = parse_limit(
+            request.args.get('limit'),
+            current_app.config.get('USERS_PAGE_SIZE'),
+            current_app.config.get('USERS_MAX_PAGE_SIZE')
+        )
+        users, next_cursor = User.get_users_page(
+            limit, request.args.get('cursor'), parse_bool(request.args.get('active'))
+        )
+    except ValueError:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid pagination parameters.'
+        }
+        return jsonify(response_object), 400
     response_object = {
         'status': 'success',
         'data': {
-          'users': users
+          'users': users,
+          'next_cursor': next_cursor
         }
     }
-    if client_prefers_html():
-        return render_template('users.html', users=users)
-    return jsonify(response_object), 200
+    return jsonify(response_object), 200, headers
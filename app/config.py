@@ -8,15 +8,89 @@ class BaseConfig:
     TESTING = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+    DATABASE_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT', 30))
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+    DATABASE_POOL_PRE_PING = os.environ.get('DATABASE_POOL_PRE_PING', 'true') == 'true'
+    DATABASE_STATEMENT_TIMEOUT_MS = int(os.environ.get('DATABASE_STATEMENT_TIMEOUT_MS', 0))
+    DATABASE_PGBOUNCER = os.environ.get('DATABASE_PGBOUNCER', 'false') == 'true'
+    DATABASE_REPLICA_URLS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+    # retry lookups the replica misses on the primary, e.g. when other processes write and replicas lag
+    DATABASE_REPLICA_RETRY_MISSES = os.environ.get('DATABASE_REPLICA_RETRY_MISSES', 'false') == 'true'
+    READ_YOUR_WRITES_SIZE = int(os.environ.get('READ_YOUR_WRITES_SIZE', 10000))
+    READ_YOUR_WRITES_TTL_SECONDS = int(os.environ.get('READ_YOUR_WRITES_TTL_SECONDS', 5))
+    # cookie sending the lookups of a client that just wrote to the primary, whichever worker serves them
+    READ_YOUR_WRITES_COOKIE = os.environ.get('READ_YOUR_WRITES_COOKIE', 'last_write')
     SECRET_KEY = 'my_precious'
-    BCRYPT_LOG_ROUNDS = 13
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 13))
+    PASSWORD_HASH_SCHEME = os.environ.get('PASSWORD_HASH_SCHEME', 'bcrypt')
+    ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', 3))
+    ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', 65536))
+    ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', 1))
+    # the cores are shared by the GUNICORN_WORKERS processes, each running its own hashing pool
+    PASSWORD_HASHING_WORKERS = int(os.environ.get(
+        'PASSWORD_HASHING_WORKERS', max(1, os.cpu_count() // int(os.environ.get('GUNICORN_WORKERS', 1)))
+    ))
+    PASSWORD_HASHING_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASHING_QUEUE_SIZE', 16))
     JWT_EXPIRATION_TIME_SECONDS = os.environ.get('JWT_EXPIRATION_TIME_SECONDS', 3600)
+    REFRESH_TOKEN_EXPIRATION_TIME_SECONDS = int(os.environ.get('REFRESH_TOKEN_EXPIRATION_TIME_SECONDS', 30 * 24 * 3600))
+    REFRESH_TOKEN_ROTATION = os.environ.get('REFRESH_TOKEN_ROTATION', 'true') == 'true'
+    AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 10000))
+    DENYLIST_URL = os.environ.get('DENYLIST_URL', '')
+    DENYLIST_BLOOM_CAPACITY = int(os.environ.get('DENYLIST_BLOOM_CAPACITY', 100000))
+    DENYLIST_BLOOM_ERROR_RATE = float(os.environ.get('DENYLIST_BLOOM_ERROR_RATE', 0.001))
+    DENYLIST_SYNC_SECONDS = int(os.environ.get('DENYLIST_SYNC_SECONDS', 1))
+    DENYLIST_REBUILD_SECONDS = int(os.environ.get('DENYLIST_REBUILD_SECONDS', 3600))
+    RATELIMIT_URL = os.environ.get('RATELIMIT_URL', '')
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'true') == 'true'
+    RATELIMIT_IP_RATE = float(os.environ.get('RATELIMIT_IP_RATE', 1.0))
+    RATELIMIT_IP_BURST = int(os.environ.get('RATELIMIT_IP_BURST', 20))
+    RATELIMIT_IDENTITY_RATE = float(os.environ.get('RATELIMIT_IDENTITY_RATE', 0.1))
+    RATELIMIT_IDENTITY_BURST = int(os.environ.get('RATELIMIT_IDENTITY_BURST', 5))
+    RATELIMIT_PROXY_COUNT = int(os.environ.get('RATELIMIT_PROXY_COUNT', 0))
+    AUTH_CONCURRENCY_LIMIT = int(os.environ.get('AUTH_CONCURRENCY_LIMIT', 8))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', 5))
+    JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+    COMPRESS_CACHE_SIZE = int(os.environ.get('COMPRESS_CACHE_SIZE', 256))
+    COMPRESS_CACHE_TTL_SECONDS = int(os.environ.get('COMPRESS_CACHE_TTL_SECONDS', 300))
+    USERS_CACHE_CONTROL = os.environ.get('USERS_CACHE_CONTROL', 'public, no-cache')
+    USERS_MAX_PAYLOAD_BYTES = int(os.environ.get('USERS_MAX_PAYLOAD_BYTES', 4096))
+    USERS_PAGE_SIZE = int(os.environ.get('USERS_PAGE_SIZE', 100))
+    USERS_MAX_PAGE_SIZE = int(os.environ.get('USERS_MAX_PAGE_SIZE', 1000))
+    USERS_MAX_BATCH_SIZE = int(os.environ.get('USERS_MAX_BATCH_SIZE', 100))
+    USERS_SEARCH_PAGE_SIZE = int(os.environ.get('USERS_SEARCH_PAGE_SIZE', 20))
+    USERS_SEARCH_MAX_PAGE_SIZE = int(os.environ.get('USERS_SEARCH_MAX_PAGE_SIZE', 100))
+    USERS_SEARCH_BUDGET_MS = int(os.environ.get('USERS_SEARCH_BUDGET_MS', 100))
+    USERS_SEARCH_SIMILARITY = float(os.environ.get('USERS_SEARCH_SIMILARITY', 0.3))
+    USERS_SEARCH_REFRESH_SECONDS = int(os.environ.get('USERS_SEARCH_REFRESH_SECONDS', 5))
+    USERS_EVENTS_BUFFER_SIZE = int(os.environ.get('USERS_EVENTS_BUFFER_SIZE', 1000))
+    USERS_EVENTS_HEARTBEAT_SECONDS = int(os.environ.get('USERS_EVENTS_HEARTBEAT_SECONDS', 15))
+    USERS_EVENTS_CHANNEL = os.environ.get('USERS_EVENTS_CHANNEL', 'users_events')
+    # direct connection LISTENing to the events of other processes, defaults to DATABASE_URL
+    USERS_EVENTS_LISTEN_URL = os.environ.get('USERS_EVENTS_LISTEN_URL')
+    # each stream holds a thread of a gthread worker for good, leave half of them to the other requests
+    USERS_EVENTS_WSGI_STREAMS = int(os.environ.get(
+        'USERS_EVENTS_WSGI_STREAMS', max(1, int(os.environ.get('GUNICORN_THREADS', 1)) // 2)
+    ))
+    USERS_STREAM_BATCH_SIZE = int(os.environ.get('USERS_STREAM_BATCH_SIZE', 1000))
+    USERS_IMPORT_BATCH_SIZE = int(os.environ.get('USERS_IMPORT_BATCH_SIZE', 1000))
+    ASGI_EXECUTOR_WORKERS = int(os.environ.get('ASGI_EXECUTOR_WORKERS', 32))
+    PROFILING_SECRET = os.environ.get('PROFILING_SECRET')
+    PROFILING_DIR = os.environ.get('PROFILING_DIR', '/tmp/profiles')
+    PROFILING_SAMPLE_INTERVAL_MS = int(os.environ.get('PROFILING_SAMPLE_INTERVAL_MS', 5))
+    PROFILING_CONTINUOUS_SECONDS = int(os.environ.get('PROFILING_CONTINUOUS_SECONDS', 0))
 
 
 class DevelopmentConfig(BaseConfig):
     """Development configuration"""
     DEBUG = True
     BCRYPT_LOG_ROUNDS = 4
+    PASSWORD_HASHING_WORKERS = 0
 
 
 class TestingConfig(BaseConfig):
@@ -25,9 +99,17 @@ class TestingConfig(BaseConfig):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL')
     BCRYPT_LOG_ROUNDS = 4
+    PASSWORD_HASHING_WORKERS = 0
     JWT_EXPIRATION_TIME_SECONDS = 1
+    RATELIMIT_ENABLED = False
+    USERS_SEARCH_REFRESH_SECONDS = 0
+    USERS_EVENTS_WSGI_STREAMS = 1
 
 
 class ProductionConfig(BaseConfig):
     """Production configuration"""
     DEBUG = False
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 10))
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 20))
+    DATABASE_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT', 5))
+    DATABASE_STATEMENT_TIMEOUT_MS = int(os.environ.get('DATABASE_STATEMENT_TIMEOUT_MS', 10000))
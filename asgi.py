@@ -0,0 +1,5 @@
+# asgi.py
+from app import create_app
+from app.api.asgi import create_asgi_app
+
+app = create_asgi_app(create_app())
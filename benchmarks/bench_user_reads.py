@@ -0,0 +1,81 @@
+"""Compares the ORM entity and the column projected read paths of the users listing
+
+    $ python -m benchmarks.bench_user_reads --users 100000 --database sqlite:////tmp/bench.db
+"""
+import argparse
+import os
+import time
+import tracemalloc
+
+os.environ.setdefault('APP_SETTINGS', 'app.config.TestingConfig')
+
+from app import create_app, db  # noqa: E402
+from app.api.models import User  # noqa: E402
+from benchmarks.utils import seed_users  # noqa: E402
+
+# bcrypt hash of 'test', users are inserted directly so there's no need to hash anything
+PASSWORD_HASH = '$2b$04$OezVSXvFjGZB/tIEg6H2wuxaDhUS5Ro.j2.Vfjd.pImsBPw/JmaAW'
+
+
+def orm_path():
+    """The listing as it used to be: full entities, then get_data()"""
+    return [user.get_data() for user in User.query.order_by(User.created_at.desc(), User.id.desc()).all()]
+
+
+def projected_path():
+    return User.get_all_users()
+
+
+def measure(name, func, count):
+    """Times func, then runs it again under tracemalloc to get its peak memory"""
+    db.session.remove()
+    started = time.perf_counter()
+    users = func()
+    elapsed = time.perf_counter() - started
+    assert len(users) == count
+    del users
+    db.session.remove()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.session.remove()
+    return {
+        'name': name,
+        'rows_per_second': count / elapsed,
+        'seconds': elapsed,
+        'peak_memory_bytes': peak,
+        'memory_per_100k_users_bytes': peak * 100000 / count
+    }
+
+
+def run(users=100000, database='sqlite://', repeat=3):
+    """Runs both paths repeat times against database, returning the best run of each"""
+    app = create_app()
+    app.config['SQLALCHEMY_DATABASE_URI'] = database
+    app.config['SQLALCHEMY_BINDS'] = {}
+    with app.app_context():
+        seed_users(users, PASSWORD_HASH)
+        results = []
+        for name, func in (('orm', orm_path), ('projected', projected_path)):
+            runs = [measure(name, func, users) for _ in range(repeat)]
+            results.append(min(runs, key=lambda result: result['seconds']))
+        db.drop_all()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--database', default='sqlite://')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print('{:<10} {:>12} {:>10} {:>22}'.format('path', 'rows/s', 'seconds', 'MB per 100k users'))
+    for result in run(args.users, args.database, args.repeat):
+        print('{name:<10} {rows_per_second:>12,.0f} {seconds:>10.3f} {mb:>22.1f}'.format(
+            mb=result['memory_per_100k_users_bytes'] / 1024 / 1024, **result
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Load benchmarks driving every users and auth route over HTTP"""
+import http.client
+import itertools
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+from app.api.models import User
+from benchmarks.server import SEEDED_PASSWORD
+from benchmarks.utils import percentile
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class Scenario:
+    """One request to replay, rule and method identifying the route it covers
+    Streams of Server-Sent Events (stream) are read up to their first event, then closed.
+    """
+
+    def __init__(self, rule, method, path, expected_status, body=None, headers=None, stream=False):
+        self.rule = rule
+        self.method = method
+        self.path = path
+        self.expected_status = expected_status
+        self.body = body
+        self.headers = headers or {}
+        self.stream = stream
+
+    @property
+    def name(self):
+        return '{} {}'.format(self.method, self.path)
+
+    def get_body(self):
+        return self.body() if callable(self.body) else self.body
+
+    def get_headers(self):
+        return self.headers() if callable(self.headers) else self.headers
+
+
+def get_scenarios(token, user_id, new_tokens=None):
+    """Lists the scenarios, authenticated requests using token and user lookups user_id
+    Logging out and refreshing revoke their token, so each of them uses one of the (token, refresh token)
+    pairs returned by new_tokens.
+    """
+    counter = itertools.count()
+    auth_headers = {'Authorization': 'Bearer ' + token}
+    new_tokens = new_tokens or (lambda: (token, token))
+
+    def new_user():
+        index = next(counter)
+        return json.dumps({
+            'username': 'bench{}-{}'.format(time.time(), index),
+            'email': 'bench{}-{}@example.com'.format(time.time(), index),
+            'password': SEEDED_PASSWORD
+        })
+
+    return [
+        Scenario('/ping', 'GET', '/ping', 200),
+        Scenario('/users/<uid>', 'GET', '/users/{}'.format(user_id), 200),
+        Scenario('/users', 'GET', '/users', 200),
+        Scenario('/users', 'GET', '/users?stream=ndjson', 200),
+        Scenario('/users', 'GET', '/users?ids={}'.format(','.join(str(user_id + i) for i in range(20))), 200),
+        Scenario('/users/search', 'GET', '/users/search?q=user1', 200),
+        Scenario('/users/events', 'GET', '/users/events', 200, stream=True),
+        Scenario('/users/lookup', 'POST', '/users/lookup', 200, json.dumps({
+            'ids': [user_id + i for i in range(100)]
+        }), JSON_HEADERS),
+        Scenario('/users', 'POST', '/users', 201, new_user, JSON_HEADERS),
+        Scenario('/users/bulk', 'POST', '/users/bulk', 200, lambda: '[{}]'.format(new_user()), JSON_HEADERS),
+        Scenario('/auth/register', 'POST', '/auth/register', 201, new_user, JSON_HEADERS),
+        Scenario('/auth/login', 'POST', '/auth/login', 200, json.dumps({
+            'email': 'user0@example.com',
+            'password': SEEDED_PASSWORD
+        }), JSON_HEADERS),
+        Scenario('/auth/status', 'GET', '/auth/status', 200, headers=auth_headers),
+        Scenario('/auth/logout', 'GET', '/auth/logout', 200, headers=lambda: {
+            'Authorization': 'Bearer ' + new_tokens()[0]
+        }),
+        Scenario('/auth/refresh', 'POST', '/auth/refresh', 200, lambda: json.dumps({
+            'refresh_token': new_tokens()[1]
+        }), JSON_HEADERS),
+    ]
+
+
+def get_uncovered_routes(app, scenarios):
+    """Lists the users and auth routes no scenario exercises"""
+    covered = {(scenario.rule, scenario.method) for scenario in scenarios}
+    uncovered = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint.split('.')[0] not in ('users', 'auth'):
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            if (rule.rule, method) not in covered:
+                uncovered.append('{} {}'.format(method, rule.rule))
+    return uncovered
+
+
+def request(connection, method, path, body, headers, stream=False):
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    if not stream:
+        response.read()
+        return response.status
+    received = b''
+    while response.status == 200 and b'event: ' not in received:
+        chunk = response.read1()
+        if not chunk:
+            break
+        received += chunk
+    # the stream never ends, the next request opens a new connection
+    connection.close()
+    return response.status
+
+
+def login(base_url):
+    """Logs the first seeded user in, returning its token and id"""
+    url = urlsplit(base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port)
+    body = json.dumps({'email': 'user0@example.com', 'password': SEEDED_PASSWORD})
+    connection.request('POST', '/auth/login', body=body, headers=JSON_HEADERS)
+    token = json.loads(connection.getresponse().read().decode())['token']
+    connection.request('GET', '/auth/status', headers={'Authorization': 'Bearer ' + token})
+    user_id = json.loads(connection.getresponse().read().decode())['data']['id']
+    connection.close()
+    return token, user_id
+
+
+def run_scenario(base_url, scenario, concurrency, duration):
+    """Replays scenario from concurrency keep-alive connections for duration seconds"""
+    url = urlsplit(base_url)
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+        local_latencies, local_errors = [], 0
+        while time.perf_counter() < deadline:
+            body = scenario.get_body()
+            headers = scenario.get_headers()
+            started = time.perf_counter()
+            try:
+                status = request(connection, scenario.method, scenario.path, body, headers, scenario.stream)
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+                local_errors += 1
+                continue
+            local_latencies.append(time.perf_counter() - started)
+            if status != scenario.expected_status:
+                local_errors += 1
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'name': scenario.name,
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'requests_per_second': len(latencies) / elapsed,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99)
+    }
+
+
+def run(app, base_url, concurrency=8, duration=5):
+    """Runs every scenario against the server at base_url"""
+    token, user_id = login(base_url)
+
+    def new_tokens():
+        # signed with the server's SECRET_KEY, saving a bcrypt check per logout or refresh
+        with app.app_context():
+            return tuple(token.decode() for token in User.encode_auth_tokens(user_id))
+    scenarios = get_scenarios(token, user_id, new_tokens)
+    for route in get_uncovered_routes(app, scenarios):
+        print('warning: no load scenario for {}'.format(route))
+    return [run_scenario(base_url, scenario, concurrency, duration) for scenario in scenarios]
@@ -0,0 +1,47 @@
+"""Micro-benchmarks of the User model hot paths"""
+import timeit
+
+from app import hasher, token_cache
+from app.api.models import User
+
+
+def measure(name, func, repeat=3):
+    """Times func, returning the best of repeat runs"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {
+        'name': name,
+        'seconds_per_op': seconds,
+        'ops_per_second': 1 / seconds
+    }
+
+
+def run(app, rounds=(4, 13)):
+    """Runs the micro-benchmarks within app, hashing passwords at each of rounds"""
+    with app.app_context():
+        app.config['JWT_EXPIRATION_TIME_SECONDS'] = 3600
+        token = User.encode_auth_token(1)
+        user = User('bench', 'bench@example.com', 'test')
+        user.id = 1
+        row = tuple(getattr(user, field) for field in User.DATA_FIELDS)
+
+        def decode_uncached():
+            token_cache.clear()
+            User.decode_auth_token(token)
+
+        results = [
+            measure('encode_auth_token', lambda: User.encode_auth_token(1)),
+            measure('decode_auth_token (uncached)', decode_uncached),
+            measure('decode_auth_token (cached)', lambda: User.decode_auth_token(token)),
+            measure('get_data', user.get_data),
+            measure('row_to_data', lambda: User.row_to_data(row)),
+        ]
+        for log_rounds in rounds:
+            results.append(measure(
+                'generate_password_hash (rounds={})'.format(log_rounds),
+                lambda: hasher.generate_password_hash('test', log_rounds),
+                repeat=1
+            ))
+        token_cache.clear()
+    return results
@@ -0,0 +1,155 @@
+"""Runs the micro and load benchmarks, saving the results as JSON for comparison between commits
+
+    $ python -m benchmarks.run --duration 5 --concurrency 8 --compare benchmarks/results/<previous>.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from benchmarks import load, micro
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+COMPARED_METRICS = {'micro': 'ops_per_second', 'load': 'requests_per_second'}
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(base_url, process, timeout=60):
+    url = urlsplit(base_url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('The benchmark server exited with status {}.'.format(process.returncode))
+        try:
+            with socket.create_connection((url.hostname, url.port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('The benchmark server did not start in time.')
+
+
+def run_load(app, url=None, database=None, users=1000, concurrency=8, duration=5):
+    """Runs the load benchmarks against url, or against a local server seeded with users"""
+    if url:
+        return load.run(app, url, concurrency, duration)
+    database = database or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    port = get_free_port()
+    process = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.server',
+        '--port', str(port), '--database', database, '--users', str(users)
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = 'http://127.0.0.1:{}'.format(port)
+    try:
+        wait_for(base_url, process)
+        return load.run(app, base_url, concurrency, duration)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run(app, only=None, rounds=(4, 13), **load_options):
+    """Runs the benchmarks, only=micro|load restricting them to one kind"""
+    results = {
+        'commit': get_commit(),
+        'created_at': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'micro': [],
+        'load': []
+    }
+    if only in (None, 'micro'):
+        results['micro'] = micro.run(app, rounds)
+    if only in (None, 'load'):
+        results['load'] = run_load(app, **load_options)
+    return results
+
+
+def save(results, directory=RESULTS_DIR):
+    """Saves results as <directory>/<timestamp>-<commit>.json, returning its path"""
+    os.makedirs(directory, exist_ok=True)
+    name = '{}-{}.json'.format(results['created_at'].replace(':', '').split('.')[0], results['commit'])
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def compare(results, previous):
+    """Returns the relative change of each benchmark found in both results, by name"""
+    changes = []
+    for kind, metric in COMPARED_METRICS.items():
+        before = {result['name']: result[metric] for result in previous.get(kind, [])}
+        for result in results.get(kind, []):
+            if before.get(result['name']):
+                changes.append((result['name'], result[metric] / before[result['name']] - 1))
+    return changes
+
+
+def report(results, previous=None):
+    lines = ['{:<40} {:>14} {:>12}'.format('micro', 'ops/s', 'us/op')]
+    for result in results['micro']:
+        lines.append('{:<40} {:>14,.1f} {:>12,.1f}'.format(
+            result['name'], result['ops_per_second'], result['seconds_per_op'] * 1e6
+        ))
+    lines.append('')
+    lines.append('{:<40} {:>10} {:>7} {:>9} {:>9} {:>9}'.format('load', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for result in results['load']:
+        lines.append('{:<40} {:>10,.1f} {:>7} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            result['name'], result['requests_per_second'], result['errors'],
+            result['p50'] * 1e3, result['p95'] * 1e3, result['p99'] * 1e3
+        ))
+    if previous:
+        lines.append('')
+        lines.append('compared with {}'.format(previous['commit']))
+        for name, change in compare(results, previous):
+            lines.append('{:<40} {:>+9.1%}'.format(name, change))
+    return '\n'.join(lines)
+
+
+def main(app=None, argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', choices=('micro', 'load'))
+    parser.add_argument('--rounds', type=int, nargs='+', default=[4, 13])
+    parser.add_argument('--url', help='benchmark a running server instead of a local one')
+    parser.add_argument('--database', help='database URL of the local server, defaults to a SQLite file')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--compare', help='previous results file to compare with')
+    args = parser.parse_args(argv)
+    if app is None:
+        os.environ.setdefault('APP_SETTINGS', 'app.config.ProductionConfig')
+        from app import create_app
+        app = create_app()
+    results = run(
+        app, args.only, args.rounds, url=args.url, database=args.database,
+        users=args.users, concurrency=args.concurrency, duration=args.duration
+    )
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print(report(results, previous))
+    print('\nresults saved to {}'.format(save(results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""Serves the app on a freshly seeded database for the load benchmarks
+
+    $ python -m benchmarks.server --port 5001 --database sqlite:////tmp/bench.db
+"""
+import argparse
+import os
+
+SEEDED_PASSWORD = 'test'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--database', required=True)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--config', default='app.config.ProductionConfig')
+    args = parser.parse_args()
+
+    os.environ['APP_SETTINGS'] = args.config
+    os.environ['DATABASE_URL'] = os.environ['TEST_DATABASE_URL'] = args.database
+    # every scenario logs in the same users from the same address, which the rate limits are there to stop
+    os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+    # the server below starts a thread per request, holding any number of event streams
+    os.environ.setdefault('USERS_EVENTS_WSGI_STREAMS', '1000')
+    from werkzeug.serving import run_simple
+    from app import create_app, hasher
+    from benchmarks.utils import seed_users
+
+    app = create_app()
+    with app.app_context():
+        password_hash = hasher.generate_password_hash(SEEDED_PASSWORD, app.config.get('BCRYPT_LOG_ROUNDS'))
+        seed_users(args.users, password_hash)
+    run_simple('127.0.0.1', args.port, app, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
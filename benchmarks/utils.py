@@ -0,0 +1,27 @@
+import datetime
+
+from app import db
+from app.api.models import User
+
+
+def seed_users(count, password_hash, batch_size=10000):
+    """Recreates the users table with count users named user<n>, all sharing password_hash"""
+    db.drop_all()
+    db.create_all()
+    created_at = datetime.datetime.utcnow()
+    for start in range(0, count, batch_size):
+        db.session.execute(User.__table__.insert(), [{
+            'username': 'user{}'.format(index),
+            'email': 'user{}@example.com'.format(index),
+            'password': password_hash,
+            'active': True,
+            'created_at': created_at - datetime.timedelta(seconds=index)
+        } for index in range(start, min(start + batch_size, count))])
+    db.session.commit()
+
+
+def percentile(sorted_values, fraction):
+    """Returns the value below which fraction of sorted_values fall"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
@@ -0,0 +1,71 @@
+# gunicorn.conf.py
+import importlib.util
+import multiprocessing
+import os
+import shutil
+
+WORKER_CLASSES = ('sync', 'gthread', 'gevent', 'uvicorn.workers.UvicornWorker')
+# packages the worker classes need beyond requirements.txt, and the requirements file listing them
+WORKER_REQUIREMENTS = {
+    'gevent': ('gevent', 'requirements-gevent.txt'),
+    'uvicorn.workers.UvicornWorker': ('uvicorn', 'requirements-asgi.txt')
+}
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', 5000))
+
+# sync: one request per process, gthread: GUNICORN_THREADS requests per process,
+# gevent: cooperative greenlets, requires gevent to be installed,
+# uvicorn.workers.UvicornWorker: an event loop per process, to serve asgi:app
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+if worker_class not in WORKER_CLASSES:
+    raise ValueError('GUNICORN_WORKER_CLASS must be one of {}'.format(', '.join(WORKER_CLASSES)))
+if worker_class in WORKER_REQUIREMENTS and importlib.util.find_spec(WORKER_REQUIREMENTS[worker_class][0]) is None:
+    raise ValueError('GUNICORN_WORKER_CLASS {} requires pip install -r {}'.format(
+        worker_class, WORKER_REQUIREMENTS[worker_class][1]
+    ))
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# let the app split the cores between the workers' password hashing pools
+os.environ.setdefault('GUNICORN_WORKERS', str(workers))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 2))
+
+# import the app once in the master so workers fork with it already loaded
+preload_app = True
+
+# recycle workers periodically, with jitter so they don't all restart at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.environ.get('GUNICORN_ERROR_LOG', '-')
+
+
+def on_starting(server):
+    """Clears the Prometheus samples left by a previous run"""
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    """Stops aggregating the live gauges of a dead worker"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    """Drops any database connection inherited from the master"""
+    from app import db
+    application = server.app.wsgi()
+    with getattr(application, 'flask_app', application).app_context():
+        db.get_engine().dispose()
+
+
+def worker_exit(server, worker):
+    """Writes the last continuous profile of the worker"""
+    from app import profiler
+    profiler.shutdown()
@@ -1,6 +1,7 @@
 # manage.py
 from flask_migrate import MigrateCommand
-from flask_script import Manager
+from flask_script import Command, Manager
+import sys
 import unittest
 import coverage
 
@@ -13,7 +14,9 @@ COV = coverage.coverage(
         'tests/*'
     ]
 )
-COV.start()
+# only measure coverage when asked to, it slows every line of app code down
+if sys.argv[1:2] == ['cov']:
+    COV.start()
 
 app = create_app()
 manager = Manager(app)
@@ -21,6 +24,18 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+class Bench(Command):
+    """Runs the micro and load benchmarks, see python manage.py bench --help."""
+    capture_all_args = True
+
+    def run(self, args):
+        from benchmarks.run import main
+        main(app, args)
+
+
+manager.add_command('bench', Bench())
+
+
 @manager.command
 def recreate_db():
     """Recreates a database."""
@@ -29,6 +44,46 @@ def recreate_db():
     db.session.commit()
 
 
+@manager.command
+def import_users(file):
+    """Imports users from a JSON array or NDJSON file."""
+    from app.api.importing import iter_records
+    from app.api.models import User
+    with open(file) as f:
+        created, errors = User.bulk_create(iter_records(f), app.config.get('USERS_IMPORT_BATCH_SIZE'))
+    for error in errors:
+        print('Row {index}: {message}'.format(**error))
+    print('Imported {} users, {} errors.'.format(created, len(errors)))
+
+
+@manager.command
+def explain():
+    """Prints the query plan of each User read query."""
+    from app.api.explain import explain_queries
+    for name, plan in explain_queries():
+        print(name)
+        for line in plan:
+            print('    ' + line)
+
+
+@manager.option('-t', '--target-ms', dest='target_ms', type=float, default=250,
+                help='Time budget of one password hash, in milliseconds.')
+def calibrate_password_hash(target_ms):
+    """Measures password hashing on this machine and suggests costs hashing within the time budget."""
+    from app.api.hashing import argon2, calibrate_argon2, calibrate_bcrypt
+    rounds, timings = calibrate_bcrypt(target_ms)
+    for cost, ms in timings.items():
+        print('bcrypt rounds={}: {:.1f} ms'.format(cost, ms))
+    print('BCRYPT_LOG_ROUNDS={}'.format(rounds))
+    if argon2 is not None:
+        time_cost, timings = calibrate_argon2(
+            target_ms, app.config.get('ARGON2_MEMORY_COST'), app.config.get('ARGON2_PARALLELISM')
+        )
+        for cost, ms in timings.items():
+            print('argon2 time_cost={}: {:.1f} ms'.format(cost, ms))
+        print('ARGON2_TIME_COST={}'.format(time_cost))
+
+
 @manager.command
 def test():
     """Runs the tests without code coverage."""
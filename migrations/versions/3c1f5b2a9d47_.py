@@ -0,0 +1,31 @@
+"""add users listing and login indexes
+
+Revision ID: 3c1f5b2a9d47
+Revises: ee501a23f0bf
+Create Date: 2026-10-18 14:20:11.318532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f5b2a9d47'
+down_revision = 'ee501a23f0bf'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_users_created_at_id', 'users', [sa.text('created_at DESC'), sa.text('id DESC')])
+    op.create_index('ix_users_email_lower', 'users', [sa.text('lower(email)')])
+    op.create_index(
+        'ix_users_active_created_at_id', 'users', [sa.text('created_at DESC'), sa.text('id DESC')],
+        postgresql_where=sa.text('active IS true')
+    )
+
+
+def downgrade():
+    op.drop_index('ix_users_active_created_at_id', table_name='users')
+    op.drop_index('ix_users_email_lower', table_name='users')
+    op.drop_index('ix_users_created_at_id', table_name='users')
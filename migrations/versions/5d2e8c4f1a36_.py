@@ -0,0 +1,34 @@
+"""add users updated_at and table versions
+
+Revision ID: 5d2e8c4f1a36
+Revises: 3c1f5b2a9d47
+Create Date: 2026-10-18 16:02:47.104215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8c4f1a36'
+down_revision = '3c1f5b2a9d47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE users SET updated_at = created_at')
+    op.alter_column('users', 'updated_at', nullable=False)
+    table_versions = op.create_table(
+        'table_versions',
+        sa.Column('name', sa.String(length=64), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_versions, [{'name': 'users', 'version': 1}])
+
+
+def downgrade():
+    op.drop_table('table_versions')
+    op.drop_column('users', 'updated_at')
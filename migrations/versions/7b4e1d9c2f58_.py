@@ -0,0 +1,32 @@
+"""add users search indexes
+
+Revision ID: 7b4e1d9c2f58
+Revises: 5d2e8c4f1a36
+Create Date: 2026-10-18 18:41:05.662190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b4e1d9c2f58'
+down_revision = '5d2e8c4f1a36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_users_username_lower_id', 'users', [sa.text('lower(username)'), sa.text('id')])
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX ix_users_username_trgm ON users USING gin (lower(username) gin_trgm_ops)')
+    op.execute('CREATE INDEX ix_users_email_trgm ON users USING gin (lower(email) gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_users_email_trgm', table_name='users')
+        op.drop_index('ix_users_username_trgm', table_name='users')
+    op.drop_index('ix_users_username_lower_id', table_name='users')
@@ -0,0 +1,28 @@
+"""make the users lower(email) index unique
+
+Revision ID: 9e3a6c1d5b20
+Revises: 7b4e1d9c2f58
+Create Date: 2026-10-18 21:12:36.518044
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e3a6c1d5b20'
+down_revision = '7b4e1d9c2f58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # fails if emails differing only by case were registered, which have to be merged first
+    op.drop_index('ix_users_email_lower', table_name='users')
+    op.create_index('ix_users_email_lower', 'users', [sa.text('lower(email)')], unique=True)
+    op.execute('UPDATE users SET email = lower(email) WHERE email <> lower(email)')
+
+
+def downgrade():
+    op.drop_index('ix_users_email_lower', table_name='users')
+    op.create_index('ix_users_email_lower', 'users', [sa.text('lower(email)')])
@@ -0,0 +1,35 @@
+"""split table versions into shards
+
+Revision ID: b6f0d2a4c8e1
+Revises: 9e3a6c1d5b20
+Create Date: 2026-10-18 21:47:02.930417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6f0d2a4c8e1'
+down_revision = '9e3a6c1d5b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('table_versions', sa.Column('shard', sa.Integer(), nullable=False, server_default='0'))
+    op.alter_column('table_versions', 'shard', server_default=None)
+    op.drop_constraint('table_versions_pkey', 'table_versions', type_='primary')
+    op.create_primary_key('table_versions_pkey', 'table_versions', ['name', 'shard'])
+
+
+def downgrade():
+    # fold the shards into one row per table, versions never going back
+    op.execute(
+        'INSERT INTO table_versions (name, shard, version) '
+        'SELECT name, -1, sum(version) FROM table_versions GROUP BY name'
+    )
+    op.execute('DELETE FROM table_versions WHERE shard <> -1')
+    op.drop_constraint('table_versions_pkey', 'table_versions', type_='primary')
+    op.drop_column('table_versions', 'shard')
+    op.create_primary_key('table_versions_pkey', 'table_versions', ['name'])
@@ -1,5 +1,5 @@
 from flask_testing import TestCase
-from app import create_app, db
+from app import create_app, db, denylist, limiter, search_index, token_cache, user_cache
 
 app = create_app()
 
@@ -16,6 +16,11 @@ class BaseTestCase(TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        token_cache.clear()
+        denylist.clear()
+        user_cache.clear()
+        limiter.clear()
+        search_index.clear()
 
     def post_user(self, data):
         with self.client:
@@ -8,3 +8,4 @@ USER_NO_EMAIL = dict(username='test', email='', password='test')
 USER_NO_PASSWORD = dict(username='test', email='test@test.com', password='')
 USER_DUPLICATE_USERNAME = dict(username='test', email='test2@test.com', password='test')
 USER_DUPLICATE_EMAIL = dict(username='test2', email='test@test.com', password='test')
+USER_INVALID_EMAIL = dict(username='test', email='test', password='test')
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import threading
+from unittest import mock
+
+from app.api.asgi import AsyncUserReader, asyncpg, create_asgi_app
+from app.api.models import User
+from tests.base import BaseTestCase
+from tests.utils import add_user
+from tests.constants import *
+
+
+class TestAsyncApp(BaseTestCase):
+    """Tests for the ASGI application."""
+
+    def setUp(self):
+        super().setUp()
+        self.asgi_app = create_asgi_app(self.app)
+
+    def tearDown(self):
+        asyncio.run(self.asgi_app.shutdown())
+        super().tearDown()
+
+    def request(self, method, path, body=b'', headers=()):
+        """Runs a request through the ASGI app
+        :return: (status, headers, json body) tuple
+        """
+        scope = {
+            'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': b'',
+            'headers': [(name.encode(), value.encode()) for name, value in headers],
+            'client': ('127.0.0.1', 1234), 'server': ('localhost', 80)
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.asgi_app(scope, receive, send))
+        start = sent[0]
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        return start['status'], dict(start['headers']), json.loads(body.decode()) if body else None
+
+    def test_pool_creation_retried(self):
+        """Ensure a pool that couldn't be created is tried again on the next request"""
+        if asyncpg is None:
+            self.skipTest('asyncpg is not installed')
+        pool = mock.Mock(fetchrow=mock.AsyncMock(return_value=None), close=mock.AsyncMock())
+        create_pool = mock.AsyncMock(side_effect=[ConnectionRefusedError(), pool])
+        reader = AsyncUserReader(dict(self.app.config, SQLALCHEMY_DATABASE_URI='postgres://localhost/app'))
+
+        async def run():
+            with self.assertRaises(ConnectionRefusedError):
+                await reader.fetchrow('SELECT 1')
+            self.assertIsNone(await reader.fetchrow('SELECT 1'))
+            await reader.close()
+        with mock.patch('app.api.asgi.asyncpg.create_pool', create_pool):
+            asyncio.run(run())
+        self.assertEqual(2, create_pool.call_count)
+        pool.close.assert_awaited_once()
+
+    def test_ping(self):
+        """Ensure /ping is served asynchronously"""
+        status, headers, data = self.request('GET', '/ping', headers=[('Origin', 'http://localhost')])
+        self.assertEqual(200, status)
+        self.assertEqual('pong!', data['message'])
+        self.assertEqual(b'*', headers[b'access-control-allow-origin'])
+
+    def test_get_user(self):
+        """Ensure users are read like the Flask view does"""
+        user = add_user('test', 'test@test.com', 'test')
+        status, _, data = self.request('GET', '/users/{}'.format(user.id))
+        self.assertEqual(200, status)
+        self.assertEqual(self.client.get('/users/{}'.format(user.id)).json, data)
+        status, headers, _ = self.request('GET', '/users/{}'.format(user.id))
+        status, _, _ = self.request('GET', '/users/{}'.format(user.id), headers=[
+            ('If-None-Match', headers[b'etag'].decode())
+        ])
+        self.assertEqual(304, status)
+        status, _, data = self.request('GET', '/users/999')
+        self.assertEqual(404, status)
+        self.assertEqual('User not found.', data['message'])
+
+    def test_login_and_status(self):
+        """Ensure users can log in and check their status"""
+        add_user('test', 'test@test.com', 'test')
+        status, _, data = self.request(
+            'POST', '/auth/login', json.dumps(LOGIN_USER_BASIC).encode(), [('Content-Type', 'application/json')]
+        )
+        self.assertEqual(200, status)
+        status, _, data = self.request('GET', '/auth/status', headers=[('Authorization', 'Bearer ' + data['token'])])
+        self.assertEqual(200, status)
+        self.assertEqual('test@test.com', data['data']['email'])
+        status, _, data = self.request('GET', '/auth/status', headers=[('Authorization', 'Bearer invalid')])
+        self.assertEqual(401, status)
+
+    def test_status_off_the_event_loop(self):
+        """Ensure tokens, which may be looked up in the denylist store, are decoded on the thread pool"""
+        threads = []
+
+        def decode_auth_token(token):
+            threads.append(threading.current_thread())
+            return 'Invalid token.'
+        with mock.patch.object(User, 'decode_auth_token', side_effect=decode_auth_token):
+            status, _, _ = self.request('GET', '/auth/status', headers=[('Authorization', 'Bearer token')])
+        self.assertEqual(401, status)
+        self.assertIsNot(threading.main_thread(), threads[0])
+
+    def test_login_invalid(self):
+        """Ensure wrong credentials and invalid payloads are rejected"""
+        add_user('test', 'test@test.com', 'test')
+        headers = [('Content-Type', 'application/json')]
+        status, _, data = self.request('POST', '/auth/login', b'{"email": "test@test.com", "password": "x"}', headers)
+        self.assertEqual(404, status)
+        status, _, data = self.request('POST', '/auth/login', json.dumps(LOGIN_USER_BASIC_NO_PASSWORD).encode(), headers)
+        self.assertEqual(400, status)
+        status, _, data = self.request('POST', '/auth/login', b'not json', headers)
+        self.assertEqual(400, status)
+        self.assertEqual('Invalid payload.', data['message'])
+
+    def test_login_rate_limited(self):
+        """Ensure logins are limited by the same limiter as the Flask view"""
+        add_user('test', 'test@test.com', 'test')
+        self.app.config['RATELIMIT_ENABLED'] = True
+        try:
+            body, headers = json.dumps(LOGIN_USER_BASIC).encode(), [('Content-Type', 'application/json')]
+            for _ in range(self.app.config['RATELIMIT_IDENTITY_BURST']):
+                status, _, _ = self.request('POST', '/auth/login', body, headers)
+                self.assertEqual(200, status)
+            status, response_headers, data = self.request('POST', '/auth/login', body, headers)
+            self.assertEqual(429, status)
+            self.assertIn(b'retry-after', response_headers)
+        finally:
+            self.app.config['RATELIMIT_ENABLED'] = False
+
+    def test_wsgi_fallback(self):
+        """Ensure the other routes are served by the Flask app"""
+        add_user('test', 'test@test.com', 'test')
+        status, _, data = self.request('GET', '/users')
+        self.assertEqual(200, status)
+        self.assertEqual(1, len(data['data']['users']))
@@ -135,6 +135,19 @@ class TestAuth(BaseTestCase):
             self.assertFalse('token' in data)
             self.assertEqual(response.status_code, 200)
 
+    def test_user_logout_revokes_token(self):
+        User(**USER_BASIC).save()
+        response_login = self.login(json.dumps(LOGIN_USER_BASIC))
+        headers = dict(Authorization='Bearer ' + json.loads(response_login.data.decode())['token'])
+        with self.client:
+            self.assertEqual(self.client.get('/auth/status', headers=headers).status_code, 200)
+            self.assertEqual(self.client.get('/auth/logout', headers=headers).status_code, 200)
+            for path in ('/auth/status', '/auth/logout'):
+                response = self.client.get(path, headers=headers)
+                data = json.loads(response.data.decode())
+                self.assertEqual(data['message'], 'Revoked token, please login again.')
+                self.assertEqual(response.status_code, 401)
+
     def test_user_logout_invalid_expired_token(self):
         User(**USER_BASIC).save()
         response_login = self.login(json.dumps(LOGIN_USER_BASIC))
@@ -190,3 +203,69 @@ class TestAuth(BaseTestCase):
             self.assertEqual('error', data['status'])
             self.assertIn('Invalid token', data['message'])
             self.assertEqual(401, response.status_code)
+
+    def test_user_login_case_insensitive_email(self):
+        User(**USER_BASIC).save()
+        response = self.login(json.dumps(dict(email='Test@Test.com', password='test')))
+        data = json.loads(response.data.decode())
+        self.assertTrue(data['status'] == 'success')
+        self.assertEqual(response.status_code, 200)
+
+    def refresh(self, refresh_token):
+        with self.client:
+            return self.client.post(
+                '/auth/refresh',
+                data=json.dumps(dict(refresh_token=refresh_token)),
+                content_type='application/json'
+            )
+
+    def test_user_refresh(self):
+        User(**USER_BASIC).save()
+        data_login = json.loads(self.login(json.dumps(LOGIN_USER_BASIC)).data.decode())
+        response = self.refresh(data_login['refresh_token'])
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['message'], 'Successfully refreshed.')
+        self.assertNotEqual(data['refresh_token'], data_login['refresh_token'])
+        response = self.client.get('/auth/status', headers=dict(Authorization='Bearer ' + data['token']))
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_refresh_reused_token(self):
+        """Ensure reusing a rotated refresh token revokes the whole login session"""
+        User(**USER_BASIC).save()
+        data_login = json.loads(self.login(json.dumps(LOGIN_USER_BASIC)).data.decode())
+        data = json.loads(self.refresh(data_login['refresh_token']).data.decode())
+        response = self.refresh(data_login['refresh_token'])
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.data.decode())['message'], 'Revoked token, please login again.')
+        self.assertEqual(self.refresh(data['refresh_token']).status_code, 401)
+        response = self.client.get('/auth/status', headers=dict(Authorization='Bearer ' + data['token']))
+        self.assertEqual(response.status_code, 401)
+
+    def test_user_refresh_without_rotation(self):
+        self.app.config['REFRESH_TOKEN_ROTATION'] = False
+        try:
+            User(**USER_BASIC).save()
+            data_login = json.loads(self.login(json.dumps(LOGIN_USER_BASIC)).data.decode())
+            data = json.loads(self.refresh(data_login['refresh_token']).data.decode())
+            self.assertEqual(data['refresh_token'], data_login['refresh_token'])
+            self.assertEqual(self.refresh(data_login['refresh_token']).status_code, 200)
+        finally:
+            self.app.config['REFRESH_TOKEN_ROTATION'] = True
+
+    def test_user_refresh_after_logout(self):
+        User(**USER_BASIC).save()
+        data_login = json.loads(self.login(json.dumps(LOGIN_USER_BASIC)).data.decode())
+        self.client.get('/auth/logout', headers=dict(Authorization='Bearer ' + data_login['token']))
+        self.assertEqual(self.refresh(data_login['refresh_token']).status_code, 401)
+
+    def test_user_refresh_invalid(self):
+        User(**USER_BASIC).save()
+        data_login = json.loads(self.login(json.dumps(LOGIN_USER_BASIC)).data.decode())
+        response = self.refresh(data_login['token'])
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.data.decode())['message'], 'Invalid token.')
+        response = self.client.get('/auth/status', headers=dict(Authorization='Bearer ' + data_login['refresh_token']))
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post('/auth/refresh', data='{}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
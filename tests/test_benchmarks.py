@@ -0,0 +1,18 @@
+from benchmarks.load import get_scenarios, get_uncovered_routes
+from benchmarks.run import compare
+from tests.base import BaseTestCase
+
+
+class TestBenchmarks(BaseTestCase):
+    """Tests for the benchmark suite."""
+
+    def test_every_route_has_a_load_scenario(self):
+        self.assertEqual([], get_uncovered_routes(self.app, get_scenarios('token', 1)))
+
+    def test_compare(self):
+        previous = {'micro': [{'name': 'get_data', 'ops_per_second': 100.0}], 'load': []}
+        results = {
+            'micro': [{'name': 'get_data', 'ops_per_second': 150.0}, {'name': 'new', 'ops_per_second': 1.0}],
+            'load': [{'name': 'GET /ping', 'requests_per_second': 10.0}]
+        }
+        self.assertEqual([('get_data', 0.5)], compare(results, previous))
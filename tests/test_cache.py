@@ -0,0 +1,43 @@
+import time
+import unittest
+
+from app.api.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    """Tests for the in-process TTL cache."""
+
+    def test_get_set(self):
+        cache = TTLCache('TEST_CACHE')
+        cache.set('key', 'value')
+        self.assertEqual('value', cache.get('key'))
+        self.assertIsNone(cache.get('missing'))
+
+    def test_expiry(self):
+        cache = TTLCache('TEST_CACHE')
+        cache.set('key', 'value', ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(0, len(cache))
+
+    def test_lru_eviction(self):
+        cache = TTLCache('TEST_CACHE', maxsize=2)
+        cache.set('one', 1)
+        cache.set('two', 2)
+        cache.get('one')
+        cache.set('three', 3)
+        self.assertEqual(1, cache.get('one'))
+        self.assertIsNone(cache.get('two'))
+        self.assertEqual(3, cache.get('three'))
+
+    def test_disabled(self):
+        cache = TTLCache('TEST_CACHE', maxsize=0)
+        cache.set('key', 'value')
+        self.assertIsNone(cache.get('key'))
+
+    def test_pop(self):
+        cache = TTLCache('TEST_CACHE')
+        cache.set('key', 'value')
+        cache.pop('key')
+        cache.pop('missing')
+        self.assertIsNone(cache.get('key'))
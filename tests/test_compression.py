@@ -0,0 +1,79 @@
+import gzip
+import json
+
+from app import compressor, db
+from app.api.compression import brotli
+from app.api.models import User
+from tests.base import BaseTestCase
+
+
+class TestCompression(BaseTestCase):
+    """Tests for the response compression."""
+
+    def setUp(self):
+        super().setUp()
+        db.session.add_all([
+            User(username='user{}'.format(i), email='user{}@test.com'.format(i), password='test')
+            for i in range(30)
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        compressor.cache.clear()
+        super().tearDown()
+
+    def test_gzip(self):
+        response = self.client.get('/users', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        data = json.loads(gzip.decompress(response.data).decode())
+        self.assertEqual(30, len(data['data']['users']))
+        self.assertEqual(len(response.data), int(response.headers['Content-Length']))
+
+    def test_brotli_preferred(self):
+        if brotli is None:
+            self.skipTest('brotli is not installed')
+        response = self.client.get('/users', headers={'Accept-Encoding': 'gzip, deflate, br'})
+        self.assertEqual('br', response.headers['Content-Encoding'])
+        data = json.loads(brotli.decompress(response.data).decode())
+        self.assertEqual(30, len(data['data']['users']))
+
+    def test_not_accepted(self):
+        response = self.client.get('/users')
+        self.assertNotIn('Content-Encoding', response.headers)
+        response = self.client.get('/users', headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_below_threshold(self):
+        response = self.client.get('/ping', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual('pong!', response.json['message'])
+
+    def test_stream(self):
+        response = self.client.get('/users?stream=ndjson', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertNotIn('Content-Length', response.headers)
+        lines = gzip.decompress(response.data).decode().splitlines()
+        self.assertEqual(30, len(lines))
+
+    def test_stream_etag(self):
+        """Ensure a compressed stream isn't tagged like the identity one"""
+        identity = self.client.get('/users?stream=json')
+        identity.get_data()
+        response = self.client.get('/users?stream=json', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(json.loads(identity.data.decode()), json.loads(gzip.decompress(response.data).decode()))
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual(identity.headers['ETag'][:-1] + '-gzip"', response.headers['ETag'])
+
+    def test_cached_by_etag(self):
+        """Ensure compressed bodies are reused, and their ETag still validates"""
+        response = self.client.get('/users', headers={'Accept-Encoding': 'gzip'})
+        etag = response.headers['ETag']
+        self.assertTrue(etag.endswith('-gzip"'))
+        self.assertEqual(1, len(compressor.cache))
+        cached = self.client.get('/users', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.data, cached.data)
+        self.assertEqual(1, len(compressor.cache))
+        response = self.client.get('/users', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response.headers['ETag'])
@@ -1,8 +1,10 @@
+import importlib
 import unittest
 import os
+from unittest import mock
 from flask import current_app
 from flask_testing import TestCase
-from app import create_app
+from app import config, create_app
 
 app = create_app()
 
@@ -50,5 +52,20 @@ class TestProductionConfig(TestCase):
             app.config['JWT_EXPIRATION_TIME_SECONDS'] == os.environ.get('JWT_EXPIRATION_TIME_SECONDS ', 3600))
 
 
+
+class TestHashingWorkersConfig(unittest.TestCase):
+    def tearDown(self):
+        importlib.reload(config)
+
+    def test_cores_split_between_workers(self):
+        """Ensure the gunicorn workers' hashing pools don't outnumber the cores"""
+        with mock.patch.dict(os.environ, {'GUNICORN_WORKERS': str(os.cpu_count() * 2 + 1)}):
+            os.environ.pop('PASSWORD_HASHING_WORKERS', None)
+            self.assertEqual(1, importlib.reload(config).BaseConfig.PASSWORD_HASHING_WORKERS)
+        with mock.patch.dict(os.environ, {'GUNICORN_WORKERS': '1'}):
+            os.environ.pop('PASSWORD_HASHING_WORKERS', None)
+            self.assertEqual(os.cpu_count(), importlib.reload(config).BaseConfig.PASSWORD_HASHING_WORKERS)
+
+
 if __name__ == '__main__':
     unittest.main()
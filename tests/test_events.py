@@ -0,0 +1,208 @@
+import asyncio
+import json
+import os
+import time
+import unittest
+
+from flask import Flask
+
+from app import db, user_events
+from app.api.asgi import create_asgi_app
+from app.api.events import NOTIFY_PAYLOAD_SIZE, EventBroker, notify_payloads
+from app.api.models import User, listen_user_events
+from tests.base import BaseTestCase
+from tests.utils import add_user
+from tests.constants import *
+
+
+class TestEventBroker(unittest.TestCase):
+    """Tests for the user events ring buffer."""
+
+    def test_resume(self):
+        broker = EventBroker()
+        start = broker.last_event_id
+        broker.publish('created', '{"id":1}')
+        broker.publish('updated', '{"id":1}')
+        events = broker.events_after(start)
+        self.assertEqual(['created', 'updated'], [event for _, event, _ in events])
+        self.assertEqual([], broker.events_after(events[-1][0]))
+        self.assertEqual([events[-1]], broker.events_after(events[0][0]))
+
+    def test_unknown_ids(self):
+        """Ensure ids of other processes, and those that left the buffer, can't be resumed from"""
+        broker = EventBroker()
+        broker._events = type(broker._events)(maxlen=2)
+        start = broker.last_event_id
+        for i in range(3):
+            broker.publish('created', '{}')
+        self.assertIsNone(broker.events_after(start))
+        self.assertIsNone(broker.events_after('other-1'))
+        self.assertIsNone(broker.events_after(None))
+        last_event_id = broker.last_event_id
+        broker.clear()
+        self.assertIsNone(broker.events_after(last_event_id))
+
+    def test_stream(self):
+        broker = EventBroker()
+        stream = broker.stream(None, 0.01)
+        self.assertEqual('retry: 3000\n\n', next(stream))
+        ready = next(stream)
+        self.assertIn('event: ready\n', ready)
+        self.assertEqual(': keep-alive\n\n', next(stream))
+        broker.publish('created', '{"id":1}')
+        message = next(stream)
+        self.assertIn('event: created\ndata: {"id":1}\n\n', message)
+        resumed = broker.stream(ready.split('\n')[0][len('id: '):], 0.01)
+        next(resumed)
+        self.assertEqual(message, next(resumed))
+        reset = broker.stream('other-1', 0.01)
+        next(reset)
+        self.assertIn('event: reset\n', next(reset))
+
+    def test_notify_payloads(self):
+        """Ensure events are NOTIFYed as JSON lists small enough for Postgres"""
+        messages = [json.dumps({'event': 'created', 'data': {'id': i, 'username': 'x' * 100}}) for i in range(200)]
+        payloads = notify_payloads(messages)
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload.encode()) <= NOTIFY_PAYLOAD_SIZE for payload in payloads))
+        self.assertEqual(list(range(200)), [
+            notification['data']['id'] for payload in payloads for notification in json.loads(payload)
+        ])
+        self.assertEqual([], notify_payloads([]))
+
+    def test_listen_url(self):
+        """Ensure the listener connects to DATABASE_URL, and needs its own URL through PgBouncer"""
+        app = Flask(__name__)
+        app.config.update(SQLALCHEMY_DATABASE_URI='postgres://localhost/app', DATABASE_PGBOUNCER=False)
+        EventBroker(app)
+        self.assertEqual('postgres://localhost/app', app.config['USERS_EVENTS_LISTEN_URL'])
+        app.config.update(USERS_EVENTS_LISTEN_URL=None, DATABASE_PGBOUNCER=True)
+        self.assertRaises(ValueError, EventBroker, app)
+        app.config['USERS_EVENTS_LISTEN_URL'] = 'postgres://direct/app'
+        EventBroker(app)
+        self.assertEqual('postgres://direct/app', app.config['USERS_EVENTS_LISTEN_URL'])
+
+
+class TestUserEvents(BaseTestCase):
+    """Tests for the events of user writes."""
+
+    def setUp(self):
+        super().setUp()
+        self.start = user_events.last_event_id
+
+    def published(self):
+        return [(event, json.loads(data)) for _, event, data in user_events.events_after(self.start)]
+
+    def test_created_and_updated(self):
+        """Ensure ORM and Core writes publish events once committed"""
+        user = add_user('test', 'test@test.com', 'test')
+        user.active = False
+        db.session.commit()
+        self.post_user(json.dumps(dict(username='other', email='other@test.com', password='test')))
+        events = self.published()
+        self.assertEqual(['created', 'updated', 'created'], [event for event, _ in events])
+        self.assertEqual(user.id, events[0][1]['id'])
+        self.assertFalse(events[1][1]['active'])
+        self.assertEqual('other', events[2][1]['username'])
+
+    def test_bulk_created(self):
+        self.client.post('/users/bulk', data=json.dumps([
+            dict(username='bulk1', email='bulk1@example.com', password='test'),
+            dict(username='bulk2', email='bulk2@example.com', password='test'),
+        ]), content_type='application/json')
+        self.assertEqual(['bulk1', 'bulk2'], [data['username'] for _, data in self.published()])
+
+    def test_rolled_back(self):
+        db.session.add(User(username='test', email='test@test.com', password='test'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual([], self.published())
+
+    def test_stream(self):
+        """Ensure the stream resumes after Last-Event-ID"""
+        add_user('test', 'test@test.com', 'test')
+        response = self.client.get('/users/events', headers={'Last-Event-ID': self.start}, buffered=False,
+                                   environ_overrides={'wsgi.multithread': True})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/event-stream', response.mimetype)
+        messages = iter(response.response)
+        self.assertEqual(b'retry: 3000\n\n', next(messages))
+        self.assertIn(b'event: created\n', next(messages))
+        response.close()
+
+    def test_stream_refused(self):
+        """Ensure streams are refused by sync workers, and past USERS_EVENTS_WSGI_STREAMS"""
+        response = self.client.get('/users/events', buffered=False)
+        self.assertEqual(503, response.status_code)
+        self.assertIn('ASGI', response.json['message'])
+        first = self.client.get('/users/events', buffered=False, environ_overrides={'wsgi.multithread': True})
+        self.assertEqual(200, first.status_code)
+        response = self.client.get('/users/events', buffered=False, environ_overrides={'wsgi.multithread': True})
+        self.assertEqual(503, response.status_code)
+        first.close()
+        response = self.client.get('/users/events', buffered=False, environ_overrides={'wsgi.multithread': True})
+        self.assertEqual(200, response.status_code)
+        response.close()
+
+    def test_asgi_stream(self):
+        """Ensure the ASGI app streams the same events"""
+        asgi_app = create_asgi_app(self.app)
+        add_user('test', 'test@test.com', 'test')
+        sent = []
+
+        async def run():
+            body_sent = asyncio.Event()
+            requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+            async def receive():
+                if requests:
+                    return requests.pop()
+                await body_sent.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if message['type'] == 'http.response.body':
+                    body_sent.set()
+            scope = {
+                'type': 'http', 'method': 'GET', 'path': '/users/events', 'query_string': b'',
+                'headers': [(b'last-event-id', self.start.encode())]
+            }
+            await asyncio.wait_for(asgi_app(scope, receive, send), 5)
+        asyncio.run(run())
+        asyncio.run(asgi_app.shutdown())
+        self.assertEqual(200, sent[0]['status'])
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertIn(b'event: created\n', sent[1]['body'])
+
+
+@unittest.skipUnless(
+    (os.environ.get('TEST_DATABASE_URL') or '').startswith('postgres'), 'LISTEN/NOTIFY needs a Postgres test database'
+)
+class TestNotifiedUserEvents(BaseTestCase):
+    """Tests for the user events relayed by LISTEN/NOTIFY, run against a Postgres test database only."""
+
+    @staticmethod
+    def wait_for(condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_listen(self):
+        """Ensure the events NOTIFYed by writes are published, with the pool pinging its connections"""
+        self.assertTrue(self.app.config.get('DATABASE_POOL_PRE_PING'))
+        listen_user_events()
+        self.assertTrue(self.wait_for(lambda: user_events.listening))
+        start = user_events.last_event_id
+        self.client.post('/users/bulk', data=json.dumps([
+            dict(username='bulk1', email='bulk1@example.com', password='test'),
+            dict(username='bulk2', email='bulk2@example.com', password='test'),
+        ]), content_type='application/json')
+        add_user('test', 'test@test.com', 'test')
+        self.assertTrue(self.wait_for(lambda: len(user_events.events_after(start) or []) >= 3))
+        events = user_events.events_after(start)
+        self.assertEqual(['created'] * 3, [event for _, event, _ in events])
+        self.assertEqual(['bulk1', 'bulk2', 'test'], [json.loads(data)['username'] for _, _, data in events])
+        # listening didn't go down meanwhile, the clients resuming from start aren't reset
+        self.assertEqual(start.partition('-')[0], user_events.last_event_id.partition('-')[0])
@@ -0,0 +1,30 @@
+from app import db
+from app.api.explain import explain_queries
+from tests.base import BaseTestCase
+from tests.utils import add_user
+
+
+class TestExplain(BaseTestCase):
+    """Tests for the query plans of the User read queries."""
+
+    def test_explain_queries(self):
+        """Ensures a plan is printed for every query"""
+        add_user('test', 'test@test.com', 'test')
+        for name, plan in explain_queries():
+            self.assertTrue(plan, name)
+
+    def test_listing_uses_indexes(self):
+        """Ensures the listings and the lookups by id, email and username are read from their indexes"""
+        if db.engine.dialect.name != 'sqlite':
+            self.skipTest('Postgres may prefer a sequential scan on a tiny table.')
+        add_user('test', 'test@test.com', 'test')
+        plans = {name: ' '.join(plan) for name, plan in explain_queries()}
+        self.assertIn('ix_users_created_at_id', plans['get_users_page'])
+        self.assertNotIn('TEMP B-TREE', plans['get_users_page'])
+        self.assertIn('ix_users_active_created_at_id', plans['get_users_page (active)'])
+        self.assertIn('ix_users_email_lower', plans['login'])
+        self.assertIn('(created_at<?)', plans['get_users_page (cursor)'])
+        self.assertIn('PRIMARY KEY', plans['get_by_ids'])
+        self.assertIn('sqlite_autoindex_users_1', plans['exists'])
+        self.assertIn('ix_users_email_lower', plans['exists'])
+        self.assertNotIn('search', plans)
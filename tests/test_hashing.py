@@ -0,0 +1,103 @@
+import json
+import unittest
+from unittest import mock
+
+from app import hasher
+from app.api.hashing import argon2, calibrate_bcrypt, verify_password
+from tests.base import BaseTestCase
+from tests.constants import *
+
+
+class TestPasswordHasher(BaseTestCase):
+    """Tests for the password hashing pool."""
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['PASSWORD_HASHING_WORKERS'] = 1
+        self.app.config['PASSWORD_HASHING_QUEUE_SIZE'] = 0
+
+    def tearDown(self):
+        hasher.shutdown()
+        self.app.config['PASSWORD_HASHING_WORKERS'] = 0
+        super().tearDown()
+
+    def test_hash_in_pool(self):
+        """Ensure passwords are hashed and verified by the pool"""
+        pw_hash = hasher.generate_password_hash('test', 4)
+        self.assertTrue(pw_hash.startswith('$2b$04$'))
+        self.assertTrue(hasher.check_password_hash(pw_hash, 'test'))
+        self.assertFalse(hasher.check_password_hash(pw_hash, 'invalid'))
+
+    def test_hash_in_pool_invalid_password(self):
+        """Ensure errors raised in the pool reach the caller"""
+        self.assertRaises(ValueError, hasher.generate_password_hash, '', 4)
+
+    def test_stats(self):
+        """Ensure queue wait and hash times are recorded"""
+        count = hasher.get_stats()['hash_time']['count']
+        hasher.generate_password_hash('test', 4)
+        stats = hasher.get_stats()
+        self.assertEqual(count + 1, stats['hash_time']['count'])
+        self.assertEqual(count + 1, stats['queue_wait']['count'])
+        self.assertGreater(stats['hash_time']['max'], 0)
+
+    def test_saturated_pool(self):
+        """Ensure a 503 is returned when the pool is saturated"""
+        _, slots = hasher._get_executor(1)
+        slots.acquire()
+        try:
+            response = self.register(json.dumps(USER_BASIC))
+        finally:
+            slots.release()
+        data = json.loads(response.data.decode())
+        self.assertEqual(503, response.status_code)
+        self.assertEqual('error', data['status'])
+        self.assertEqual('1', response.headers['Retry-After'])
+
+
+class TestPasswordSchemes(BaseTestCase):
+    """Tests for the password hashing schemes and costs."""
+
+    def tearDown(self):
+        self.app.config['PASSWORD_HASH_SCHEME'] = 'bcrypt'
+        super().tearDown()
+
+    def test_needs_rehash_bcrypt_cost(self):
+        pw_hash = hasher.generate_password_hash('test', 4)
+        self.assertFalse(hasher.needs_rehash(pw_hash, 4))
+        self.assertTrue(hasher.needs_rehash(pw_hash, 5))
+
+    @unittest.skipIf(argon2 is None, 'argon2-cffi is not installed')
+    def test_argon2(self):
+        bcrypt_hash = hasher.generate_password_hash('test', 4)
+        self.app.config['PASSWORD_HASH_SCHEME'] = 'argon2'
+        pw_hash = hasher.generate_password_hash('test', 4)
+        self.assertTrue(pw_hash.startswith('$argon2'))
+        self.assertTrue(hasher.check_password_hash(pw_hash, 'test'))
+        self.assertFalse(hasher.check_password_hash(pw_hash, 'invalid'))
+        self.assertTrue(hasher.check_password_hash(bcrypt_hash, 'test'))
+        self.assertFalse(hasher.needs_rehash(pw_hash, 4))
+        self.assertTrue(hasher.needs_rehash(bcrypt_hash, 4))
+        self.assertRaises(ValueError, hasher.generate_password_hash, '', 4)
+
+    def test_unverifiable_hashes(self):
+        """Ensure hashes that can't be verified fail the check rather than the request"""
+        argon2_hash = '$argon2id$v=19$m=65536,t=3,p=1$c2FsdHNhbHQ$aGFzaGhhc2hoYXNoaGFzaA'
+        with mock.patch('app.api.hashing.argon2', None):
+            self.assertFalse(verify_password(argon2_hash, 'test'))
+            self.app.config['PASSWORD_HASH_SCHEME'] = 'argon2'
+            with self.assertRaisesRegex(ValueError, 'argon2-cffi'):
+                hasher.init_app(self.app)
+        self.assertFalse(verify_password('$argon2id$invalid', 'test'))
+        self.assertFalse(verify_password('invalid', 'test'))
+
+    def test_unknown_scheme(self):
+        self.app.config['PASSWORD_HASH_SCHEME'] = 'md5'
+        self.assertRaises(ValueError, hasher.generate_password_hash, 'test', 4)
+
+    def test_calibrate_bcrypt(self):
+        rounds, timings = calibrate_bcrypt(0.001, maximum=5)
+        self.assertEqual(4, rounds)
+        self.assertEqual([4], list(timings))
+        rounds, timings = calibrate_bcrypt(60000, maximum=5)
+        self.assertEqual(5, rounds)
@@ -0,0 +1,38 @@
+import json
+
+from tests.base import BaseTestCase
+from tests.utils import add_user
+from tests.constants import *
+
+
+class TestMetrics(BaseTestCase):
+    """Tests for the Prometheus metrics."""
+
+    def get_metrics(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('text/plain', response.content_type)
+        return response.data.decode()
+
+    def test_request_metrics(self):
+        """Ensure requests are counted per route, status and SQL queries"""
+        add_user('test', 'test@test.com', 'test')
+        self.client.get('/ping')
+        self.client.get('/users')
+        self.client.get('/users/999')
+        metrics = self.get_metrics()
+        self.assertIn('http_requests_total{endpoint="/ping",method="GET",status="200"}', metrics)
+        self.assertIn('http_requests_total{endpoint="/users/<uid>",method="GET",status="404"}', metrics)
+        self.assertIn('http_request_duration_seconds_count{endpoint="/users",method="GET"}', metrics)
+        self.assertIn('http_request_sql_queries_bucket{endpoint="/users",le="1.0"}', metrics)
+
+    def test_jwt_metrics(self):
+        """Ensure JWT encoding and decoding is timed"""
+        add_user('test', 'test@test.com', 'test')
+        response = self.login(json.dumps(LOGIN_USER_BASIC))
+        token = json.loads(response.data.decode())['token']
+        self.client.get('/auth/status', headers={'Authorization': 'Bearer ' + token})
+        metrics = self.get_metrics()
+        self.assertIn('jwt_duration_seconds_count{operation="encode"}', metrics)
+        self.assertIn('jwt_duration_seconds_count{operation="decode"}', metrics)
+        self.assertIn('password_hash_duration_seconds_count', metrics)
@@ -0,0 +1,83 @@
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+
+from app import profiler
+from app.api.profiling import StackSampler
+from tests.base import BaseTestCase
+
+
+class TestProfiling(BaseTestCase):
+    """Tests for the request profiler."""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.app.config['PROFILING_SECRET'] = 'secret'
+        self.app.config['PROFILING_DIR'] = self.directory
+
+    def tearDown(self):
+        profiler.shutdown()
+        self.app.config['PROFILING_SECRET'] = None
+        self.app.config['PROFILING_CONTINUOUS_SECONDS'] = 0
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def get_profiled(self, mode, secret='secret'):
+        return self.client.get('/users', headers={'X-Profile': mode, 'X-Profile-Secret': secret})
+
+    def test_cprofile(self):
+        """Ensure a request can be run under cProfile"""
+        response = self.get_profiled('cprofile')
+        self.assertEqual(response.status_code, 200)
+        path = os.path.join(self.directory, response.headers['X-Profile-File'])
+        self.assertTrue(path.endswith('.prof'))
+        functions = [function for _, _, function in pstats.Stats(path).stats]
+        self.assertIn('get_users_page', functions)
+
+    def test_sample(self):
+        """Ensure a request can be run under the stack sampler"""
+        response = self.get_profiled('sample')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['X-Profile-File'].endswith('.folded'))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, response.headers['X-Profile-File'])))
+
+    def test_wrong_secret(self):
+        """Ensure the profiling flag is ignored without the secret"""
+        response = self.get_profiled('cprofile', secret='invalid')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-File', response.headers)
+        self.app.config['PROFILING_SECRET'] = None
+        response = self.get_profiled('cprofile', secret='')
+        self.assertNotIn('X-Profile-File', response.headers)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_stack_sampler(self):
+        """Ensure the sampler records the stacks of the sampled thread only"""
+        done = threading.Event()
+
+        def wait_for_test():
+            done.wait()
+        thread = threading.Thread(target=wait_for_test)
+        thread.start()
+        sampler = StackSampler(0.001, thread.ident)
+        sampler.sample()
+        done.set()
+        thread.join()
+        stacks = sampler.stop()
+        self.assertEqual(1, sum(stacks.values()))
+        stack, = stacks
+        self.assertIn('wait_for_test', stack)
+
+    def test_continuous(self):
+        """Ensure workers write periodic profiles when continuous profiling is on"""
+        self.app.config['PROFILING_CONTINUOUS_SECONDS'] = 60
+        self.client.get('/ping')
+        continuous = profiler._ensure_continuous()
+        continuous.sample()
+        profiler.shutdown()
+        profiles = os.listdir(self.directory)
+        self.assertEqual(1, len(profiles))
+        self.assertTrue(profiles[0].startswith('worker-{}-'.format(os.getpid())))
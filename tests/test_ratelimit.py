@@ -0,0 +1,103 @@
+import json
+import time
+import unittest
+
+from app import limiter
+from app.api.ratelimit import MemoryRateLimitStore, get_client_ip, get_identities
+from tests.base import BaseTestCase
+from tests.utils import add_user
+from tests.constants import *
+
+
+class TestRateLimitStore(unittest.TestCase):
+    """Tests for the token buckets."""
+
+    def test_memory_store(self):
+        store = MemoryRateLimitStore()
+        self.assertEqual([0, 0, 0], [store.take('key', 1, 3) for _ in range(3)])
+        self.assertGreater(store.take('key', 1, 3), 0)
+        self.assertEqual(0, store.take('other', 1, 3))
+
+    def test_memory_store_refill(self):
+        store = MemoryRateLimitStore()
+        store.take('key', 100, 1)
+        self.assertGreater(store.take('key', 100, 1), 0)
+        time.sleep(0.02)
+        self.assertEqual(0, store.take('key', 100, 1))
+
+    def test_memory_store_maxsize(self):
+        store = MemoryRateLimitStore(maxsize=2)
+        for key in ('first', 'second', 'third'):
+            store.take(key, 1, 1)
+        self.assertEqual(0, store.take('first', 1, 1))
+
+    def test_client_ip(self):
+        self.assertEqual('10.0.0.1', get_client_ip('10.0.0.1', '1.2.3.4', 0))
+        self.assertEqual('5.6.7.8', get_client_ip('10.0.0.1', '1.2.3.4, 5.6.7.8', 1))
+        self.assertEqual('1.2.3.4', get_client_ip('10.0.0.1', '1.2.3.4, 5.6.7.8', 2))
+        self.assertEqual('10.0.0.1', get_client_ip('10.0.0.1', '1.2.3.4', 2))
+
+    def test_identities(self):
+        self.assertEqual(['email:test@test.com'], get_identities({'email': 'Test@test.com'}, ('email', 'username')))
+        self.assertEqual([], get_identities(['email'], ('email',)))
+
+
+class TestRateLimiting(BaseTestCase):
+    """Tests for the rate limited routes."""
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['RATELIMIT_ENABLED'] = True
+
+    def tearDown(self):
+        self.app.config['RATELIMIT_ENABLED'] = False
+        self.app.config['RATELIMIT_IP_BURST'] = 20
+        self.app.config['AUTH_CONCURRENCY_LIMIT'] = 8
+        limiter.clear()
+        super().tearDown()
+
+    def test_login_limited_per_email(self):
+        """Ensure an account can't be brute forced, while other accounts can log in"""
+        add_user('test', 'test@test.com', 'test')
+        add_user('other', 'other@test.com', 'other')
+        for _ in range(self.app.config['RATELIMIT_IDENTITY_BURST']):
+            self.login(json.dumps(dict(email='TEST@test.com', password='wrong')))
+        response = self.login(json.dumps(LOGIN_USER_BASIC))
+        self.assertEqual(429, response.status_code)
+        self.assertEqual('Too many requests, please try again later.', response.json['message'])
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+        response = self.login(json.dumps(dict(email='other@test.com', password='other')))
+        self.assertEqual(200, response.status_code)
+
+    def test_register_limited_per_ip(self):
+        """Ensure a client can't hash passwords faster than its bucket refills"""
+        self.app.config['RATELIMIT_IP_BURST'] = 2
+        for i in range(2):
+            response = self.register(json.dumps(dict(username='test{}'.format(i), email='test{}@test.com'.format(i), password='test')))
+            self.assertEqual(201, response.status_code)
+        response = self.register(json.dumps(USER_BASIC))
+        self.assertEqual(429, response.status_code)
+        response = self.client.post(
+            '/auth/register',
+            data=json.dumps(USER_BASIC),
+            content_type='application/json',
+            environ_base={'REMOTE_ADDR': '10.0.0.2'}
+        )
+        self.assertEqual(201, response.status_code)
+
+    def test_load_shedding(self):
+        """Ensure password hashing routes are shed once all slots are taken, cheap reads still served"""
+        user = add_user('test', 'test@test.com', 'test')
+        self.app.config['AUTH_CONCURRENCY_LIMIT'] = 1
+        self.assertTrue(limiter.acquire())
+        try:
+            response = self.login(json.dumps(LOGIN_USER_BASIC))
+            self.assertEqual(503, response.status_code)
+            self.assertEqual('1', response.headers['Retry-After'])
+            response = self.post_user(json.dumps(USER_DUPLICATE_EMAIL))
+            self.assertEqual(503, response.status_code)
+            self.assertEqual(200, self.client.get('/ping').status_code)
+            self.assertEqual(200, self.client.get('/users/{}'.format(user.id)).status_code)
+        finally:
+            limiter.release()
+        self.assertEqual(200, self.login(json.dumps(LOGIN_USER_BASIC)).status_code)
@@ -0,0 +1,112 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app.api.revocation import BloomFilter, MemoryDenylistStore, TokenDenylist
+
+
+class TestRevocation(unittest.TestCase):
+    """Tests for the token denylist."""
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add('revoked{}'.format(i))
+        self.assertTrue(all('revoked{}'.format(i) in bloom for i in range(1000)))
+        false_positives = sum('valid{}'.format(i) in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_memory_store_expiry(self):
+        store = MemoryDenylistStore()
+        store.add('expired', time.time() - 1)
+        store.add('revoked', time.time() + 60)
+        self.assertFalse(store.contains('expired'))
+        self.assertTrue(store.contains('revoked'))
+        self.assertEqual(['revoked'], store.active())
+        self.assertEqual(['revoked'], store.added_since(time.time() - 10))
+        self.assertEqual([], store.added_since(time.time() + 10))
+        self.assertTrue(store.add_if_absent('expired', time.time() + 60))
+        self.assertFalse(store.add_if_absent('revoked', time.time() + 60))
+
+    def test_denylist(self):
+        denylist = TokenDenylist()
+        denylist.revoke('revoked', time.time() + 60)
+        denylist.revoke('expired', time.time() - 1)
+        self.assertTrue(denylist.is_revoked('revoked'))
+        self.assertFalse(denylist.is_revoked('expired'))
+        self.assertFalse(denylist.is_revoked('valid'))
+
+    def test_claim(self):
+        """Ensure only one of concurrent claims of a token succeeds"""
+        denylist = TokenDenylist()
+        barrier = threading.Barrier(8)
+        claimed = []
+
+        def claim():
+            barrier.wait()
+            claimed.append(denylist.claim('refresh', time.time() + 60))
+        threads = [threading.Thread(target=claim) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([True], [result for result in claimed if result])
+        self.assertTrue(denylist.is_revoked('refresh'))
+
+    def test_denylist_sync(self):
+        """Ensure tokens revoked by another process are picked up by the syncing thread"""
+        denylist = TokenDenylist()
+        denylist.sync_seconds = 0.01
+        denylist.store.add('revoked', time.time() + 60)
+        self.assertTrue(self.wait_for(lambda: denylist.is_revoked('revoked')))
+
+    def test_denylist_sync_incremental(self):
+        """Ensure syncs only read what was added since the previous one, and rebuilds drop expired entries"""
+        denylist = TokenDenylist()
+        denylist.store.add('old', time.time() + 60)
+        denylist.sync()
+        denylist.store.add('new', time.time() + 60)
+        with mock.patch.object(denylist.store, 'active', side_effect=AssertionError):
+            denylist.sync()
+        self.assertTrue(denylist.is_revoked('new'))
+        self.assertEqual(2, denylist._count)
+        denylist.store._entries['old'] = time.time() - 1
+        denylist.rebuild_seconds = 0
+        denylist.sync()
+        self.assertEqual(1, denylist._count)
+        self.assertNotIn('old', denylist._filter)
+
+    def test_denylist_revoked_during_rebuild(self):
+        """Ensure a token revoked while the filter is rebuilt from the store stays in the new filter"""
+        denylist = TokenDenylist()
+        active = denylist.store.active
+
+        def revoke_meanwhile():
+            jtis = active()
+            denylist.revoke('meanwhile', time.time() + 60)
+            return jtis
+        with mock.patch.object(denylist.store, 'active', side_effect=revoke_meanwhile):
+            denylist.sync()
+        self.assertIn('meanwhile', denylist._filter)
+
+    def test_denylist_sync_off_request_threads(self):
+        """Ensure checks never wait for the filter to be rebuilt"""
+        denylist = TokenDenylist()
+        threads = []
+        with mock.patch.object(denylist, 'sync', side_effect=lambda: threads.append(threading.current_thread())):
+            self.assertFalse(denylist.is_revoked('valid'))
+            self.assertTrue(self.wait_for(lambda: threads))
+            self.assertFalse(denylist.is_revoked('valid'))
+        self.assertNotIn(threading.current_thread(), threads)
+
+    @staticmethod
+    def wait_for(condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_create_store(self):
+        self.assertIsInstance(TokenDenylist.create_store(''), MemoryDenylistStore)
+        self.assertRaises(ValueError, TokenDenylist.create_store, 'memcached://localhost')
@@ -0,0 +1,106 @@
+import asyncio
+import datetime
+import json
+
+from sqlalchemy.orm.exc import NoResultFound
+
+from app import db, recent_writes
+from app.api.asgi import create_asgi_app
+from app.api.consistency import WRITE_MARKER_HEADER
+from app.api.models import User
+from tests.base import BaseTestCase
+from tests.utils import add_user
+
+REPLICA_BINDS = {'replica_0': 'sqlite://', 'replica_1': 'sqlite://'}
+
+
+class TestReplicaRouting(BaseTestCase):
+    """Tests for the read replica routing."""
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['SQLALCHEMY_BINDS'] = REPLICA_BINDS
+        # each in memory replica is its own, empty, database
+        for bind in REPLICA_BINDS:
+            User.__table__.create(db.get_engine(self.app, bind=bind))
+
+    def tearDown(self):
+        self.app.config['DATABASE_REPLICA_RETRY_MISSES'] = False
+        for bind in REPLICA_BINDS:
+            User.__table__.drop(db.get_engine(self.app, bind=bind))
+        self.app.config['SQLALCHEMY_BINDS'] = {}
+        recent_writes.clear()
+        super().tearDown()
+
+    def add_replica_user(self, bind, username):
+        db.get_engine(self.app, bind=bind).execute(User.__table__.insert(), {
+            'username': username,
+            'email': username + '@example.com',
+            'password': 'test',
+            'active': True,
+            'created_at': datetime.datetime.utcnow()
+        })
+
+    def test_listing_round_robin(self):
+        """Ensures listings alternate between replicas"""
+        self.add_replica_user('replica_0', 'replica0')
+        self.add_replica_user('replica_1', 'replica1')
+        usernames = {User.get_all_users()[0]['username'] for _ in range(2)}
+        self.assertEqual({'replica0', 'replica1'}, usernames)
+
+    def test_read_your_writes(self):
+        """Ensures a freshly written user is read from the primary"""
+        user = add_user('test', 'test@test.com', 'test')
+        self.assertEqual('test', User.get_by_id(user.id)['username'])
+        self.assertEqual(user.id, User.login('test@test.com', 'test').id)
+
+    def test_replica_misses(self):
+        """Ensures lookups the replicas miss aren't retried on the primary by default"""
+        add_user('test', 'test@test.com', 'test')
+        recent_writes.clear()
+        self.assertRaises(NoResultFound, User.login, 'test@test.com', 'test')
+        self.assertEqual(({}, [1]), User.get_by_ids([1]))
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        """Ensures lookups the replicas miss are retried on the primary with DATABASE_REPLICA_RETRY_MISSES"""
+        self.app.config['DATABASE_REPLICA_RETRY_MISSES'] = True
+        user = add_user('test', 'test@test.com', 'test')
+        recent_writes.clear()
+        self.assertEqual(user.id, User.login('test@test.com', 'test').id)
+        self.assertEqual([user.id], list(User.get_by_ids([user.id])[0]))
+        self.assertEqual([], User.get_all_users())
+
+    def test_read_your_writes_across_workers(self):
+        """Ensures a client that just registered logs in through any worker, its marker sending it to the primary"""
+        response = self.client.post('/auth/register', data=json.dumps({
+            'username': 'test', 'email': 'test@test.com', 'password': 'test'
+        }), content_type='application/json')
+        self.assertEqual(201, response.status_code)
+        marker = response.headers[WRITE_MARKER_HEADER]
+        # as seen by another worker, which didn't record the write
+        recent_writes.clear()
+        login = json.dumps({'email': 'test@test.com', 'password': 'test'})
+        self.assertEqual(200, self.client.post('/auth/login', data=login, content_type='application/json').status_code)
+        other_client = self.app.test_client()
+        self.assertEqual(404, other_client.post('/auth/login', data=login, content_type='application/json').status_code)
+        self.assertEqual(200, other_client.post('/auth/login', data=login, content_type='application/json', headers={
+            WRITE_MARKER_HEADER: marker
+        }).status_code)
+        self.assertEqual(404, other_client.post('/auth/login', data=login, content_type='application/json', headers={
+            WRITE_MARKER_HEADER: marker + 'forged'
+        }).status_code)
+        asgi_app = create_asgi_app(self.app)
+        for cookie, expected in [('last_write=' + marker, 200), ('', 404)]:
+            sent = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': login.encode(), 'more_body': False}
+
+            async def send(message):
+                sent.append(message)
+            asyncio.run(asgi_app({
+                'type': 'http', 'method': 'POST', 'path': '/auth/login', 'query_string': b'',
+                'headers': [(b'content-type', b'application/json'), (b'cookie', cookie.encode())]
+            }, receive, send))
+            self.assertEqual(expected, sent[0]['status'])
+        asyncio.run(asgi_app.shutdown())
@@ -0,0 +1,129 @@
+import os
+import unittest
+from unittest import mock
+
+from app import db
+from app.api.explain import explain_queries
+from app.api.models import User
+from app.api.search import (
+    SearchIndex, SearchTimeout, decode_search_cursor, encode_search_cursor, similarity, trigrams
+)
+from tests.base import BaseTestCase
+from tests.utils import add_user
+
+USERS = [
+    {'id': 1, 'username': 'johnny', 'email': 'jd@example.com', 'created_at': None, 'active': True},
+    {'id': 2, 'username': 'Alice', 'email': 'alice@example.com', 'created_at': None, 'active': True},
+    {'id': 3, 'username': 'bob', 'email': 'bob@johnson.org', 'created_at': None, 'active': True},
+    {'id': 4, 'username': 'jonny', 'email': 'jonny@example.com', 'created_at': None, 'active': True},
+]
+
+
+class TestSearchIndex(unittest.TestCase):
+    """Tests for the in-process user search index."""
+
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.refresh(lambda: 1, lambda: USERS)
+
+    def test_trigrams(self):
+        self.assertEqual({'  c', ' ca', 'cat', 'at '}, trigrams('Cat'))
+        self.assertEqual(1, similarity(trigrams('word'), trigrams('WORD')))
+        self.assertEqual(0, similarity(trigrams('abc'), trigrams('xyz')))
+
+    def test_search(self):
+        """Ensure usernames and emails containing the query, and similar usernames, match in username order"""
+        users, position = self.index.search('JOHN', 10, 0.3)
+        self.assertEqual(['bob', 'johnny'], [user['username'] for user in users])
+        self.assertIsNone(position)
+        users, _ = self.index.search('jony', 10, 0.3)
+        self.assertEqual(['johnny', 'jonny'], [user['username'] for user in users])
+
+    def test_search_pages(self):
+        users, position = self.index.search('example', 2, 0.3)
+        self.assertEqual(['Alice', 'johnny'], [user['username'] for user in users])
+        self.assertEqual(('johnny', 1), position)
+        users, position = self.index.search('example', 2, 0.3, decode_search_cursor(encode_search_cursor(*position)))
+        self.assertEqual(['jonny'], [user['username'] for user in users])
+        self.assertIsNone(position)
+
+    def test_search_budget(self):
+        """Ensure a search running out of time returns where it stopped"""
+        index = SearchIndex()
+        index.refresh(lambda: 1, lambda: [
+            {'id': i, 'username': 'user{:05d}'.format(i), 'email': 'user{}@example.com'.format(i)} for i in range(2000)
+        ])
+        index.CHECK_EVERY = 1
+        users, position = index.search('nobody', 10, 0.9, budget_ms=1e-6)
+        self.assertEqual([], users)
+        self.assertIsNotNone(position)
+
+    def test_refresh(self):
+        self.index.refresh(lambda: 1, lambda: [])
+        self.assertEqual(2, len(self.index.search('john', 10, 0.3)[0]))
+        self.index.refresh(lambda: 2, lambda: USERS[:1])
+        self.assertEqual(1, len(self.index.search('john', 10, 0.3)[0]))
+
+    def test_refresh_interval(self):
+        """Ensure the version isn't even checked again within the refresh interval"""
+        get_version = mock.Mock(return_value=3)
+        self.index.refresh(get_version, lambda: [], 60)
+        get_version.assert_not_called()
+        self.index.clear()
+        self.index.refresh(get_version, lambda: USERS[:1], 60)
+        self.index.refresh(get_version, lambda: [], 60)
+        self.assertEqual(1, get_version.call_count)
+        self.assertEqual(1, len(self.index.search('john', 10, 0.3)[0]))
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            decode_search_cursor('invalid')
+
+
+@unittest.skipUnless(
+    (os.environ.get('TEST_DATABASE_URL') or '').startswith('postgres'), 'pg_trgm needs a Postgres test database'
+)
+class TestTrigramSearch(BaseTestCase):
+    """Tests for the pg_trgm user search, run against a Postgres test database only."""
+
+    def setUp(self):
+        super().setUp()
+        db.session.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        db.session.commit()
+        for user in USERS:
+            add_user(user['username'], user['email'], 'test')
+        add_user('under_score', 'us@example.com', 'test')
+
+    def tearDown(self):
+        self.app.config['USERS_SEARCH_BUDGET_MS'] = 100
+        super().tearDown()
+
+    def usernames(self, users):
+        return [user['username'] for user in users]
+
+    def test_search(self):
+        """Ensure usernames and emails containing the query, and similar usernames, match in username order"""
+        users, next_cursor = User.search('JOHN', 1)
+        self.assertEqual(['bob'], self.usernames(users))
+        users, next_cursor = User.search('JOHN', 10, next_cursor)
+        self.assertEqual(['johnny'], self.usernames(users))
+        self.assertIsNone(next_cursor)
+        self.assertEqual(['johnny', 'jonny'], self.usernames(User.search('jony', 10)[0]))
+
+    def test_search_escapes_like_patterns(self):
+        self.assertEqual(['under_score'], self.usernames(User.search('_', 10)[0]))
+        self.assertEqual([], User.search('%', 10)[0])
+
+    def test_search_timeout(self):
+        """Ensure searches running past USERS_SEARCH_BUDGET_MS are canceled by the statement timeout"""
+        query_data = User.query_data
+        self.app.config['USERS_SEARCH_BUDGET_MS'] = 10
+        with mock.patch.object(User, 'query_data', side_effect=lambda: query_data().add_columns(db.func.pg_sleep(0.1))):
+            self.assertRaises(SearchTimeout, User.search, 'john', 10)
+        self.assertEqual(['bob', 'johnny'], self.usernames(User.search('john', 10)[0]))
+
+    def test_search_explained(self):
+        """Ensure manage.py explain plans the trigram search queries"""
+        plans = dict(explain_queries())
+        self.assertTrue(plans['search'])
+        self.assertTrue(plans['search (cursor)'])
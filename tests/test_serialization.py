@@ -0,0 +1,45 @@
+import datetime
+import json
+import unittest
+
+from app.api import serialization
+from app.api.serialization import compile_row_encoder, dumps, set_backend
+
+USER_FIELDS = ('id', 'username', 'email', 'created_at', 'active')
+USER_ROW = (1, 'test', 'tést"@test.com', datetime.datetime(2017, 9, 17, 15, 5, 28, 727297), True)
+
+
+class TestSerialization(unittest.TestCase):
+    """Tests for the JSON serialisation layer."""
+
+    def tearDown(self):
+        set_backend('auto')
+
+    def test_backends_agree(self):
+        """Ensures every installed backend produces the same output"""
+        outputs = set()
+        for backend, encoder in serialization.BACKENDS.items():
+            if encoder:
+                set_backend(backend)
+                outputs.add(dumps(dict(zip(USER_FIELDS, USER_ROW))))
+        self.assertEqual(1, len(outputs))
+
+    def test_datetime_iso_8601(self):
+        """Ensures naive datetimes are formatted as ISO-8601 UTC"""
+        set_backend('json')
+        self.assertEqual(
+            '"2017-09-17T15:05:28.727297+00:00"',
+            dumps(datetime.datetime(2017, 9, 17, 15, 5, 28, 727297))
+        )
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, set_backend, 'unknown')
+
+    def test_row_encoder(self):
+        """Ensures rows are encoded as the dicts they stand for"""
+        encode = compile_row_encoder(USER_FIELDS)
+        self.assertEqual(
+            json.loads(dumps(dict(zip(USER_FIELDS, USER_ROW)))),
+            json.loads(encode(USER_ROW))
+        )
+        self.assertEqual({'id': 2, 'email': None}, json.loads(compile_row_encoder(('id', 'email'))((2, None))))
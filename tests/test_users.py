@@ -1,5 +1,9 @@
 import json
 import datetime
+from unittest import mock
+
+from app import db, hasher
+from app.api.models import User
 from tests.base import BaseTestCase
 from tests.utils import add_user
 from tests.constants import *
@@ -60,6 +64,29 @@ class TestUserService(BaseTestCase):
         self.assertIn('User already exists.', data['message'])
         self.assertIn('fail', data['status'])
 
+    def test_add_user_invalid_email(self):
+        """Ensure malformed emails are rejected"""
+        response = self.post_user(json.dumps(USER_INVALID_EMAIL))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid payload.', response.json['message'])
+
+    def test_add_user_payload_too_large(self):
+        """Ensure oversized payloads are rejected before being parsed"""
+        response = self.post_user(json.dumps(dict(USER_BASIC, password='x' * 5000)))
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('Payload too large.', response.json['message'])
+        self.assertIn('fail', response.json['status'])
+
+    def test_add_user_duplicate_user_not_hashed(self):
+        """Ensure taken usernames and emails are rejected without hashing the password"""
+        self.post_user(json.dumps(USER_BASIC))
+        with mock.patch.object(hasher, 'generate_password_hash', wraps=hasher.generate_password_hash) as hash_password:
+            response = self.post_user(json.dumps(USER_DUPLICATE_EMAIL))
+            self.assertEqual(response.status_code, 409)
+            response = self.post_user(json.dumps(USER_INVALID_EMAIL))
+            self.assertEqual(response.status_code, 400)
+            hash_password.assert_not_called()
+
     def test_get_user(self):
         """Ensure we can get a single user based on its ID"""
         # add a user for this test.
@@ -69,6 +96,7 @@ class TestUserService(BaseTestCase):
             data = json.loads(response.data.decode())
             self.assertEqual(response.status_code, 200)
             self.assertTrue('created_at' in data['data'])
+            self.assertTrue(data['data']['created_at'].endswith('+00:00'))
             self.assertIn('testuser', data['data']['username'])
             self.assertIn('user@example.com', data['data']['email'])
             self.assertIn('success', data['status'])
@@ -146,3 +174,228 @@ class TestUserService(BaseTestCase):
             self.assertIn(b'<h1>All Users</h1>', response.data)
             self.assertNotIn(b'<p>No users!</p>', response.data)
             self.assertIn(b'<strong>testuser</strong>', response.data)
+
+    def test_main_add_user_invalid(self):
+        """Ensure the HTML form is validated, and duplicates rejected, like JSON payloads"""
+        add_user('testuser', 'user@example.com', 'test')
+        for form, status in (
+            (dict(username='testuser2', email='user@example.com', password='test'), 409),
+            (dict(username='', email='user2@example.com', password='test'), 400),
+            (dict(username='testuser2', email='notanemail', password='test'), 400),
+            (dict(username='testuser2', email='user2@example.com'), 400),
+        ):
+            with self.client:
+                response = self.client.post('/users', data=form)
+                self.assertEqual(status, response.status_code)
+                self.assertEqual('fail', json.loads(response.data.decode())['status'])
+        self.assertEqual(1, len(User.get_all_users()))
+
+    def test_get_users_paginated(self):
+        """Ensure users can be retrieved one page at a time"""
+        created = datetime.datetime.utcnow() + datetime.timedelta(-30)
+        add_user('testuser', 'user@example.com', 'test')
+        add_user('testuser2', 'user2@example.com', 'test', created)
+        with self.client:
+            response = self.client.get('/users?limit=1')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(data['data']['users']), 1)
+            self.assertIn('testuser', data['data']['users'][0]['username'])
+            self.assertTrue(data['data']['next_cursor'])
+            response = self.client.get(f'/users?limit=1&cursor={data["data"]["next_cursor"]}')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(data['data']['users']), 1)
+            self.assertIn('testuser2', data['data']['users'][0]['username'])
+            self.assertIsNone(data['data']['next_cursor'])
+
+    def test_get_users_invalid_pagination(self):
+        """Ensure an error is thrown when the pagination parameters are invalid"""
+        with self.client:
+            for query in ('limit=0', 'limit=invalid', 'cursor=invalid', 'stream=xml'):
+                response = self.client.get(f'/users?{query}')
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('fail', data['status'])
+                self.assertIn('Invalid pagination parameters.', data['message'])
+
+    def test_get_users_stream_ndjson(self):
+        """Ensure all users can be streamed as NDJSON"""
+        add_user('testuser', 'user@example.com', 'test')
+        add_user('testuser2', 'user2@example.com', 'test')
+        with self.client:
+            response = self.client.get('/users?stream=ndjson')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content_type, 'application/x-ndjson')
+            users = [json.loads(line) for line in response.data.decode().splitlines()]
+            self.assertEqual(len(users), 2)
+            self.assertEqual({'testuser', 'testuser2'}, {user['username'] for user in users})
+
+    def test_get_users_stream_json(self):
+        """Ensure all users can be streamed as a JSON array"""
+        add_user('testuser', 'user@example.com', 'test')
+        add_user('testuser2', 'user2@example.com', 'test')
+        with self.client:
+            response = self.client.get('/users?stream=json')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('success', data['status'])
+            self.assertEqual(len(data['data']['users']), 2)
+
+    def test_bulk_add_users(self):
+        """Ensure many users can be added at once, reporting the rows that failed"""
+        add_user('testuser', 'user@example.com', 'test')
+        users = [
+            dict(username='bulk1', email='bulk1@example.com', password='test'),
+            dict(username='testuser', email='other@example.com', password='test'),
+            dict(username='bulk2', email='bulk2@example.com', password='test'),
+            dict(username='bulk2', email='bulk3@example.com', password='test'),
+            dict(username='bulk4', email='bulk4@example.com'),
+        ]
+        with self.client:
+            response = self.client.post('/users/bulk', data=json.dumps(users), content_type='application/json')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('success', data['status'])
+            self.assertEqual(2, data['data']['created'])
+            self.assertEqual([
+                {'index': 1, 'message': 'User already exists.'},
+                {'index': 3, 'message': 'User already exists.'},
+                {'index': 4, 'message': 'Invalid payload.'},
+            ], data['data']['errors'])
+            response = self.client.get('/users')
+            self.assertEqual(3, len(json.loads(response.data.decode())['data']['users']))
+
+    def test_bulk_add_users_ndjson(self):
+        """Ensure many users can be added at once from an NDJSON stream"""
+        lines = [
+            json.dumps(dict(username='bulk1', email='bulk1@example.com', password='test')),
+            'invalid',
+            json.dumps(dict(username='bulk2', email='bulk2@example.com', password='test')),
+        ]
+        with self.client:
+            response = self.client.post(
+                '/users/bulk',
+                data='\n'.join(lines) + '\n',
+                content_type='application/x-ndjson'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(2, data['data']['created'])
+            self.assertEqual([{'index': 1, 'message': 'Invalid payload.'}], data['data']['errors'])
+
+    def test_bulk_add_users_invalid_payload(self):
+        """Ensure an error is thrown when the bulk payload is not a list"""
+        with self.client:
+            response = self.client.post('/users/bulk', data=json.dumps(USER_BASIC), content_type='application/json')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid payload.', data['message'])
+
+    def test_get_active_users(self):
+        """Ensure users can be filtered on their active flag"""
+        add_user('testuser', 'user@example.com', 'test')
+        user = add_user('testuser2', 'user2@example.com', 'test')
+        user.active = False
+        db.session.commit()
+        with self.client:
+            response = self.client.get('/users?active=true')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(['testuser'], [user['username'] for user in data['data']['users']])
+            response = self.client.get('/users?active=false')
+            data = json.loads(response.data.decode())
+            self.assertEqual(['testuser2'], [user['username'] for user in data['data']['users']])
+
+    def test_get_users_by_ids(self):
+        """Ensure many users are fetched at once, in the requested order, missing ids reported"""
+        first = add_user('first', 'first@example.com', 'test')
+        second = add_user('second', 'second@example.com', 'test')
+        self.assertEqual(User.get_by_id(first.id), User.get_by_ids([first.id])[0][first.id])
+        response = self.client.get('/users?ids={},999,{},{}'.format(second.id, first.id, second.id))
+        self.assertEqual(response.status_code, 200)
+        data = response.json['data']
+        self.assertEqual([str(second.id), str(first.id)], list(data['users']))
+        self.assertEqual('second', data['users'][str(second.id)]['username'])
+        self.assertEqual([999], data['missing'])
+        response = self.client.post(
+            '/users/lookup',
+            data=json.dumps({'ids': [first.id, 999]}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([str(first.id)], list(response.json['data']['users']))
+        self.assertEqual([999], response.json['data']['missing'])
+
+    def test_get_users_by_ids_invalid(self):
+        """Ensure malformed and oversized id lists are rejected"""
+        for ids in ('', 'a', '1,,2', '-1', str(2 ** 31), ','.join(['1'] * 101)):
+            response = self.client.get('/users', query_string={'ids': ids})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('fail', response.json['status'])
+        for payload in ({'ids': [1.5]}, {'ids': [True]}, {'ids': 1}, [1]):
+            response = self.client.post('/users/lookup', data=json.dumps(payload), content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_search_users(self):
+        """Ensure users are found by part of their username or email, one page at a time"""
+        add_user('johnny', 'jd@example.com', 'test')
+        add_user('alice', 'alice@example.com', 'test')
+        add_user('bob', 'bob@johnson.org', 'test')
+        response = self.client.get('/users/search?q=John&limit=1')
+        self.assertEqual(response.status_code, 200)
+        data = response.json['data']
+        self.assertEqual(['bob'], [user['username'] for user in data['users']])
+        response = self.client.get('/users/search', query_string={'q': 'John', 'cursor': data['next_cursor']})
+        self.assertEqual(['johnny'], [user['username'] for user in response.json['data']['users']])
+        self.assertIsNone(response.json['data']['next_cursor'])
+        add_user('johnson', 'johnson@example.com', 'test')
+        response = self.client.get('/users/search?q=john')
+        self.assertEqual(['bob', 'johnny', 'johnson'], [user['username'] for user in response.json['data']['users']])
+
+    def test_search_users_invalid(self):
+        for query_string in ({}, {'q': ' '}, {'q': 'x' * 129}, {'q': 'a', 'cursor': 'x'}, {'q': 'a', 'limit': 0}):
+            response = self.client.get('/users/search', query_string=query_string)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid search parameters.', response.json['message'])
+
+    def test_single_user_etag(self):
+        """Ensure a user can be revalidated with its ETag"""
+        user = add_user('test', 'test@test.com', 'test')
+        response = self.client.get('/users/{}'.format(user.id))
+        etag = response.headers['ETag']
+        self.assertEqual('public, no-cache', response.headers['Cache-Control'])
+        response = self.client.get('/users/{}'.format(user.id), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(b'', response.data)
+        self.assertEqual(etag, response.headers['ETag'])
+        user.username = 'updated'
+        db.session.commit()
+        response = self.client.get('/users/{}'.format(user.id), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(etag, response.headers['ETag'])
+        self.assertEqual('updated', response.json['data']['username'])
+
+    def test_all_users_etag(self):
+        """Ensure listings are revalidated against the users table version"""
+        add_user('test', 'test@test.com', 'test')
+        response = self.client.get('/users?limit=10')
+        etag = response.headers['ETag']
+        self.assertIn('Accept', response.headers['Vary'].split(', '))
+        response = self.client.get('/users?limit=10', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/users?limit=20', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        add_user('test2', 'test2@test.com', 'test')
+        response = self.client.get('/users?limit=10', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(2, len(response.json['data']['users']))
+        etag = response.headers['ETag']
+        self.client.post(
+            '/users/bulk',
+            data=json.dumps([{'username': 'bulk', 'email': 'bulk@test.com', 'password': 'test'}]),
+            content_type='application/json'
+        )
+        response = self.client.get('/users?limit=10', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(3, len(response.json['data']['users']))
@@ -1,10 +1,15 @@
+import io
+import os
 import time
+from unittest import mock
 
 import jwt.exceptions
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
 
-from app import db
-from app.api.models import User
+from app import db, token_cache, user_cache
+from app.api.importing import iter_records
+from app.api.models import TableVersion, User, UserAlreadyExists
 from tests.base import BaseTestCase
 from tests.utils import add_user
 
@@ -41,6 +46,56 @@ class TestUserModel(BaseTestCase):
         db.session.add(duplicate_user)
         self.assertRaises(IntegrityError, db.session.commit)
 
+    def test_create_user(self):
+        """Ensure created users are returned without reading them back"""
+        version = User.get_users_version()
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            data = User.create('test', 'test@mail.com', 'test')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        inserted = [i for i, statement in enumerate(statements) if statement.startswith('INSERT INTO users')]
+        self.assertEqual(1, len(inserted))
+        self.assertFalse([statement for statement in statements[inserted[0]:] if statement.startswith('SELECT')])
+        self.assertEqual(User.get_by_id(data['id']), data)
+        self.assertEqual('test', User.login('test@mail.com', 'test').username)
+        self.assertGreater(User.get_users_version(), version)
+
+    def test_create_duplicate_user(self):
+        User.create('test', 'test@mail.com', 'test')
+        self.assertRaises(UserAlreadyExists, User.create, 'test', 'test@mail2.com', 'test')
+        self.assertRaises(UserAlreadyExists, User.create, 'test2', 'test@mail.com', 'test')
+        self.assertRaises(ValueError, User.create, '', 'test@mail3.com', 'test')
+
+    def test_emails_unique_whatever_their_case(self):
+        """Ensure emails differing only by case can't both be registered, as logins wouldn't tell them apart"""
+        data = User.create('test', 'Test@Mail.com', 'test')
+        self.assertEqual('test@mail.com', data['email'])
+        self.assertRaises(UserAlreadyExists, User.create, 'test2', 'TEST@mail.com', 'test')
+        db.session.add(User(username='test3', email='tEst@mail.com', password='test'))
+        self.assertRaises(IntegrityError, db.session.commit)
+        db.session.rollback()
+        self.assertRaises(IntegrityError, db.session.execute, User.__table__.insert(), {
+            'username': 'test4', 'email': 'TEST@MAIL.COM', 'password': 'test', 'active': True,
+            'created_at': data['created_at'], 'updated_at': data['created_at']
+        })
+
+    def test_table_version_shards(self):
+        """Ensure the versions bumped by several threads add up, their rows being created by their first write"""
+        shards = {hash((os.getpid(), ident)) % TableVersion.SHARDS: ident for ident in range(1000)}
+        idents = list(shards.values())[:3]
+        for ident in idents + idents[:1]:
+            with mock.patch('threading.get_ident', return_value=ident):
+                TableVersion.bump('test')
+        db.session.commit()
+        self.assertEqual(4, TableVersion.get('test'))
+        self.assertEqual(3, TableVersion.query.filter(TableVersion.name == 'test').count())
+        self.assertEqual(0, TableVersion.get('other'))
+
     def test_passwords_are_random(self):
         user_one = add_user('test', 'test@test.com', 'test')
         user_two = add_user('test2', 'test@test2.com', 'test')
@@ -68,3 +123,52 @@ class TestUserModel(BaseTestCase):
         auth_token = user.encode_auth_token(user.id)
         time.sleep(3)
         self.assertEqual(str(user.decode_auth_token(auth_token)), 'Expired token, please login again.')
+
+    def test_decode_auth_token_cached(self):
+        """Ensures a decoded token is served from the token cache"""
+        user = add_user('test', 'test@test.com', 'test')
+        auth_token = user.encode_auth_token(user.id)
+        self.assertEqual(user.id, User.decode_auth_token(auth_token))
+        self.assertEqual(1, len(token_cache))
+        self.assertEqual(user.id, User.decode_auth_token(auth_token))
+
+    def test_get_by_id_cache_invalidated(self):
+        """Ensures a cached user is invalidated when written"""
+        user = add_user('test', 'test@test.com', 'test')
+        self.assertEqual('test', User.get_by_id(user.id)['username'])
+        self.assertIsNotNone(user_cache.get(user.id))
+        user.username = 'updated'
+        db.session.commit()
+        self.assertIsNone(user_cache.get(user.id))
+        self.assertEqual('updated', User.get_by_id(user.id)['username'])
+
+    def test_login_rehashes_password(self):
+        """Ensures a password hashed with another cost is rehashed on login"""
+        user = add_user('test', 'test@test.com', 'test')
+        self.assertTrue(user.password.startswith('$2b$04$'))
+        self.app.config['BCRYPT_LOG_ROUNDS'] = 5
+        try:
+            User.login('test@test.com', 'test')
+        finally:
+            self.app.config['BCRYPT_LOG_ROUNDS'] = 4
+        db.session.expire_all()
+        self.assertTrue(User.query.get(user.id).password.startswith('$2b$05$'))
+        self.assertEqual(user.id, User.login('test@test.com', 'test').id)
+
+    def test_bulk_create_across_batches(self):
+        """Ensures duplicates are reported across batches"""
+        records = iter_records(io.StringIO(
+            '[{"username": "test", "email": "test@test.com", "password": "test"},'
+            ' {"username": "test2", "email": "test@test.com", "password": "test"}]'
+        ))
+        created, errors = User.bulk_create(records, batch_size=1)
+        self.assertEqual(1, created)
+        self.assertEqual([{'index': 1, 'message': 'User already exists.'}], errors)
+
+    def test_query_data(self):
+        """Ensures the projected read path returns the same data as get_data()"""
+        user = add_user('test', 'test@test.com', 'test')
+        row = User.query_data().filter(User.id == user.id).one()
+        self.assertEqual(user.get_data(), User.row_to_data(row))
+        self.assertEqual(user.get_data(), User.get_by_id(user.id))
+        self.assertEqual([user.get_data()], User.get_all_users())
@@ -0,0 +1,32 @@
+import unittest
+
+from app.api.validation import compile_schema, validate_user
+
+
+class TestValidation(unittest.TestCase):
+    """Tests for the compiled payload schemas."""
+
+    def test_valid_payload(self):
+        payload = dict(username='test', email='test@test.com', password='test')
+        self.assertEqual(payload, validate_user(payload))
+
+    def test_invalid_payloads(self):
+        for payload in (
+            None,
+            ['test'],
+            dict(username='test', email='test@test.com'),
+            dict(username='test', email='test@test.com', password='test', active=False),
+            dict(username='', email='test@test.com', password='test'),
+            dict(username='test', email='test@', password='test'),
+            dict(username='test', email='test@test.com', password=1),
+            dict(username='t' * 129, email='test@test.com', password='test'),
+        ):
+            with self.assertRaises(ValueError):
+                validate_user(payload)
+
+    def test_compile_schema(self):
+        validate = compile_schema({'code': (2, 3, '[A-Z]+')})
+        self.assertEqual({'code': 'AB'}, validate({'code': 'AB'}))
+        for code in ('A', 'ABCD', 'ab'):
+            with self.assertRaises(ValueError):
+                validate({'code': code})